@@ -0,0 +1,36 @@
+"""
+    Batched animation of spheres and lights.
+
+    Both keep (t) (center xyz) (axis xyz) (radius) (velocity) in their
+    store's state columns, so any number of them can be advanced with
+    one NumPy expression, writing positions straight into the records
+    that get packed into objectData.
+"""
+
+from config import *
+
+def animate(store, indices, rate):
+    """
+        Advance the given rows of a store, moving each object along its axis:
+        position = center + radius * axis * sin(velocity * t)
+
+            Parameters:
+                store (storage.Store): SPHERES or LIGHTS
+                indices (np.ndarray): rows to advance
+                rate (float): time step
+
+            Returns:
+                the rows whose position changed
+    """
+
+    state = store.state[indices]
+    t = state[:, 0] + rate
+    store.state[indices, 0] = t
+
+    position = (
+        state[:, 1:4] + state[:, 7:8] * state[:, 4:7] * np.sin(state[:, 8] * t)[:, None]
+    ).astype(np.float32)
+    moved = np.any(position != store.records[indices, 0:3], axis = 1)
+    store.records[indices, 0:3] = position
+
+    return indices[moved]
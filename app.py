@@ -20,6 +20,10 @@ class App:
         pg.mouse.set_visible(False)
 
         self.graphicsEngine = engine.Engine(self.screenWidth, self.screenHeight)
+        #trace at whatever resolution fits the frame time budget and resolve
+        #up to the window's over time, which keeps refining still views too
+        self.graphicsEngine.useUpscaling = True
+        self.graphicsEngine.useAdaptiveResolution = True
         self.scene = scene.Scene()
 
         self.lastTime = pg.time.get_ticks()
@@ -84,13 +88,19 @@ class App:
         delta = self.currentTime - self.lastTime
         if (delta >= 1000):
             framerate = max(1,int(1000.0 * self.numFrames/delta))
-            pg.display.set_caption(f"Running at {framerate} fps.")
+            stats = self.graphicsEngine.resolutionStats()
+            width, height = stats["resolution"]
+            measured = stats["measuredMs"] or 0.0
+            pg.display.set_caption(
+                f"Running at {framerate} fps, tracing {width}x{height}"
+                f" in {measured:.1f} ms ({stats['timer']})."
+            )
             self.lastTime = self.currentTime
             self.numFrames = -1
             self.frameTime = float(1000.0 / max(1,framerate))
-            self.graphicsEngine.adaptResolution(framerate)
         self.numFrames += 1
 
     def quit(self):
         #self.graphicsEngine.destroy()
+        self.scene.destroy()
         pg.quit()
\ No newline at end of file
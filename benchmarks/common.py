@@ -0,0 +1,96 @@
+"""
+    What the benchmarks share: their arguments, a headless GL context,
+    the scene additions they measure with, and timing frames.
+
+    Importing it puts the repository root on sys.path, so the scripts
+    import it before any of the ray tracer's modules.
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import headless
+from config import *
+import sphere
+
+def argument_parser(doc):
+    """
+        Returns:
+            argparse.ArgumentParser described by the first line of a script's docstring
+    """
+
+    return argparse.ArgumentParser(description = doc.strip().splitlines()[0])
+
+def add_frame_size(parser, width = 800, height = 600):
+
+    parser.add_argument("--width", type = int, default = width)
+    parser.add_argument("--height", type = int, default = height)
+
+@contextlib.contextmanager
+def gl_context():
+    """
+        Surfaceless GL context for the duration of a with block, which
+        is handed the name of the renderer. Needs no window or GPU,
+        Mesa's llvmpipe is enough.
+    """
+
+    display, context = headless.create_context()
+    try:
+        yield glGetString(GL_RENDERER).decode()
+    finally:
+        headless.destroy_context(display, context)
+
+def add_spheres(level, count, seed = 0):
+    """
+        Scatter count small still spheres through the starting room.
+    """
+
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        level.spheres.append(sphere.Sphere(
+            center = (rng.uniform(1.1, 2.9), rng.uniform(1.1, 2.9), rng.uniform(0.05, 0.6)),
+            radius = 0.03,
+            color = rng.random(3),
+            roughness = 0.5,
+            axis = (0, 0, 1),
+            radius_of_motion = 0,
+            velocity = 0
+        ))
+    level.outDated = True
+
+def time_frames(renderer, level, frames, warmup = 1, rate = 1.0, step = None, synchronize = None):
+    """
+        Render warm-up frames, then time frames one at a time.
+        The first frame compiles, uploads the scene and warms caches,
+        so it's normally left out.
+
+            Parameters:
+                frames (int): frames to time
+                warmup (int): frames to render before them
+                rate (float): passed to the scene's update before each frame
+                step (function): called with the frame's number, counting the
+                    warm-up frames, before each frame, to move the camera
+                synchronize (function): called before reading the clock,
+                    such as glFinish to time work queued on a GPU
+
+            Returns:
+                (milliseconds of each timed frame, milliseconds of each warm-up frame)
+    """
+
+    times = []
+    for frame in range(warmup + frames):
+        if step is not None:
+            step(frame)
+        level.update(rate)
+        start = time.perf_counter()
+        renderer.renderScene(level)
+        if synchronize is not None:
+            synchronize()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times[warmup:], times[:warmup]
@@ -0,0 +1,68 @@
+"""
+    Ray tracer frame time against compute workgroup size.
+
+    Builds a headless engine.Engine for every local size and times frames
+    at each of its resolution levels.
+
+    Run from the repository root:
+    python benchmarks/dispatch.py [--sizes 1x1 8x8 16x16] [--levels 0 4 8] [--frames N]
+"""
+
+import common
+import headless
+from config import *
+import scene
+
+def parse_size(text):
+
+    x, _, y = text.partition("x")
+    return int(x), int(y or x)
+
+def time_levels(localSize, levels, frames, width, height):
+    """
+        Milliseconds per frame at each resolution level, for one local size.
+
+            Returns:
+                {level: (resolution, seconds)}
+    """
+
+    renderer = headless.HeadlessEngine(width, height, localSize = localSize)
+    level = scene.Scene()
+    timings = {}
+    try:
+        for resolutionLevel in levels:
+            if resolutionLevel >= len(renderer.resolutions):
+                continue
+            renderer.setResolutionLevel(resolutionLevel)
+            times, _ = common.time_frames(renderer, level, frames, synchronize = glFinish)
+            timings[resolutionLevel] = (renderer.resolutions[resolutionLevel], np.mean(times))
+    finally:
+        level.destroy()
+        renderer.destroy()
+
+    return timings
+
+def main():
+    parser = common.argument_parser(__doc__)
+    parser.add_argument("--sizes", nargs = "+", default = ["1x1", "4x4", "8x8", "16x16", "32x8"],
+                        help = "local sizes, XxY")
+    parser.add_argument("--levels", nargs = "+", type = int, default = None,
+                        help = "resolution levels, defaults to all of them")
+    parser.add_argument("--frames", type = int, default = 3, help = "timed frames per level")
+    common.add_frame_size(parser)
+    args = parser.parse_args()
+
+    levels = args.levels if args.levels is not None else range(64)
+    with common.gl_context() as rendererName:
+        print(rendererName)
+        results = {size: time_levels(parse_size(size), levels, args.frames, args.width, args.height)
+                   for size in args.sizes}
+
+    print(f"{'level':>5s} {'resolution':>10s}" + "".join(f"{size:>10s}" for size in args.sizes))
+    for resolutionLevel in sorted(next(iter(results.values()))):
+        (width, height), _ = results[args.sizes[0]][resolutionLevel]
+        row = "".join(f"{results[size][resolutionLevel][1]:8.1f}ms" for size in args.sizes)
+        print(f"{resolutionLevel:5d} {f'{width}x{height}':>10s}{row}")
+
+if __name__ == "__main__":
+    main()
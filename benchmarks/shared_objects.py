@@ -0,0 +1,62 @@
+"""
+    Ray tracer frame time with and without the shared memory object cache.
+
+    Times frames with every invocation unpacking objects from the objects
+    image, then with each workgroup loading them into shared memory
+    (engine.Engine's sharedObjects), with the hierarchy on and off.
+    Extra spheres can be scattered through the first room to make the
+    object set outgrow a window, so it has to be streamed.
+
+    Run from the repository root:
+    python benchmarks/shared_objects.py [--windows 0 64 256] [--spheres N] [--resolution LEVEL]
+"""
+
+import common
+import headless
+from config import *
+import scene
+
+def time_setting(sharedObjects, useBVH, args):
+    """
+        Returns:
+            (milliseconds per frame, (spheres, planes, lights) traced)
+    """
+
+    renderer = headless.HeadlessEngine(
+        args.width, args.height, localSize = (args.local, args.local), sharedObjects = sharedObjects
+    )
+    renderer.useBVH = useBVH
+    renderer.setResolutionLevel(args.resolution)
+    level = scene.Scene()
+    common.add_spheres(level, args.spheres)
+    try:
+        times, _ = common.time_frames(renderer, level, args.frames, synchronize = glFinish)
+        counts = renderer.objectCounts
+    finally:
+        level.destroy()
+        renderer.destroy()
+
+    return np.mean(times), counts
+
+def main():
+    parser = common.argument_parser(__doc__)
+    parser.add_argument("--windows", nargs = "+", type = int, default = [0, 64, 256],
+                        help = "records per shared window, 0 for per invocation unpacking")
+    parser.add_argument("--spheres", type = int, default = 0, help = "extra spheres in the first room")
+    parser.add_argument("--resolution", type = int, default = 6, help = "index into the engine's resolutions")
+    parser.add_argument("--local", type = int, default = 8, help = "workgroup side length")
+    parser.add_argument("--frames", type = int, default = 3, help = "timed frames per setting")
+    common.add_frame_size(parser)
+    args = parser.parse_args()
+
+    with common.gl_context() as rendererName:
+        print(rendererName)
+        for useBVH in (True, False):
+            for sharedObjects in args.windows:
+                milliseconds, counts = time_setting(sharedObjects, useBVH, args)
+                label = f"{'bvh' if useBVH else 'brute force'}, " \
+                    + (f"shared {sharedObjects}" if sharedObjects else "per invocation")
+                print(f"{label:28s} {milliseconds:8.1f} ms/frame  spheres, planes, lights {counts}")
+
+if __name__ == "__main__":
+    main()
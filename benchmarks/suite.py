@@ -0,0 +1,281 @@
+"""
+    Reproducible benchmark suite, results as JSON to compare across commits.
+
+    Renders a fixed set of scenes, the shipped level and versions of it
+    with more spheres scattered through the first room, along the camera
+    paths recorded in benchmarks/paths (render.py's keyframe format), at
+    several resolution levels. Noise and scattered spheres are seeded and
+    objects move a fixed step per frame, so every run sees the same frames.
+
+    Measured, in milliseconds:
+    startup      createNoiseTexture and createMegaTexture of a fresh engine,
+                 and the level's make_level, built without the level cache
+    per frame    packing and uploading the scene (prepareScene), tracing
+                 (GPU timer queries, or the CPU clock, as Engine.frameTimes),
+                 and the whole frame as renderScene returns
+    The first frame of each case compiles and uploads, so it is reported
+    on its own and left out of the per frame figures.
+
+    Run from the repository root:
+    python benchmarks/suite.py run [--backend gpu|cpu] [--levels 0 2 4] [--output results.json]
+    python benchmarks/suite.py compare base.json new.json [--threshold 0.15]
+    compare exits with status 1 if any median got slower by more than the threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import contextlib
+import subprocess
+from platform import machine, python_version
+
+import common
+from common import ROOT
+import headless
+from config import *
+import cpu_engine
+import scene
+import render
+
+PATHS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "paths")
+#extra spheres in the first room of each scene
+SCENES = {"shipped": 0, "spheres_256": 256, "spheres_1024": 1024}
+STARTUP_PHASES = ("createNoiseTexture", "createMegaTexture")
+FRAME_PHASES = ("prepareScene",)
+
+def timed(base, names, synchronize = None):
+    """
+        Returns:
+            subclass of base recording how long each method in
+            names takes, in milliseconds, under self.phaseTimes[name]
+    """
+
+    def wrap(name):
+        method = getattr(base, name)
+
+        def timed_method(self, *args, **kwargs):
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            if synchronize is not None:
+                synchronize()
+            self.__dict__.setdefault("phaseTimes", {}).setdefault(name, []).append(
+                (time.perf_counter() - start) * 1000)
+            return result
+
+        return timed_method
+
+    return type(f"Timed{base.__name__}", (base,), {name: wrap(name) for name in names})
+
+def summary(values):
+
+    values = np.array(values, dtype=np.float64)
+    return {
+        "median": float(np.median(values)), "mean": float(np.mean(values)),
+        "min": float(np.min(values)), "max": float(np.max(values)),
+    }
+
+def create_renderer(args):
+
+    if args.backend == "gpu":
+        base, synchronize = headless.HeadlessEngine, glFinish
+    else:
+        base, synchronize = cpu_engine.CPUEngine, None
+    renderer = timed(timed(base, STARTUP_PHASES, synchronize), FRAME_PHASES)(args.width, args.height)
+    return renderer
+
+def create_scene(name, args):
+    """
+        Returns:
+            the named scene, built without the level cache, with its
+            spheres scattered from args.seed
+    """
+
+    level = timed(scene.Scene, ("make_level",))(cache_dir = None)
+    common.add_spheres(level, SCENES[name], args.seed)
+    return level
+
+def load_paths(names):
+
+    if not names:
+        names = sorted(os.path.splitext(os.path.basename(path))[0]
+                       for path in glob.glob(os.path.join(PATHS, "*.json")))
+    return {name: render.load_path(os.path.join(PATHS, f"{name}.json")) for name in names}
+
+def run_case(sceneName, keyframes, resolutionLevel, args):
+    """
+        Fly along keyframes through a fresh scene with a fresh engine.
+
+            Returns:
+                dict of the case's results
+    """
+
+    renderer = create_renderer(args)
+    level = create_scene(sceneName, args)
+    renderer.setResolutionLevel(resolutionLevel)
+
+    def step(frame):
+        level.camera.setView(*render.view_at(keyframes, frame / args.frames))
+        level.cameraMoved = True
+
+    try:
+        wallTimes, (firstFrame,) = common.time_frames(
+            renderer, level, args.frames, step = step,
+            synchronize = glFinish if args.backend == "gpu" else None
+        )
+        if args.backend == "gpu":
+            #pick up timer queries still in flight
+            renderer.updateResolution()
+
+        traceTimes = [times["trace"] for _, times in list(renderer.frameTimes)[1:]]
+        packTimes = renderer.phaseTimes["prepareScene"][1:]
+        result = {
+            "scene": sceneName, "level": resolutionLevel,
+            "resolution": list(renderer.resolutions[resolutionLevel]),
+            "frames": args.frames, "timer": renderer.frameTimer.kind,
+            "first_frame_ms": firstFrame,
+            "pack_ms": summary(packTimes),
+            "trace_ms": summary(traceTimes),
+            "frame_ms": summary(wallTimes),
+        }
+    finally:
+        level.destroy()
+        renderer.destroy()
+
+    return result
+
+def measure_startup(args):
+
+    cached = os.path.isdir(os.path.join(ROOT, "cache"))
+    renderer = create_renderer(args)
+    level = create_scene("shipped", args)
+    startup = {name: renderer.phaseTimes[name][0] for name in STARTUP_PHASES}
+    startup["make_level"] = level.phaseTimes["make_level"][0]
+    level.destroy()
+    renderer.destroy()
+
+    #baking the material atlas dominates createMegaTexture when it isn't cached yet
+    return startup, "warm" if cached else "cold"
+
+def git_commit():
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, capture_output = True, text = True, check = True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+
+    context = common.gl_context() if args.backend == "gpu" else contextlib.nullcontext(machine())
+    with context as rendererName:
+        print(rendererName)
+
+        startup, cache = measure_startup(args)
+        print("startup " + "  ".join(f"{name} {ms:.1f} ms" for name, ms in startup.items()) + f" ({cache} cache)")
+
+        cases = {}
+        for pathName, keyframes in load_paths(args.paths).items():
+            for sceneName in args.scenes:
+                for resolutionLevel in args.levels:
+                    key = f"{sceneName}/{pathName}/{resolutionLevel}"
+                    result = run_case(sceneName, keyframes, resolutionLevel, args)
+                    result["path"] = pathName
+                    cases[key] = result
+                    width, height = result["resolution"]
+                    print(f"{key:32s} {width:4d}x{height:<4d} pack {result['pack_ms']['median']:7.2f}  "
+                          f"trace {result['trace_ms']['median']:8.2f}  frame {result['frame_ms']['median']:8.2f} ms")
+
+    results = {
+        "meta": {
+            "commit": git_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "backend": args.backend, "renderer": rendererName,
+            "width": args.width, "height": args.height, "frames": args.frames, "seed": args.seed,
+            "cache": cache, "python": python_version(), "numpy": np.__version__,
+        },
+        "startup": startup,
+        "cases": cases,
+    }
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent = 2)
+    print(f"wrote {args.output}")
+
+def metrics(results):
+    """
+        Returns:
+            {name: milliseconds} of every figure compare looks at
+    """
+
+    figures = {f"startup/{name}": ms for name, ms in results["startup"].items()}
+    for key, case in results["cases"].items():
+        for metric in ("pack_ms", "trace_ms", "frame_ms"):
+            figures[f"{key}/{metric}"] = case[metric]["median"]
+    return figures
+
+def compare(args):
+
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    for field in ("backend", "renderer", "width", "height", "frames", "cache"):
+        if base["meta"].get(field) != new["meta"].get(field):
+            print(f"warning: {field} differs, {base['meta'].get(field)} against {new['meta'].get(field)}")
+
+    baseFigures, newFigures = metrics(base), metrics(new)
+    regressions = 0
+    print(f"{'':48s} {base['meta'].get('commit') or 'base':>10s} {new['meta'].get('commit') or 'new':>10s}")
+    for name in baseFigures:
+        if name not in newFigures:
+            continue
+        before, after = baseFigures[name], newFigures[name]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        #slower by both the relative threshold and an absolute floor, so
+        #timer noise on sub-millisecond figures isn't flagged
+        if change > args.threshold and after - before > args.floor:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and before - after > args.floor:
+            flag = "  faster"
+        print(f"{name:48s} {before:10.2f} {after:10.2f} {change * 100:+7.1f}%{flag}")
+
+    missing = sorted(set(baseFigures) ^ set(newFigures))
+    if missing:
+        print(f"only in one run: {', '.join(missing)}")
+    print(f"{regressions} regression{'s' if regressions != 1 else ''}")
+    return 1 if regressions > 0 else 0
+
+def main():
+    parser = common.argument_parser(__doc__)
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    runner = commands.add_parser("run", help = "run the suite and write its results")
+    runner.add_argument("--backend", choices = ("gpu", "cpu"), default = "gpu",
+                        help = "trace through an EGL context or with NumPy")
+    runner.add_argument("--scenes", nargs = "+", choices = list(SCENES), default = list(SCENES))
+    runner.add_argument("--paths", nargs = "+", default = None, help = "camera paths, every one in benchmarks/paths by default")
+    runner.add_argument("--levels", nargs = "+", type = int, default = [0, 2, 4, 6, 8],
+                        help = "resolution levels, 0 is full resolution and each one after about 0.8 the size")
+    runner.add_argument("--frames", type = int, default = 16, help = "timed frames along each path")
+    runner.add_argument("--seed", type = int, default = 0, help = "seed the extra spheres are scattered from")
+    common.add_frame_size(runner, 320, 240)
+    runner.add_argument("--output", default = "results.json")
+
+    comparer = commands.add_parser("compare", help = "flag figures that got slower between two runs")
+    comparer.add_argument("base")
+    comparer.add_argument("new")
+    comparer.add_argument("--threshold", type = float, default = 0.15, help = "relative slowdown flagged")
+    comparer.add_argument("--floor", type = float, default = 0.5, help = "milliseconds a slowdown has to exceed too")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
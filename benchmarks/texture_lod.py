@@ -0,0 +1,76 @@
+"""
+    Cost and effect of mip selection on the CPU tracer.
+
+    Renders the same frames with texture LOD off and on, reports the time
+    per frame, how many texels of each mip level were read, and how far
+    the two images are apart.
+
+    Run from the repository root:
+    python benchmarks/texture_lod.py [--frames N] [--resolution LEVEL] [--width W --height H]
+"""
+
+import common
+from config import *
+import cpu_engine
+import cpu_tracer
+import scene
+
+def count_levels(counts):
+    """
+        Wrap cpu_tracer.texel_fetch to count the reads made on each level.
+    """
+
+    texel_fetch = cpu_tracer.texel_fetch
+
+    def counting(levels, x, y, level):
+        for mip, reads in zip(*np.unique(level, return_counts = True)):
+            counts[int(mip)] = counts.get(int(mip), 0) + int(reads)
+        return texel_fetch(levels, x, y, level)
+
+    return counting
+
+def render(textureLOD, args):
+    """
+        Returns:
+            (milliseconds per frame, {mip level: texel reads}, last image)
+    """
+
+    renderer = cpu_engine.CPUEngine(args.width, args.height)
+    renderer.useTextureLOD = textureLOD
+    renderer.resolutionLevel = args.resolution
+    renderer.screenWidth, renderer.screenHeight = renderer.resolutions[args.resolution]
+    renderer.colorBuffer = renderer.colorBuffers[args.resolution]
+    level = scene.Scene()
+
+    counts = {}
+    texel_fetch = cpu_tracer.texel_fetch
+    cpu_tracer.texel_fetch = count_levels(counts)
+    try:
+        #every frame is timed, the texel counts have to cover all of them
+        times, _ = common.time_frames(renderer, level, args.frames, warmup = 0, rate = 2.0)
+    finally:
+        cpu_tracer.texel_fetch = texel_fetch
+        level.destroy()
+
+    return np.mean(times), counts, renderer.colorBuffer.copy()
+
+def main():
+    parser = common.argument_parser(__doc__)
+    parser.add_argument("--frames", type = int, default = 3, help = "frames per setting")
+    parser.add_argument("--resolution", type = int, default = 0, help = "index into the engine's resolutions")
+    common.add_frame_size(parser)
+    args = parser.parse_args()
+
+    images = []
+    for textureLOD in (False, True):
+        milliseconds, counts, image = render(textureLOD, args)
+        images.append(image)
+        total = sum(counts.values()) or 1
+        levels = "  ".join(f"{mip}:{reads / total:5.1%}" for mip, reads in sorted(counts.items()))
+        print(f"{'LOD on' if textureLOD else 'LOD off':8s} {milliseconds:8.1f} ms/frame  reads by level {levels}")
+
+    difference = np.abs(images[1] - images[0])
+    print(f"mean difference {difference.mean():.4f}, pixels changed {(difference.max(axis = 2) > 0).mean():.1%}")
+
+if __name__ == "__main__":
+    main()
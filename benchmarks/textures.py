@@ -0,0 +1,77 @@
+"""
+    Material atlas build times.
+
+    Reports how long each material's five maps take to decode on their
+    own, then how long the whole atlas takes to build on one thread and
+    on the thread pool, and how long a baked atlas takes to map back in.
+
+    Run from the repository root:
+    python benchmarks/textures.py [--workers N]
+"""
+
+import os
+import time
+import tempfile
+
+import common
+from config import *
+import engine
+import megatexture
+
+def time_materials(filenames, texture_size):
+    """
+        Seconds to decode each material's maps, one after another.
+    """
+
+    timings = {}
+    for material in filenames:
+        start = time.perf_counter()
+        for map_name in megatexture.MAPS:
+            megatexture.decode_map(megatexture.map_path(material, map_name), texture_size)
+        timings[material] = time.perf_counter() - start
+
+    return timings
+
+def time_atlas(filenames, texture_size, workers):
+
+    start = time.perf_counter()
+    megatexture.load_atlas(filenames, texture_size, workers)
+    return time.perf_counter() - start
+
+def time_cached(filenames, texture_size):
+    """
+        Seconds to bake the atlas into a fresh cache, then to map it back in.
+    """
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        megatexture.cached_atlas(filenames, cache_dir, texture_size)
+        bake = time.perf_counter() - start
+
+        start = time.perf_counter()
+        megatexture.cached_atlas(filenames, cache_dir, texture_size)
+        load = time.perf_counter() - start
+
+    return bake, load
+
+def main():
+
+    parser = common.argument_parser(__doc__)
+    parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "decoding threads")
+    parser.add_argument("--size", type = int, default = 1024, help = "side length of a single map")
+    args = parser.parse_args()
+
+    filenames = engine.MATERIALS
+    for material, seconds in time_materials(filenames, args.size).items():
+        print(f"{material:32s} {seconds * 1000:8.1f} ms")
+
+    serial = time_atlas(filenames, args.size, 1)
+    parallel = time_atlas(filenames, args.size, args.workers)
+    bake, load = time_cached(filenames, args.size)
+    print(f"{'atlas, 1 thread':32s} {serial * 1000:8.1f} ms")
+    print(f"{f'atlas, {args.workers} threads':32s} {parallel * 1000:8.1f} ms")
+    print(f"{'bake into cache':32s} {bake * 1000:8.1f} ms")
+    print(f"{'map from cache':32s} {load * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+    Image quality and frame time of the temporal upscaler.
+
+    Renders a reference at full resolution by accumulating frames, then
+    compares it against what a lower resolution level puts on screen,
+    both stretched with nearest neighbour sampling as drawScreen used to,
+    and resolved by engine.Engine's temporal upscaler. The camera first
+    holds still, then turns a little every frame so history has to be
+    reprojected.
+
+    Run from the repository root:
+    python benchmarks/upscaling.py [--levels 3] [--frames N] [--width W --height H]
+"""
+
+import common
+import headless
+from config import *
+import scene
+
+def psnr(image, reference):
+
+    error = np.mean((np.clip(image[..., :3], 0, 1) - np.clip(reference[..., :3], 0, 1)) ** 2)
+    return 10 * np.log10(1.0 / max(error, 1e-12))
+
+def stretch(image, width, height):
+    """
+        Nearest neighbour resize, as the screen quad samples colorBuffer.
+    """
+
+    rows = ((np.arange(height) + 0.5) * image.shape[0] / height).astype(int)
+    columns = ((np.arange(width) + 0.5) * image.shape[1] / width).astype(int)
+    return image[rows][:, columns]
+
+def still_scene():
+    """
+        The starting room with its objects stopped where the first update put them.
+    """
+
+    level = scene.Scene()
+    level.update(1.0)
+    return level
+
+def turn(level, frame, turnRate):
+
+    if turnRate != 0:
+        level.spin_player((turnRate, 0.3 * turnRate * np.sin(frame)))
+
+def reference(renderer, frames, turnRate, args):
+    """
+        Accumulate frames at full resolution of the view the
+        sequence ends on.
+    """
+
+    level = still_scene()
+    for frame in range(args.frames):
+        turn(level, frame, turnRate)
+    renderer.useUpscaling = False
+    renderer.useAccumulation = True
+    renderer.setResolutionLevel(0)
+    for _ in range(frames):
+        level.update(0.0)
+        renderer.renderScene(level)
+    renderer.useAccumulation = False
+    level.destroy()
+    return renderer.readDisplayBuffer().copy()
+
+def sequence(renderer, resolutionLevel, useUpscaling, turnRate, args):
+    """
+        Returns:
+            (milliseconds per frame, last image on screen)
+    """
+
+    level = still_scene()
+    renderer.useUpscaling = useUpscaling
+    renderer.setResolutionLevel(resolutionLevel)
+    #the reference already compiled and uploaded everything
+    times, _ = common.time_frames(
+        renderer, level, args.frames, warmup = 0, rate = 0.0,
+        step = lambda frame: turn(level, frame, turnRate), synchronize = glFinish
+    )
+    image = renderer.readDisplayBuffer().copy()
+    renderer.useUpscaling = False
+    level.destroy()
+
+    return np.mean(times), image
+
+def main():
+    parser = common.argument_parser(__doc__)
+    parser.add_argument("--levels", nargs = "+", type = int, default = [3],
+                        help = "resolution levels to upscale from, 3 is about half width")
+    parser.add_argument("--frames", type = int, default = 16, help = "frames per sequence")
+    parser.add_argument("--reference", type = int, default = 16, help = "frames accumulated for the reference")
+    parser.add_argument("--turn", type = float, default = 0.5, help = "degrees the camera turns per frame")
+    common.add_frame_size(parser)
+    args = parser.parse_args()
+
+    with common.gl_context() as rendererName:
+        print(rendererName)
+        renderer = headless.HeadlessEngine(args.width, args.height)
+        try:
+            for label, turnRate in (("still", 0.0), ("turning", args.turn)):
+                target = reference(renderer, args.reference, turnRate, args)
+                milliseconds, native = sequence(renderer, 0, False, turnRate, args)
+                print(f"{label}: native {args.width}x{args.height} {milliseconds:7.1f} ms/frame  "
+                      f"{psnr(native, target):5.2f} dB")
+                for resolutionLevel in args.levels:
+                    width, height = renderer.resolutions[resolutionLevel]
+                    milliseconds, image = sequence(renderer, resolutionLevel, False, turnRate, args)
+                    stretched = stretch(image, args.width, args.height)
+                    print(f"  {width}x{height} stretched {milliseconds:7.1f} ms/frame  "
+                          f"{psnr(stretched, target):5.2f} dB")
+                    milliseconds, upscaled = sequence(renderer, resolutionLevel, True, turnRate, args)
+                    print(f"  {width}x{height} upscaled  {milliseconds:7.1f} ms/frame  "
+                          f"{psnr(upscaled, target):5.2f} dB")
+        finally:
+            renderer.destroy()
+
+if __name__ == "__main__":
+    main()
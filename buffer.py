@@ -1,97 +1,223 @@
 from config import *
+import ctypes
+import time
 import sphere
 import plane
 import light
 
+#copies of the buffer the GPU and CPU take turns on, so the CPU can
+#fill one while the GPU is still reading the frames before it
+FRAMES_IN_FLIGHT = 3
+
+MAP_FLAGS = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+
 class Buffer:
+    """
+        A shader storage buffer holding an array of one std430 struct,
+        mirrored by a host array with one row per element.
+        Both grow geometrically as elements are added.
+
+        The device buffer stays mapped and is split into FRAMES_IN_FLIGHT
+        regions. Each upload copies into the next region through a NumPy
+        view of the mapping, after waiting on the fence of the last frame
+        that read it, and binds that region.
+    """
 
     def __init__(self, size: int, binding: int, floatCount: int):
+        """
+            Parameters:
+                size (int): elements to allocate up front
+                binding (int): shader storage binding point
+                floatCount (int): floats per element, the struct's std430 size / 4
+        """
 
-        self.size = size
+        self.size = max(1, size)
         self.binding = binding
         self.floatCount = floatCount
 
-        # (cx cy cz r) (r g b _)
-        self.hostMemory = np.zeros(floatCount * size, dtype=np.float32)
+        self.hostMemory = np.zeros((self.size, floatCount), dtype=np.float32)
+        self.deviceMemory = None
+        self.fences = [None] * FRAMES_IN_FLIGHT
+        #seconds spent waiting for the GPU to release a region, in total
+        self.waitTime = 0.0
+        self.allocate()
+
+        #elements [first, last) written since the last upload
+        self.dirtyFirst = self.size
+        self.dirtyLast = 0
+
+    def allocate(self) -> None:
+        """
+            (Re)create the device buffer and its mapped regions from the
+            host array. Immutable storage can't be resized, so growing replaces it.
+        """
+
+        if self.deviceMemory is not None:
+            self.release()
+
+        alignment = glGetIntegerv(GL_SHADER_STORAGE_BUFFER_OFFSET_ALIGNMENT)
+        self.regionBytes = -(-self.hostMemory.nbytes // alignment) * alignment
 
         self.deviceMemory = glGenBuffers(1)
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.deviceMemory)
         glBufferStorage(
-            GL_SHADER_STORAGE_BUFFER, self.hostMemory.nbytes, 
-            self.hostMemory, GL_DYNAMIC_STORAGE_BIT)
-        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, binding, self.deviceMemory)
-        self.elements_updated = 0
-    
-    def recordSphere(self, i: int, _sphere: sphere.Sphere) -> None:
+            GL_SHADER_STORAGE_BUFFER, self.regionBytes * FRAMES_IN_FLIGHT, None, MAP_FLAGS)
+        address = glMapBufferRange(
+            GL_SHADER_STORAGE_BUFFER, 0, self.regionBytes * FRAMES_IN_FLIGHT, MAP_FLAGS)
+        mapping = np.ctypeslib.as_array(
+            (ctypes.c_float * (self.regionBytes * FRAMES_IN_FLIGHT // 4)).from_address(address))
+
+        #one (size, floatCount) view per region, all starting out current
+        self.regions = [
+            mapping[i * self.regionBytes // 4 : i * self.regionBytes // 4 + self.hostMemory.size]
+                .reshape(self.hostMemory.shape)
+            for i in range(FRAMES_IN_FLIGHT)
+        ]
+        for region in self.regions:
+            region[:] = self.hostMemory
+        self.region = 0
+        #elements [first, last) each region is missing
+        self.stale = [(self.size, 0)] * FRAMES_IN_FLIGHT
+
+        self.bind()
+
+    def reserve(self, count: int) -> bool:
         """
-            Record the given sphere in position i, if this exceeds the buffer size,
-            the sphere is not recorded.
+            Make room for count elements, doubling the size as needed.
+
+                Returns:
+                    whether the buffer had to grow
         """
 
-        if i >= self.size:
-            return
+        if count <= self.size:
+            return False
 
-        baseIndex = self.floatCount * i
-        self.hostMemory[baseIndex : baseIndex + 3] = _sphere.center[:]
-        self.hostMemory[baseIndex + 3] = _sphere.radius
-        self.hostMemory[baseIndex + 4 : baseIndex + 7] = _sphere.color[:]
-        self.hostMemory[baseIndex + 7] = _sphere.roughness
-        self.elements_updated += 1
-    
-    def recordPlane(self, i: int, _plane: plane.Plane) -> None:
+        size = self.size
+        while size < count:
+            size *= 2
+        hostMemory = np.zeros((size, self.floatCount), dtype=np.float32)
+        hostMemory[:self.size] = self.hostMemory
+        self.hostMemory = hostMemory
+        self.size = size
+        self.allocate()
+
+        return True
+
+    def write(self, first: int, records: np.ndarray) -> None:
         """
-            Record the given sphere in position i, if this exceeds the buffer size,
-            the sphere is not recorded.
+            Copy rows of records, such as 20 float object records, into
+            elements first onwards, keeping each row's first floatCount floats.
         """
 
-        if i >= self.size:
+        last = first + len(records)
+        if last <= first:
             return
+        self.reserve(last)
+        self.hostMemory[first:last] = records[:, :self.floatCount]
+        self.dirtyFirst = min(self.dirtyFirst, first)
+        self.dirtyLast = max(self.dirtyLast, last)
 
-        baseIndex = self.floatCount * i
-        # plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (r g b -)
-
-        self.hostMemory[baseIndex : baseIndex + 3]  = _plane.center[:]
-        self.hostMemory[baseIndex + 3]              = _plane.uMin
+    def recordSphere(self, i: int, _sphere: sphere.Sphere) -> None:
+        """
+            Record the given sphere in position i.
+        """
 
-        self.hostMemory[baseIndex + 4 : baseIndex + 7]  = _plane.tangent[:]
-        self.hostMemory[baseIndex + 7]                  = _plane.uMax
+        # sphere: (cx cy cz r) (r g b roughness)
+        self.write(i, _sphere.store.records[_sphere.index : _sphere.index + 1])
 
-        self.hostMemory[baseIndex + 8 : baseIndex + 11] = _plane.bitangent[:]
-        self.hostMemory[baseIndex + 11]                 = _plane.vMin
+    def recordPlane(self, i: int, _plane: plane.Plane) -> None:
+        """
+            Record the given plane in position i.
+        """
 
-        self.hostMemory[baseIndex + 12 : baseIndex + 15]    = _plane.normal[:]
-        self.hostMemory[baseIndex + 15]                     = _plane.vMax
+        # plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (material - - -)
+        self.write(i, _plane.store.records[_plane.index : _plane.index + 1])
 
-        self.hostMemory[baseIndex + 16] = _plane.material_index
-        self.elements_updated += 1
-        
     def recordLight(self, i: int, _light: light.Light) -> None:
         """
-            Record the given light in position i, if this exceeds the buffer size,
-            the light is not recorded.
+            Record the given light in position i.
         """
-        
-        baseIndex = self.floatCount * i
-        
+
         # light: (x y z s) (r g b -)
-        self.hostMemory[baseIndex : baseIndex + 3] = _light.position[:]
-        self.hostMemory[baseIndex + 3] = _light.strength
-        self.hostMemory[baseIndex + 4 : baseIndex + 7] = _light.color[:]
-        self.elements_updated += 1
-    
-    def readFrom(self) -> None:
+        self.write(i, _light.store.records[_light.index : _light.index + 1])
+
+    def readFrom(self) -> int:
+        """
+            Move on to the next region if anything was written since the
+            last call, bring it up to date, then arm the buffer for reading.
+
+                Returns:
+                    bytes sent
+        """
+
+        if self.dirtyLast <= self.dirtyFirst:
+            self.bind()
+            return 0
+
+        for i, (first, last) in enumerate(self.stale):
+            self.stale[i] = (min(first, self.dirtyFirst), max(last, self.dirtyLast))
+        self.dirtyFirst = self.size
+        self.dirtyLast = 0
+
+        self.region = (self.region + 1) % FRAMES_IN_FLIGHT
+        self.wait(self.region)
+        first, last = self.stale[self.region]
+        self.regions[self.region][first:last] = self.hostMemory[first:last]
+        self.stale[self.region] = (self.size, 0)
+        self.bind()
+
+        return (last - first) * self.floatCount * 4
+
+    def bind(self) -> None:
+        """
+            Bind the current region to the buffer's binding point.
         """
-            Upload the CPU data to the buffer, then arm it for reading.
+
+        glBindBufferRange(
+            GL_SHADER_STORAGE_BUFFER, self.binding, self.deviceMemory,
+            self.region * self.regionBytes, self.regionBytes)
+
+    def fence(self) -> None:
+        """
+            Mark the current region as read by every command issued so far.
+            Call after the dispatches that read it.
+        """
+
+        if self.fences[self.region] is not None:
+            glDeleteSync(self.fences[self.region])
+        self.fences[self.region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+    def wait(self, region: int) -> None:
+        """
+            Block until the GPU is done with the given region.
+        """
+
+        fence = self.fences[region]
+        if fence is None:
+            return
+        start = time.perf_counter()
+        while glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000) == GL_TIMEOUT_EXPIRED:
+            pass
+        self.waitTime += time.perf_counter() - start
+        glDeleteSync(fence)
+        self.fences[region] = None
+
+    def release(self) -> None:
+        """
+            Unmap and delete the device buffer once the GPU is done with it.
         """
 
+        for region in range(FRAMES_IN_FLIGHT):
+            self.wait(region)
+        self.regions = []
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.deviceMemory)
-        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, self.floatCount * 4 * self.elements_updated, self.hostMemory)
-        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.deviceMemory)
-        self.elements_updated = 0
-    
+        glUnmapBuffer(GL_SHADER_STORAGE_BUFFER)
+        glDeleteBuffers(1, (self.deviceMemory,))
+        self.deviceMemory = None
+
     def destroy(self) -> None:
         """
             Free the memory.
         """
 
-        glDeleteBuffers(1, (self.deviceMemory,))
\ No newline at end of file
+        self.release()
@@ -0,0 +1,220 @@
+"""
+    Bounding volume hierarchy over the spheres and planes packed in objectData.
+
+    The tree is flattened into rows of 12 floats, three vec4s each, which
+    the ray tracer reads from an std430 storage buffer (binding 4, its
+    nodes array, three vec4s per row):
+    row i:  (minx miny minz leftFirst) (maxx maxy maxz count) (primitive - - -)
+    The first two vec4s of row i are node i. Inner nodes have count 0 and
+    children at leftFirst, leftFirst + 1. Leaves cover
+    primitives[leftFirst : leftFirst + count], and primitives are object
+    indices into objectData.
+    The third vec4 of row i holds primitives[i], which has nothing to do
+    with node i. There are as many rows as the larger of the two counts.
+"""
+
+from config import *
+
+MAX_DEPTH = 60
+BINS = 8
+PADDING = 0.0001
+
+def object_bounds(objectData, sphereCount, planeCount):
+    """
+        Axis aligned box around each sphere and plane record in objectData.
+
+            Returns:
+                mins, maxs (np.ndarray (sphereCount + planeCount, 3))
+    """
+
+    records = objectData.reshape(-1, 20)
+
+    # sphere: (cx cy cz r)
+    spheres = records[:sphereCount]
+    radius = spheres[:, 3:4]
+    sphereMins = spheres[:, 0:3] - radius
+    sphereMaxs = spheres[:, 0:3] + radius
+
+    # plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax)
+    planes = records[sphereCount : sphereCount + planeCount]
+    center = planes[:, 0:3]
+    tangent = planes[:, 4:7]
+    bitangent = planes[:, 8:11]
+    corners = np.stack([
+        center + tangent * planes[:, 3 + 4 * u : 4 + 4 * u] + bitangent * planes[:, 11 + 4 * v : 12 + 4 * v]
+        for u in (0, 1) for v in (0, 1)
+    ])
+    planeMins = corners.min(axis = 0) - PADDING
+    planeMaxs = corners.max(axis = 0) + PADDING
+
+    return (
+        np.concatenate((sphereMins, planeMins)).astype(np.float32),
+        np.concatenate((sphereMaxs, planeMaxs)).astype(np.float32)
+    )
+
+def surface_area(mins, maxs):
+
+    extent = np.maximum(maxs - mins, 0.0)
+    return 2 * (
+        extent[..., 0] * extent[..., 1]
+        + extent[..., 1] * extent[..., 2]
+        + extent[..., 2] * extent[..., 0]
+    )
+
+class BVH:
+    """
+        SAH built bounding volume hierarchy, flattened into arrays.
+    """
+
+    def __init__(self, mins, maxs):
+        """
+            Build a tree over the given boxes.
+
+                Parameters:
+                    mins, maxs (np.ndarray (n,3)): primitive bounds
+        """
+
+        primitiveCount = len(mins)
+        self.primitives = np.arange(primitiveCount, dtype=np.int32)
+
+        nodeCapacity = max(1, 2 * primitiveCount - 1)
+        self.nodeMin = np.zeros((nodeCapacity, 3), dtype=np.float32)
+        self.nodeMax = np.zeros((nodeCapacity, 3), dtype=np.float32)
+        self.leftFirst = np.zeros(nodeCapacity, dtype=np.int32)
+        self.count = np.zeros(nodeCapacity, dtype=np.int32)
+        self.depth = np.zeros(nodeCapacity, dtype=np.int32)
+        self.nodeCount = 0
+
+        if primitiveCount == 0:
+            return
+
+        centroids = 0.5 * (mins + maxs)
+
+        self.nodeCount = 1
+        self.leftFirst[0] = 0
+        self.count[0] = primitiveCount
+        stack = [(0, 0)]
+        while len(stack) > 0:
+            node, depth = stack.pop()
+            self.depth[node] = depth
+            first = self.leftFirst[node]
+            count = self.count[node]
+            members = self.primitives[first : first + count]
+            self.nodeMin[node] = mins[members].min(axis = 0)
+            self.nodeMax[node] = maxs[members].max(axis = 0)
+
+            if count <= 1 or depth >= MAX_DEPTH:
+                continue
+
+            leftSide = self.find_split(mins[members], maxs[members], centroids[members])
+            if leftSide is None:
+                continue
+            leftCount = int(leftSide.sum())
+            self.primitives[first : first + count] = np.concatenate(
+                (members[leftSide], members[~leftSide])
+            )
+
+            left = self.nodeCount
+            self.nodeCount += 2
+            self.leftFirst[left] = first
+            self.count[left] = leftCount
+            self.leftFirst[left + 1] = first + leftCount
+            self.count[left + 1] = count - leftCount
+            self.leftFirst[node] = left
+            self.count[node] = 0
+            stack.append((left, depth + 1))
+            stack.append((left + 1, depth + 1))
+
+    def find_split(self, mins, maxs, centroids):
+        """
+            Binned surface area heuristic.
+
+                Returns:
+                    boolean mask of the primitives going left,
+                    or None if keeping the node as a leaf is cheaper.
+        """
+
+        count = len(mins)
+        bestCost = count * surface_area(mins.min(axis = 0), maxs.max(axis = 0))
+        bestSide = None
+
+        for axis in range(3):
+
+            low = centroids[:, axis].min()
+            high = centroids[:, axis].max()
+            if high - low < 1e-6:
+                continue
+
+            bins = np.minimum(((centroids[:, axis] - low) / (high - low) * BINS).astype(int), BINS - 1)
+
+            binCount = np.bincount(bins, minlength = BINS)
+            binMin = np.full((BINS, 3), np.inf, dtype=np.float32)
+            binMax = np.full((BINS, 3), -np.inf, dtype=np.float32)
+            np.minimum.at(binMin, bins, mins)
+            np.maximum.at(binMax, bins, maxs)
+
+            leftCount = np.cumsum(binCount)[:-1]
+            rightCount = np.cumsum(binCount[::-1])[::-1][1:]
+            leftArea = surface_area(
+                np.minimum.accumulate(binMin)[:-1], np.maximum.accumulate(binMax)[:-1]
+            )
+            rightArea = surface_area(
+                np.minimum.accumulate(binMin[::-1])[::-1][1:],
+                np.maximum.accumulate(binMax[::-1])[::-1][1:]
+            )
+
+            with np.errstate(invalid = "ignore"):
+                cost = np.where(
+                    (leftCount > 0) & (rightCount > 0),
+                    leftCount * leftArea + rightCount * rightArea, np.inf
+                )
+            plane = int(np.argmin(cost))
+            if cost[plane] < bestCost:
+                bestCost = cost[plane]
+                bestSide = bins <= plane
+
+        return bestSide
+
+    def refit(self, mins, maxs):
+        """
+            Recompute node bounds for moved primitives, keeping the topology.
+            Leaves are refit in one pass, then inner nodes level by level
+            from the deepest up.
+        """
+
+        if self.nodeCount == 0:
+            return
+
+        nodes = np.arange(self.nodeCount)
+        leaves = nodes[self.count[:self.nodeCount] > 0]
+        order = np.argsort(self.leftFirst[leaves])
+        leaves = leaves[order]
+        starts = self.leftFirst[leaves]
+        self.nodeMin[leaves] = np.minimum.reduceat(mins[self.primitives], starts)
+        self.nodeMax[leaves] = np.maximum.reduceat(maxs[self.primitives], starts)
+
+        inner = nodes[self.count[:self.nodeCount] == 0]
+        depth = self.depth[inner]
+        for level in range(depth.max(initial = -1), -1, -1):
+            parents = inner[depth == level]
+            left = self.leftFirst[parents]
+            self.nodeMin[parents] = np.minimum(self.nodeMin[left], self.nodeMin[left + 1])
+            self.nodeMax[parents] = np.maximum(self.nodeMax[left], self.nodeMax[left + 1])
+
+    def pack(self, target):
+        """
+            Write the flattened tree into a (nodes, 12) float array with
+            at least two rows per object.
+
+                Returns:
+                    number of nodes written
+        """
+
+        nodes = self.nodeCount
+        target[:nodes, 0:3] = self.nodeMin[:nodes]
+        target[:nodes, 3] = self.leftFirst[:nodes]
+        target[:nodes, 4:7] = self.nodeMax[:nodes]
+        target[:nodes, 7] = self.count[:nodes]
+        target[:len(self.primitives), 8] = self.primitives
+
+        return nodes
@@ -35,4 +35,26 @@ class Camera:
 
         self.up = pyrr.vector.normalize(
             pyrr.vector3.cross(self.right, self.forwards)
-        )
\ No newline at end of file
+        )
+
+    def setView(self, position, theta, phi):
+        """
+            Move the camera to position, looking theta degrees around
+            the vertical axis and phi degrees above the horizon.
+        """
+
+        self.position[:] = position
+        self.theta = theta
+        self.phi = phi
+        self.recalculateVectors()
+
+    def snapshot(self):
+        """
+            Copy of the view as it is now, for comparing frames against
+            the ones before them.
+
+                Returns:
+                    (position, forwards, right, up)
+        """
+
+        return (self.position.copy(), self.forwards.copy(), self.right.copy(), self.up.copy())
@@ -0,0 +1,173 @@
+from config import *
+import engine
+import megatexture
+import material
+import cpu_tracer
+import noise
+import resolution
+from collections import deque
+
+class CPUEngine(engine.Engine):
+    """
+        Draws scenes with the NumPy port of the ray tracer,
+        needs no window or OpenGL context.
+    """
+
+    def __init__(self, width, height, chunkSize = 16384, useBVH = True, useGrid = False,
+                 noiseMethod = "white", noiseSeed = 0, materialBudget = None):
+        """
+            Initialize a headless raytracing context
+
+                Parameters:
+                    width (int): width of screen
+                    height (int): height of screen
+                    chunkSize (int): rays traced per batch
+                    useBVH (bool): traverse a bounding volume hierarchy
+                        instead of testing every object
+                    useGrid (bool): walk the level's grid instead,
+                        takes precedence over useBVH
+                    noiseMethod (str): how the noise texture is sampled, one of noise.METHODS
+                    noiseSeed (int): seed of the noise texture
+                    materialBudget (int): bytes of atlas to stream materials
+                        into, None to load every material up front
+        """
+        self.screenWidth = width
+        self.screenHeight = height
+        self.noiseMethod = noiseMethod
+        self.noiseSeed = noiseSeed
+        self.materialBudget = materialBudget
+        self.chunkSize = chunkSize
+        self.useBVH = useBVH
+        self.useGrid = useGrid
+        self.useTextureLOD = True
+        self.useAccumulation = False
+        self.accumulatedFrames = 0
+        self.accumulationLevel = None
+        self.noiseOffset = (0, 0)
+        self.noisePoint = noise.frame_point(0, noiseMethod)
+        #the temporal upscaler only runs on the GPU
+        self.useUpscaling = False
+
+        self.targetFrameRate = 60
+        self.frameRateMargin = 10
+        self.useAdaptiveResolution = False
+
+        self.createLODChain()
+        self.createFrameTimer()
+        self.createColorBuffers()
+        self.createResourceMemory()
+        self.createNoiseTexture()
+        self.createMegaTexture()
+
+    def createFrameTimer(self):
+
+        self.frameTimer = resolution.CPUTimer(("trace",))
+        self.resolutionController = resolution.ResolutionController(
+            self.resolutions, 1000.0 / self.targetFrameRate
+        )
+        self.frameTimes = deque(maxlen = 256)
+
+    def createColorBuffers(self):
+
+        self.colorBuffers = []
+        self.accumulationBuffers = []
+
+        for resolution in self.resolutions:
+
+            width,height = resolution
+            self.colorBuffers.append(np.zeros((height, width, 4), dtype=np.float32))
+            self.accumulationBuffers.append(np.zeros((height, width, 4), dtype=np.float32))
+
+        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
+
+    def createResourceMemory(self):
+
+        self.objectData = np.zeros(engine.OBJECT_CAPACITY * 20, dtype=np.float32)
+        self.createObjectSlots()
+        self.createBVHMemory()
+        self.packedScene = cpu_tracer.PackedScene(self.objectData, 0, 0, 0)
+
+    def createNoiseTexture(self):
+
+        self.noise = self.noiseData = self.generateNoise()
+
+    def createMegaTexture(self):
+
+        if self.materialBudget is None:
+            self.materials = None
+            self.megaTexture = megatexture.cached_atlas(engine.MATERIALS)
+            self.materialTable = megatexture.atlas_table(len(engine.MATERIALS))
+        else:
+            self.materials = material.MaterialManager(engine.MATERIALS, self.materialBudget)
+            self.megaTexture = self.materials.atlas
+            self.materialTable = self.materials.table
+
+    def updateScene(self, scene):
+
+        scene.outDated = False
+
+        ranges, repacked = self.recordChanges(scene)
+        sphereCount, planeCount, lightCount = self.objectCounts
+        level = None
+        if self.useGrid:
+            level = scene.get_grid()
+        elif self.useBVH and (repacked or any(first < sphereCount for first, _ in ranges)):
+            self.updateBVH(scene, sphereCount, planeCount)
+        self.packedScene = cpu_tracer.PackedScene(
+            self.objectData, sphereCount, planeCount, lightCount,
+            self.bvhData, self.nodeCount, level
+        )
+
+    def prepareScene(self, scene):
+
+        self.updateAccumulation(scene)
+        if scene.outDated:
+            self.updateScene(scene)
+        if self.materials is not None:
+            self.materials.request(scene)
+            self.materials.update()
+
+    def renderScene(self, scene):
+        """
+            Draw all objects in the scene into the current color buffer
+        """
+
+        self.prepareScene(scene)
+
+        self.frameTimer.begin("trace")
+        cpu_tracer.render_tile(
+            self.packedScene, scene.camera, self.noise, self.megaTexture, self.materialTable,
+            (self.screenWidth, self.screenHeight),
+            0, 0, self.screenWidth, self.screenHeight,
+            self.colorBuffer, self.chunkSize, self.useTextureLOD, self.noiseOffset, self.noisePoint
+        )
+        self.frameTimer.end()
+        self.frameTimer.endFrame(self.resolutionLevel)
+        self.accumulateFrame()
+        self.updateResolution()
+
+    def accumulateFrame(self):
+        """
+            Fold the frame just drawn into the running average,
+            and leave the average in the color buffer.
+        """
+
+        if not self.useAccumulation:
+            return
+
+        average = self.accumulationBuffers[self.resolutionLevel]
+        if self.accumulatedFrames > 0:
+            average += (self.colorBuffer - average) / np.float32(self.accumulatedFrames + 1)
+        else:
+            average[:] = self.colorBuffer
+        self.colorBuffer[:] = average
+        self.accumulatedFrames += 1
+
+    def drawScreen(self):
+
+        pass
+
+    def destroy(self):
+
+        if self.materials is not None:
+            self.materials.destroy()
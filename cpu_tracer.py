@@ -0,0 +1,839 @@
+"""
+    Vectorized NumPy port of shaders/rayTracer.txt.
+
+    Every function works on a batch of rays at once, rays are rows of
+    (n,3) float32 arrays. Function names follow the shader so the two
+    can be read side by side.
+"""
+
+from config import *
+#the name noise is taken by the noise images passed around
+import noise as noise_patterns
+
+FAR_AWAY = 999999999
+EPSILON = 0.0001
+
+class PackedScene:
+    """
+        Columns of the packed objectData records, as read back by
+        unpackSphere, unpackPlane and unpackLight.
+    """
+
+    def __init__(self, objectData, sphereCount, planeCount, lightCount, bvhData = None, nodeCount = 0, grid = None):
+        """
+            Unpack the first sphereCount + planeCount + lightCount records.
+
+                Parameters:
+                    objectData (np.ndarray): flat float32 array, 20 floats per object
+                    sphereCount, planeCount, lightCount (int): object counts
+                    bvhData (np.ndarray): packed hierarchy over the spheres and planes,
+                        see bvh.py. Objects are tested brute force without one.
+                    nodeCount (int): nodes in use in bvhData
+                    grid (grid.Grid): when given, planes are the whole level's,
+                        found by walking the grid instead of objectData's
+        """
+
+        records = objectData.reshape(-1, 20)
+        spheres = records[:sphereCount]
+        planes = records[sphereCount : sphereCount + planeCount]
+        lights = records[sphereCount + planeCount : sphereCount + planeCount + lightCount]
+
+        # sphere: (cx cy cz r) (r g b roughness)
+        self.sphereCenter = np.ascontiguousarray(spheres[:, 0:3])
+        self.sphereRadius = np.ascontiguousarray(spheres[:, 3])
+        self.sphereColor = np.ascontiguousarray(spheres[:, 4:7])
+        self.sphereRoughness = np.ascontiguousarray(spheres[:, 7])
+
+        # plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (material - - -)
+        self.planeCenter = np.ascontiguousarray(planes[:, 0:3])
+        self.planeTangent = np.ascontiguousarray(planes[:, 4:7])
+        self.planeBitangent = np.ascontiguousarray(planes[:, 8:11])
+        self.planeNormal = np.ascontiguousarray(planes[:, 12:15])
+        self.planeBounds = np.ascontiguousarray(planes[:, 3:16:4])
+        self.planeMaterial = np.ascontiguousarray(planes[:, 16])
+
+        # light: (x y z s) (r g b -)
+        self.lightPosition = np.ascontiguousarray(lights[:, 0:3])
+        self.lightStrength = np.ascontiguousarray(lights[:, 3])
+        self.lightColor = np.ascontiguousarray(lights[:, 4:7])
+
+        self.sphereCount = sphereCount
+        self.planeCount = planeCount
+        self.lightCount = lightCount
+
+        # node: (minx miny minz leftFirst) (maxx maxy maxz count) (primitive - - -)
+        self.nodeCount = nodeCount if bvhData is not None else 0
+        if self.nodeCount > 0:
+            nodes = bvhData.reshape(-1, 12)
+            self.nodeMin = np.ascontiguousarray(nodes[:nodeCount, 0:3])
+            self.leftFirst = nodes[:nodeCount, 3].astype(np.int64)
+            self.nodeMax = np.ascontiguousarray(nodes[:nodeCount, 4:7])
+            self.nodeObjectCount = nodes[:nodeCount, 7].astype(np.int64)
+            self.primitives = nodes[:sphereCount + planeCount, 8].astype(np.int64)
+
+        self.grid = grid
+        if grid is not None:
+            planes = grid.planeData
+            self.planeCenter = np.ascontiguousarray(planes[:, 0:3])
+            self.planeTangent = np.ascontiguousarray(planes[:, 4:7])
+            self.planeBitangent = np.ascontiguousarray(planes[:, 8:11])
+            self.planeNormal = np.ascontiguousarray(planes[:, 12:15])
+            self.planeBounds = np.ascontiguousarray(planes[:, 3:16:4])
+            self.planeMaterial = np.ascontiguousarray(planes[:, 16])
+            self.planeCount = len(planes)
+            self.nodeCount = 0
+
+            # per axis columns and offsets, for testing rays against
+            # a different set of planes each
+            self.planeNormalAxes = np.ascontiguousarray(self.planeNormal.T)
+            self.planeTangentAxes = np.ascontiguousarray(self.planeTangent.T)
+            self.planeBitangentAxes = np.ascontiguousarray(self.planeBitangent.T)
+            self.planeOffset = np.einsum("ij,ij->i", self.planeCenter, self.planeNormal)
+            self.planeTangentOffset = np.einsum("ij,ij->i", self.planeCenter, self.planeTangent)
+            self.planeBitangentOffset = np.einsum("ij,ij->i", self.planeCenter, self.planeBitangent)
+
+class RenderState:
+    """
+        Per-ray result of trace(), one row per ray.
+    """
+
+    def __init__(self, rayCount):
+
+        self.t = np.zeros(rayCount, dtype=np.float32)
+        self.color = np.zeros((rayCount, 3), dtype=np.float32)
+        self.emissive = np.zeros((rayCount, 3), dtype=np.float32)
+        self.position = np.zeros((rayCount, 3), dtype=np.float32)
+        self.normal = np.zeros((rayCount, 3), dtype=np.float32)
+        self.hit = np.zeros(rayCount, dtype=bool)
+        self.roughness = np.zeros(rayCount, dtype=np.float32)
+
+def normalize(vectors):
+
+    return vectors / np.linalg.norm(vectors, axis = 1, keepdims = True)
+
+def generate_rays(viewer, noise, screen_size, pixel_x, pixel_y, noiseOffset = (0, 0), noisePoint = (0, 0, 0, 0)):
+    """
+        Build primary rays for the given pixels, as main() does.
+
+            Parameters:
+                viewer (camera.Camera): position, forwards, right, up
+                noise (np.ndarray): (rows, cols, 4) noise texels
+                screen_size (tuple): (width, height) of the image being drawn
+                pixel_x, pixel_y (np.ndarray): integer pixel coordinates
+                noiseOffset (tuple): (x, y) texel the frame starts reading noise at
+                noisePoint (tuple): the frame's noise.frame_point
+
+            Returns:
+                origins, directions (np.ndarray (n,3))
+    """
+
+    width, height = screen_size
+
+    screenDeflection = noise_sample(noise, pixel_x, pixel_y, noiseOffset, noisePoint)[:, :2]
+
+    horizontalCoefficient = pixel_x.astype(np.float32) + screenDeflection[:, 0]
+    horizontalCoefficient = (horizontalCoefficient * 2 - width) / width
+
+    verticalCoefficient = pixel_y.astype(np.float32) + screenDeflection[:, 1]
+    verticalCoefficient = (verticalCoefficient * 2 - height) / width
+
+    directions = viewer.forwards[None, :] \
+        + horizontalCoefficient[:, None] * viewer.right[None, :] \
+        + verticalCoefficient[:, None] * viewer.up[None, :]
+    origins = np.broadcast_to(viewer.position.astype(np.float32), directions.shape)
+
+    return origins, directions.astype(np.float32)
+
+def noise_sample(noise, pixel_x, pixel_y, noiseOffset, noisePoint):
+    """
+        Noise offsets of the given pixels on a frame, as noise_sample() reads them.
+
+            Returns:
+                np.ndarray (n,3)
+    """
+
+    rows, cols = noise.shape[:2]
+    texels = image_load(noise, (pixel_x + noiseOffset[0]) % cols, (pixel_y + noiseOffset[1]) % rows)
+    return noise_patterns.sample(texels, noisePoint)
+
+def image_load(image, x, y):
+    """
+        imageLoad for a batch of texel coordinates,
+        out of range reads return zero like they do on the GPU.
+    """
+
+    rows, cols = image.shape[:2]
+    inside = (x >= 0) & (x < cols) & (y >= 0) & (y < rows)
+    result = np.zeros((len(x), image.shape[2]), dtype=np.float32)
+    result[inside] = image[y[inside], x[inside]]
+    return result
+
+def texel_fetch(levels, x, y, level):
+    """
+        texelFetch for a batch of texel coordinates, each on its own mip level.
+    """
+
+    result = np.zeros((len(x), levels[0].shape[2]), dtype=np.float32)
+    for mip in np.unique(level).tolist():
+        rays = level == mip
+        result[rays] = image_load(levels[mip], x[rays], y[rays])
+    return result
+
+def first_pass(scene, viewerPosition, megaTexture, materialTable, origins, directions, coneSpread = 0.0):
+    """
+        Colour of the first surface each ray hits, black on a miss.
+    """
+
+    renderState = trace(scene, megaTexture, materialTable, origins, directions, coneSpread = coneSpread)
+
+    pixel = np.zeros((len(origins), 3), dtype=np.float32)
+
+    hit = renderState.hit
+    if not hit.any():
+        return pixel
+
+    lighting = light_fragment(
+        scene, viewerPosition, renderState.position[hit], renderState.normal[hit]
+    )
+    pixel[hit] = renderState.color[hit] * lighting + renderState.emissive[hit]
+
+    return pixel
+
+def light_fragment(scene, viewerPosition, position, normal):
+    """
+        Ambient plus diffuse and specular terms from every unblocked light.
+
+            Parameters:
+                scene (PackedScene)
+                viewerPosition (np.ndarray [3,])
+                position, normal (np.ndarray (n,3)): surface points being lit
+    """
+
+    #ambient
+    color = np.full((len(position), 3), 0.2, dtype=np.float32)
+
+    fragViewer = normalize(viewerPosition[None, :] - position)
+
+    for i in range(scene.lightCount):
+
+        fragLight = scene.lightPosition[i][None, :] - position
+        distanceToLight = np.linalg.norm(fragLight, axis = 1)
+        fragLight = fragLight / distanceToLight[:, None]
+        halfway = normalize(fragViewer + fragLight)
+
+        lit = ~occluded(scene, position, fragLight, distanceToLight)
+        if not lit.any():
+            continue
+
+        attenuation = scene.lightStrength[i] / (distanceToLight[lit] * distanceToLight[lit])
+        #diffuse
+        diffuse = np.maximum(0.0, np.einsum("ij,ij->i", normal[lit], fragLight[lit]))
+        #specular
+        specular = np.maximum(0.0, np.einsum("ij,ij->i", normal[lit], halfway[lit])) ** 64
+        color[lit] += scene.lightColor[i][None, :] * ((diffuse + specular) * attenuation)[:, None]
+
+    return color
+
+def occluded(scene, origins, directions, distanceToLight):
+    """
+        Whether anything lies between each point and its light.
+    """
+
+    blocked = np.zeros(len(origins), dtype=bool)
+
+    if scene.grid is not None:
+
+        if scene.sphereCount > 0:
+            trialDist = distance_to_spheres(scene, origins, directions)
+            blocked |= (trialDist < distanceToLight[:, None]).any(axis = 1)
+
+        def visit(rays, owner, planes):
+            trialDist = distance_to_plane_pairs(
+                scene, origins[rays[owner]], directions[rays[owner]], planes
+            )
+            hit = np.zeros(len(rays), dtype=bool)
+            hit[owner[trialDist < distanceToLight[rays[owner]]]] = True
+            blocked[rays[hit]] = True
+            return hit
+
+        walk_grid(scene, origins, directions, distanceToLight, ~blocked, visit)
+        return blocked
+
+    if scene.nodeCount > 0:
+
+        tMax = distanceToLight.copy()
+
+        def visit(spheres, planes, rays):
+            hit = np.zeros(len(rays), dtype=bool)
+            if len(spheres) > 0:
+                trialDist = distance_to_spheres(scene, origins[rays], directions[rays], spheres)
+                hit |= (trialDist < distanceToLight[rays, None]).any(axis = 1)
+            if len(planes) > 0:
+                trialDist = distance_to_planes(scene, origins[rays], directions[rays], planes)
+                hit |= (trialDist < distanceToLight[rays, None]).any(axis = 1)
+            blocked[rays[hit]] = True
+            #blocked rays need not be traversed any further
+            tMax[rays[hit]] = -np.inf
+
+        traverse(scene, origins, directions, tMax, visit)
+        return blocked
+
+    if scene.sphereCount > 0:
+        trialDist = distance_to_spheres(scene, origins, directions)
+        blocked |= (trialDist < distanceToLight[:, None]).any(axis = 1)
+    if scene.planeCount > 0:
+        trialDist = distance_to_planes(scene, origins, directions)
+        blocked |= (trialDist < distanceToLight[:, None]).any(axis = 1)
+
+    return blocked
+
+def trace(scene, megaTexture, materialTable, origins, directions, tMin = 0.001, coneSpread = 0.0):
+    """
+        Find the nearest sphere or plane along each ray.
+        coneSpread is the angle between neighbouring rays, 0 to always
+        sample full detail textures.
+
+            Returns:
+                RenderState
+    """
+
+    rayCount = len(origins)
+    renderState = RenderState(rayCount)
+
+    if scene.grid is not None:
+        nearestHit, nearestObject = nearest_grid(scene, origins, directions, tMin)
+    elif scene.nodeCount > 0:
+        nearestHit, nearestObject = nearest_bvh(scene, origins, directions, tMin)
+    else:
+        nearestHit, nearestObject = nearest_brute_force(scene, origins, directions, tMin)
+
+    hit = (nearestObject >= 0) & (nearestObject < scene.sphereCount)
+    if hit.any():
+
+        index = nearestObject[hit]
+        tHit = nearestHit[hit]
+        position = origins[hit] + tHit[:, None] * directions[hit]
+        renderState.position[hit] = position
+        renderState.normal[hit] = normalize(position - scene.sphereCenter[index])
+        renderState.t[hit] = tHit
+        renderState.color[hit] = scene.sphereColor[index]
+        renderState.roughness[hit] = scene.sphereRoughness[index]
+        renderState.emissive[hit] = 0.0
+        renderState.hit |= hit
+
+    hit = nearestObject >= scene.sphereCount
+    if hit.any():
+
+        index = nearestObject[hit] - scene.sphereCount
+        tHit = nearestHit[hit]
+        tangent = scene.planeTangent[index]
+        bitangent = scene.planeBitangent[index]
+        normal = scene.planeNormal[index]
+        uMin, _, vMin, _ = scene.planeBounds[index].T
+
+        testPoint = origins[hit] + tHit[:, None] * directions[hit]
+        testDirection = testPoint - scene.planeCenter[index]
+        u = np.einsum("ij,ij->i", testDirection, tangent)
+        v = np.einsum("ij,ij->i", testDirection, bitangent)
+        # one texture tile per unit square, so merged planes tile
+        u = u - uMin
+        v = v - vMin
+        u -= np.floor(u)
+        v -= np.floor(v)
+
+        # width of the ray cone where it meets the plane, stretched by the angle it meets it at
+        lengthSquared = np.einsum("ij,ij->i", directions[hit], directions[hit])
+        facing = np.maximum(-np.einsum("ij,ij->i", directions[hit], normal), 0.0001)
+        footprint = (np.float32(coneSpread) * tHit * lengthSquared / facing).astype(np.float32)
+
+        albedo, emissive, gloss, materialNormal, _ = sample_material(
+            megaTexture, materialTable, scene.planeMaterial[index], u, v, footprint
+        )
+
+        renderState.position[hit] = testPoint
+        renderState.t[hit] = tHit
+        renderState.color[hit] = albedo
+        renderState.emissive[hit] = emissive
+        renderState.roughness[hit] = np.maximum(0, 1.0 - gloss)
+
+        # maps tangent space into world space
+        renderState.normal[hit] = tangent * materialNormal[:, 0:1] \
+            + bitangent * materialNormal[:, 1:2] \
+            + normal * materialNormal[:, 2:3]
+        renderState.hit |= hit
+
+    return renderState
+
+def nearest_brute_force(scene, origins, directions, tMin):
+    """
+        Test every ray against every object, as the shader's loops do.
+
+            Returns:
+                nearestHit (np.ndarray (n,)): distance along the ray
+                nearestObject (np.ndarray (n,)): object index, -1 on a miss
+    """
+
+    rayCount = len(origins)
+    rays = np.arange(rayCount)
+    nearestHit = np.full(rayCount, FAR_AWAY, dtype=np.float32)
+    nearestObject = np.full(rayCount, -1, dtype=np.int64)
+
+    if scene.sphereCount > 0:
+
+        t = hit_spheres(scene, origins, directions, tMin)
+        nearest = np.argmin(t, axis = 1)
+        tNearest = t[rays, nearest]
+        hit = tNearest < nearestHit
+        nearestHit[hit] = tNearest[hit]
+        nearestObject[hit] = nearest[hit]
+
+    if scene.planeCount > 0:
+
+        t = hit_planes(scene, origins, directions, tMin)
+        nearest = np.argmin(t, axis = 1)
+        tNearest = t[rays, nearest]
+        hit = tNearest < nearestHit
+        nearestHit[hit] = tNearest[hit]
+        nearestObject[hit] = nearest[hit] + scene.sphereCount
+
+    return nearestHit, nearestObject
+
+def nearest_bvh(scene, origins, directions, tMin):
+    """
+        Same as nearest_brute_force, visiting only the leaves
+        of the bounding volume hierarchy each ray passes through.
+    """
+
+    rayCount = len(origins)
+    nearestHit = np.full(rayCount, FAR_AWAY, dtype=np.float32)
+    nearestObject = np.full(rayCount, -1, dtype=np.int64)
+
+    def visit(spheres, planes, rays):
+        if len(spheres) > 0:
+            t = hit_spheres(scene, origins[rays], directions[rays], tMin, spheres)
+            nearest = np.argmin(t, axis = 1)
+            tNearest = t[np.arange(len(rays)), nearest]
+            hit = tNearest < nearestHit[rays]
+            nearestHit[rays[hit]] = tNearest[hit]
+            nearestObject[rays[hit]] = spheres[nearest[hit]]
+        if len(planes) > 0:
+            t = hit_planes(scene, origins[rays], directions[rays], tMin, planes)
+            nearest = np.argmin(t, axis = 1)
+            tNearest = t[np.arange(len(rays)), nearest]
+            hit = tNearest < nearestHit[rays]
+            nearestHit[rays[hit]] = tNearest[hit]
+            nearestObject[rays[hit]] = planes[nearest[hit]] + scene.sphereCount
+
+    traverse(scene, origins, directions, nearestHit, visit)
+
+    return nearestHit, nearestObject
+
+def nearest_grid(scene, origins, directions, tMin):
+    """
+        Same as nearest_brute_force, testing spheres directly and planes
+        only in the map cells each ray passes through.
+    """
+
+    rayCount = len(origins)
+    nearestHit = np.full(rayCount, FAR_AWAY, dtype=np.float32)
+    nearestObject = np.full(rayCount, -1, dtype=np.int64)
+
+    if scene.sphereCount > 0:
+
+        t = hit_spheres(scene, origins, directions, tMin)
+        nearest = np.argmin(t, axis = 1)
+        tNearest = t[np.arange(rayCount), nearest]
+        hit = tNearest < nearestHit
+        nearestHit[hit] = tNearest[hit]
+        nearestObject[hit] = nearest[hit]
+
+    def visit(rays, owner, planes):
+        t = hit_plane_pairs(scene, origins[rays[owner]], directions[rays[owner]], planes, tMin)
+        tNearest = np.full(len(rays), np.inf, dtype=np.float32)
+        np.minimum.at(tNearest, owner, t)
+        hit = tNearest < nearestHit[rays]
+        #first (lowest index) plane at the nearest distance
+        nearest = np.flatnonzero(hit[owner] & (t == tNearest[owner]))
+        rayHit, first = np.unique(owner[nearest], return_index = True)
+        nearestHit[rays[rayHit]] = tNearest[rayHit]
+        nearestObject[rays[rayHit]] = planes[nearest[first]] + scene.sphereCount
+        return np.zeros(len(rays), dtype=bool)
+
+    walk_grid(scene, origins, directions, nearestHit, np.ones(rayCount, dtype=bool), visit)
+
+    return nearestHit, nearestObject
+
+def walk_grid(scene, origins, directions, tMax, active, visit):
+    """
+        Step every ray through the map one cell at a time (2D DDA in x,y).
+        A ray stops once it leaves the map, once tMax falls within the
+        cell it is in, or when visit says it is done.
+
+            Parameters:
+                tMax (np.ndarray (n,)): per-ray cutoff, may be lowered by visit
+                active (np.ndarray (n,)): rays to walk
+                visit (function): called as visit(rays, owner, planes) with the
+                    rays in a cell and every (ray, plane) pair to test, owner being
+                    a position in rays. Returns which of the rays are finished.
+    """
+
+    grid = scene.grid
+    cell = np.floor(origins[:, 0:2]).astype(np.int64)
+    step = np.sign(directions[:, 0:2]).astype(np.int64)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        tDelta = np.abs(1.0 / directions[:, 0:2])
+        tNext = (cell + (step > 0) - origins[:, 0:2]) / directions[:, 0:2]
+    tNext[step == 0] = np.inf
+    tEntry = np.zeros(len(origins), dtype=np.float32)
+
+    rays = np.flatnonzero(active)
+    for _ in range(grid.rows + grid.cols + 2):
+
+        inside = (cell[rays, 0] >= 0) & (cell[rays, 0] < grid.cols) \
+            & (cell[rays, 1] >= 0) & (cell[rays, 1] < grid.rows)
+        rays = rays[inside & (tEntry[rays] < tMax[rays])]
+        if len(rays) == 0:
+            return
+
+        cells = cell[rays, 1] * grid.cols + cell[rays, 0]
+        counts = grid.cellCount[cells]
+        owner = np.repeat(np.arange(len(rays)), counts)
+        first = np.repeat(grid.cellStart[cells] - (np.cumsum(counts) - counts), counts)
+        planes = grid.cellPlanes[first + np.arange(len(owner))]
+        finished = visit(rays, owner, planes)
+
+        tExit = tNext[rays].min(axis = 1)
+        rays = rays[~finished & (tMax[rays] > tExit + EPSILON)]
+
+        #step across whichever cell boundary comes first
+        axis = np.argmin(tNext[rays], axis = 1)
+        tEntry[rays] = tNext[rays, axis]
+        cell[rays, axis] += step[rays, axis]
+        tNext[rays, axis] += tDelta[rays, axis]
+
+def plane_pairs(scene, origins, directions, planes):
+    """
+        Intersect each ray with one plane, ray i against planes[i].
+
+            Returns:
+                t, inside, facing (np.ndarray (n,))
+    """
+
+    def dot(vectors, axes):
+        return vectors[:, 0] * axes[0][planes] \
+            + vectors[:, 1] * axes[1][planes] \
+            + vectors[:, 2] * axes[2][planes]
+
+    denom = dot(directions, scene.planeNormalAxes)
+    facing = denom < 0.000001
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        t = (scene.planeOffset[planes] - dot(origins, scene.planeNormalAxes)) / denom
+
+        # u = dot(origin + t * direction - center, tangent)
+        u = dot(origins, scene.planeTangentAxes) - scene.planeTangentOffset[planes] \
+            + t * dot(directions, scene.planeTangentAxes)
+        v = dot(origins, scene.planeBitangentAxes) - scene.planeBitangentOffset[planes] \
+            + t * dot(directions, scene.planeBitangentAxes)
+        uMin, uMax, vMin, vMax = scene.planeBounds[planes].T
+        inside = (u > uMin) & (u < uMax) & (v > vMin) & (v < vMax)
+
+    return t, inside, facing
+
+def hit_plane_pairs(scene, origins, directions, planes, tMin):
+    """
+        hit_planes for ray i against planes[i] only.
+    """
+
+    t, inside, facing = plane_pairs(scene, origins, directions, planes)
+
+    with np.errstate(invalid = "ignore"):
+        hit = facing & (t > tMin) & inside
+
+    return np.where(hit, t, np.inf).astype(np.float32)
+
+def distance_to_plane_pairs(scene, origins, directions, planes):
+    """
+        distance_to_planes for ray i against planes[i] only.
+    """
+
+    t, inside, facing = plane_pairs(scene, origins, directions, planes)
+    length = np.linalg.norm(directions, axis = 1)
+
+    with np.errstate(invalid = "ignore"):
+        hit = facing & (t >= 0.0001) & inside
+    return np.where(hit, t * length, 9999)
+
+def traverse(scene, origins, directions, tMax, visit):
+    """
+        Walk the hierarchy with the whole batch of rays, splitting it
+        at every node into the rays that enter the node's box.
+
+            Parameters:
+                tMax (np.ndarray (n,)): per-ray cutoff, read again at every node
+                    so visit can shrink it
+                visit (function): called as visit(spheres, planes, rays) for
+                    each leaf, with sphere and plane indices and the ray indices
+    """
+
+    with np.errstate(divide = "ignore"):
+        inverseDirections = 1.0 / directions
+    # one contiguous array per axis keeps the slab tests cheap
+    origins = [np.ascontiguousarray(origins[:, axis]) for axis in range(3)]
+    inverseDirections = [np.ascontiguousarray(inverseDirections[:, axis]) for axis in range(3)]
+    meanDirection = directions.sum(axis = 0)
+
+    stack = [(0, np.arange(len(directions)))]
+    while len(stack) > 0:
+
+        node, rays = stack.pop()
+
+        tNear = hit_box(
+            scene.nodeMin[node], scene.nodeMax[node],
+            [component[rays] for component in origins],
+            [component[rays] for component in inverseDirections]
+        )
+        rays = rays[tNear < tMax[rays]]
+        if len(rays) == 0:
+            continue
+
+        count = scene.nodeObjectCount[node]
+        first = scene.leftFirst[node]
+        if count > 0:
+            objects = scene.primitives[first : first + count]
+            spheres = objects[objects < scene.sphereCount]
+            planes = objects[objects >= scene.sphereCount] - scene.sphereCount
+            visit(spheres, planes, rays)
+            continue
+
+        #visit the child nearer along the batch's mean direction first
+        towards = scene.nodeMin[first + 1] + scene.nodeMax[first + 1] \
+            - scene.nodeMin[first] - scene.nodeMax[first]
+        if np.dot(meanDirection, towards) >= 0:
+            stack.append((first + 1, rays))
+            stack.append((first, rays))
+        else:
+            stack.append((first, rays))
+            stack.append((first + 1, rays))
+
+def hit_box(boxMin, boxMax, origins, inverseDirections):
+    """
+        Slab test against one box, entry distance or inf on a miss.
+
+            Parameters:
+                boxMin, boxMax (np.ndarray [3,])
+                origins, inverseDirections (list): x, y and z arrays
+    """
+
+    tNear = np.full(len(origins[0]), -np.inf, dtype=np.float32)
+    tFar = np.full(len(origins[0]), np.inf, dtype=np.float32)
+    with np.errstate(invalid = "ignore"):
+        for axis in range(3):
+            t0 = (boxMin[axis] - origins[axis]) * inverseDirections[axis]
+            t1 = (boxMax[axis] - origins[axis]) * inverseDirections[axis]
+            tNear = np.fmax(tNear, np.fmin(t0, t1))
+            tFar = np.fmin(tFar, np.fmax(t0, t1))
+
+    return np.where((tNear <= tFar) & (tFar >= 0.0), tNear, np.inf)
+
+def sphere_roots(scene, origins, directions, spheres = slice(None)):
+    """
+        Nearer quadratic root of every ray against every sphere.
+
+            Returns:
+                t, discriminant (np.ndarray (rays, spheres))
+    """
+
+    center = scene.sphereCenter[spheres]
+    radius = scene.sphereRadius[spheres]
+
+    co = origins[:, None, :] - center[None, :, :]
+    a = np.einsum("ij,ij->i", directions, directions)[:, None]
+    b = 2 * np.einsum("ik,ijk->ij", directions, co)
+    c = np.einsum("ijk,ijk->ij", co, co) - (radius * radius)[None, :]
+    discriminant = b * b - (4 * a * c)
+
+    with np.errstate(invalid = "ignore"):
+        t = (-b - np.sqrt(discriminant)) / (2 * a)
+
+    return t, discriminant
+
+def hit_spheres(scene, origins, directions, tMin, spheres = slice(None)):
+    """
+        Hit distance of every ray against every sphere, inf on a miss.
+    """
+
+    t, discriminant = sphere_roots(scene, origins, directions, spheres)
+
+    return np.where((discriminant > 0.0) & (t > tMin), t, np.inf).astype(np.float32)
+
+def plane_coordinates(scene, origins, directions, planes = slice(None)):
+    """
+        Intersect every ray with every plane's supporting plane.
+
+            Returns:
+                t, u, v, facing (np.ndarray (rays, planes))
+    """
+
+    center = scene.planeCenter[planes]
+    normal = scene.planeNormal[planes]
+    tangent = scene.planeTangent[planes]
+    bitangent = scene.planeBitangent[planes]
+
+    denom = directions @ normal.T
+    facing = denom < 0.000001
+
+    offset = np.einsum("ij,ij->i", center, normal)[None, :] - origins @ normal.T
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        t = offset / denom
+
+    # u = dot(origin + t * direction - center, tangent)
+    u = origins @ tangent.T \
+        - np.einsum("ij,ij->i", center, tangent)[None, :] \
+        + t * (directions @ tangent.T)
+    v = origins @ bitangent.T \
+        - np.einsum("ij,ij->i", center, bitangent)[None, :] \
+        + t * (directions @ bitangent.T)
+
+    return t, u, v, facing
+
+def inside_bounds(scene, u, v, planes = slice(None)):
+
+    uMin, uMax, vMin, vMax = scene.planeBounds[planes].T
+    return (u > uMin[None, :]) & (u < uMax[None, :]) \
+        & (v > vMin[None, :]) & (v < vMax[None, :])
+
+def hit_planes(scene, origins, directions, tMin, planes = slice(None)):
+    """
+        Hit distance of every ray against every plane, inf on a miss.
+    """
+
+    t, u, v, facing = plane_coordinates(scene, origins, directions, planes)
+
+    with np.errstate(invalid = "ignore"):
+        hit = facing & (t > tMin) & inside_bounds(scene, u, v, planes)
+
+    return np.where(hit, t, np.inf).astype(np.float32)
+
+def distance_to_spheres(scene, origins, directions, spheres = slice(None)):
+    """
+        distanceTo(Ray, Sphere) for every ray against every sphere.
+    """
+
+    t, discriminant = sphere_roots(scene, origins, directions, spheres)
+    length = np.linalg.norm(directions, axis = 1)[:, None]
+
+    with np.errstate(invalid = "ignore"):
+        distance = np.where(t < 0.0001, 9999, t * length)
+    return np.where(discriminant > 0.0, distance, 99999)
+
+def distance_to_planes(scene, origins, directions, planes = slice(None)):
+    """
+        distanceTo(Ray, Plane) for every ray against every plane.
+    """
+
+    t, u, v, facing = plane_coordinates(scene, origins, directions, planes)
+    length = np.linalg.norm(directions, axis = 1)[:, None]
+
+    with np.errstate(invalid = "ignore"):
+        hit = facing & (t >= 0.0001) & inside_bounds(scene, u, v, planes)
+    return np.where(hit, t * length, 9999)
+
+def sample_material(megaTexture, materialTable, index, u, v, footprint = None):
+    """
+        Read and unpack the material maps at (u,v) of the given materials,
+        see megatexture.py for the packing and material.py for the table.
+        Materials that aren't resident come back flat grey.
+
+            Parameters:
+                megaTexture (list of np.ndarray): (rows, cols, 4) uint8 atlas and its mips
+                materialTable (np.ndarray): (materials, 4) of (x y size -)
+                index, u, v (np.ndarray): per-ray material index and coordinates
+                footprint (np.ndarray): per-ray width of the surface seen by
+                    one pixel, picks the mip level like the shader does,
+                    None for full detail
+
+            Returns:
+                albedo, emissive, gloss, normal, specular
+    """
+
+    index = index.astype(np.int64)
+    known = (index >= 0) & (index < len(materialTable))
+    region = np.zeros((len(index), 4), dtype=np.float32)
+    region[known] = materialTable[index[known]]
+    x0, y0, size = region[:, 0], region[:, 1], region[:, 2]
+    resident = size > 0
+
+    # one texel per footprint, but no smaller than 8 texels across
+    level = np.zeros(len(index), dtype=np.int64)
+    if footprint is not None:
+        lod = resident & (footprint > 0)
+        with np.errstate(divide = "ignore"):
+            maxLevel = np.minimum(np.float32(len(megaTexture) - 1), np.log2(size[lod] / np.float32(8.0)))
+            wanted = np.floor(np.log2(footprint[lod].astype(np.float32) * size[lod]))
+        level[lod] = np.clip(wanted, 0.0, maxLevel).astype(np.int64)
+    scale = np.exp2(-level).astype(np.float32)
+    x0, y0, size = x0 * scale, y0 * scale, size * scale
+
+    row = (y0 + np.floor(size * v)).astype(np.int64)
+
+    def load(tile):
+        x = (x0 + tile * size + np.floor(size * u)).astype(np.int64)
+        return texel_fetch(megaTexture, x, row, level) / 255.0
+
+    surface = load(0)
+    detail = load(1)
+    glow = texel_fetch(
+        megaTexture,
+        (x0 + 2 * size + np.floor(0.5 * size * u)).astype(np.int64),
+        (y0 + np.floor(0.5 * size * v)).astype(np.int64),
+        level
+    ) / 255.0
+
+    normal = np.empty((len(u), 3))
+    normal[:, :2] = 2.0 * detail[:, :2] - 1.0
+    normal[:, 2] = np.sqrt(np.maximum(0.0, 1.0 - np.einsum("ij,ij->i", normal[:, :2], normal[:, :2])))
+
+    albedo = np.where(resident[:, None], surface[:, :3], 0.5)
+    emissive = np.where(resident[:, None], glow[:, :3], 0.0)
+    gloss = np.where(resident, surface[:, 3], 0.0)
+    normal = np.where(resident[:, None], normal, [0.0, 0.0, 1.0])
+    specular = np.where(resident[:, None], detail[:, 2:3], 0.0).repeat(3, axis = 1)
+
+    return albedo, emissive, gloss, normal, specular
+
+def render_tile(scene, viewer, noise, megaTexture, materialTable, screen_size, x0, y0, x1, y1, target,
+                chunkSize = 16384, textureLOD = True, noiseOffset = (0, 0), noisePoint = (0, 0, 0, 0)):
+    """
+        Ray trace the pixels [x0,x1) x [y0,y1) into target.
+
+            Parameters:
+                scene (PackedScene)
+                viewer (camera.Camera)
+                noise (np.ndarray): (rows, cols, 4) noise texels
+                megaTexture (list of np.ndarray): (rows, cols, 4) uint8 atlas and its mips
+                materialTable (np.ndarray): (materials, 4) region of each material in the atlas
+                screen_size (tuple): (width, height) of the full image
+                target (np.ndarray): (height, width, 4) float32 image, row 0 at the bottom
+                chunkSize (int): rays traced together, bounds temporary memory
+                textureLOD (bool): sample smaller mips for distant and grazing surfaces
+                noiseOffset (tuple): (x, y) texel the frame starts reading noise at
+                noisePoint (tuple): the frame's noise.frame_point
+    """
+
+    pixel_y, pixel_x = np.mgrid[y0:y1, x0:x1]
+    pixel_x = pixel_x.ravel()
+    pixel_y = pixel_y.ravel()
+
+    viewerPosition = np.asarray(viewer.position, dtype=np.float32)
+    coneSpread = np.float32(np.arctan(2.0 / screen_size[0])) if textureLOD else 0.0
+
+    for start in range(0, len(pixel_x), chunkSize):
+
+        xs = pixel_x[start : start + chunkSize]
+        ys = pixel_y[start : start + chunkSize]
+
+        origins, directions = generate_rays(viewer, noise, screen_size, xs, ys, noiseOffset, noisePoint)
+        pixel = first_pass(scene, viewerPosition, megaTexture, materialTable, origins, directions, coneSpread)
+
+        target[ys, xs, :3] = pixel
+        target[ys, xs, 3] = 1.0
@@ -1,35 +1,135 @@
 from config import *
 import megatexture
+import bvh
+import grid
+import sphere
+import plane
+import light
+import noise
+import material
+import buffer
+import resolution
+from collections import deque
+
+#objects objectData has room for before it first has to grow
+OBJECT_CAPACITY = 1024
+
+MATERIALS = [
+    "AlienArchitecture", "AlternatingColumnsConcreteTile", "BiomechanicalPlumbing", 
+    "CarvedStoneFloorCheckered", "ChemicalStrippedConcrete", "ClayBrick",
+    "CrumblingBrickWall", "DiamondSquareFlourishTiles", "EgyptianHieroglyphMetal"
+]
+
+def merge_slots(slots):
+    """
+        Group record indices into contiguous ranges.
+
+            Returns:
+                list of (first, last) ranges, last exclusive
+    """
+
+    slots = np.unique(slots)
+    if len(slots) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(slots) != 1) + 1
+    firsts = slots[np.concatenate(([0], breaks))]
+    lasts = slots[np.concatenate((breaks - 1, [len(slots) - 1]))] + 1
+
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+def slot_table(_store, objects, first):
+    """
+        Map store rows to the objectData slots the objects were packed into,
+        -1 for rows that weren't packed.
+    """
+
+    table = np.full(len(_store.records), -1, dtype=np.int64)
+    indices = np.fromiter((_object.index for _object in objects), dtype=np.int64, count = len(objects))
+    table[indices] = np.arange(first, first + len(objects))
+
+    return table
 
 class Engine:
     """
         Responsible for drawing scenes
     """
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, noiseMethod = "white", noiseSeed = 0, materialBudget = None,
+                 localSize = (8, 8), sharedObjects = 0):
         """
             Initialize a flat raytracing context
             
                 Parameters:
                     width (int): width of screen
                     height (int): height of screen
+                    noiseMethod (str): how the noise texture is sampled, one of noise.METHODS
+                    noiseSeed (int): seed of the noise texture
+                    materialBudget (int): bytes of texture memory to stream
+                        materials into, None to load every material up front
+                    localSize (tuple): (x, y) pixels per compute workgroup
+                    sharedObjects (int): objectData records each workgroup loads
+                        into shared memory and streams the rest through,
+                        0 to have every invocation read them itself
         """
         self.screenWidth = width
         self.screenHeight = height
+        self.noiseMethod = noiseMethod
+        self.noiseSeed = noiseSeed
+        self.materialBudget = materialBudget
+        self.localSize = tuple(localSize)
+        self.sharedObjects = sharedObjects
 
         self.targetFrameRate = 60
         self.frameRateMargin = 10
+        #render each frame at the level resolutionController picks to
+        #fit 1000 / targetFrameRate milliseconds, see updateResolution
+        self.useAdaptiveResolution = False
+
+        #walk the level's grid instead of testing the active rooms' planes
+        self.useGrid = False
+        #otherwise traverse a hierarchy over them, rather than testing every one
+        self.useBVH = True
+        #sample smaller atlas mips for distant and grazing surfaces
+        self.useTextureLOD = True
+        #average successive frames for as long as nothing in view changes
+        self.useAccumulation = False
+        self.accumulatedFrames = 0
+        self.accumulationLevel = None
+        self.noiseOffset = (0, 0)
+        self.noisePoint = noise.frame_point(0, noiseMethod)
+        #trace below full resolution with a sub-pixel jitter per frame and
+        #resolve up to full resolution over time, see upscaleFrame
+        self.useUpscaling = False
+        self.upscaledFrames = 0
+        self.previousView = None
+        self.jitter = (0.0, 0.0)
+
+        #bytes sent to scene textures during the last frame, and in total
+        self.uploadedBytes = 0
+        self.totalUploadedBytes = 0
 
         #general OpenGL configuration
         self.shader = self.createShader("shaders/frameBufferVertex.txt",
                                         "shaders/frameBufferFragment.txt")
         
-        self.rayTracerShader = self.createComputeShader("shaders/rayTracer.txt")
+        self.rayTracerShader = self.createComputeShader(
+            "shaders/rayTracer.txt",
+            {
+                "LOCAL_SIZE_X": self.localSize[0], "LOCAL_SIZE_Y": self.localSize[1],
+                "SHARED_OBJECTS": self.sharedObjects,
+            }
+        )
+        self.upscalerShader = self.createComputeShader(
+            "shaders/temporalUpscaler.txt",
+            {"LOCAL_SIZE_X": self.localSize[0], "LOCAL_SIZE_Y": self.localSize[1]}
+        )
         
         glUseProgram(self.shader)
         
         self.createQuad()
         self.createLODChain()
+        self.createFrameTimer()
         self.createColorBuffers()
         self.createResourceMemory()
         self.createNoiseTexture()
@@ -48,6 +148,24 @@ class Engine:
         self.resolutionLevel = len(self.resolutions) - 1
         
         self.screenWidth,self.screenHeight = self.resolutions[self.resolutionLevel]
+
+    def createFrameTimer(self):
+        """
+            Time the tracer and the upscaler with GPU timer queries, or
+            the CPU clock where there are none, and model frame cost
+            from those times to pick resolutions with.
+        """
+
+        phases = ("trace", "upscale")
+        if resolution.GPUTimer.supported():
+            self.frameTimer = resolution.GPUTimer(phases)
+        else:
+            self.frameTimer = resolution.CPUTimer(phases, glFinish)
+        self.resolutionController = resolution.ResolutionController(
+            self.resolutions, 1000.0 / self.targetFrameRate
+        )
+        #(level, {phase: milliseconds}) of the latest frames timed
+        self.frameTimes = deque(maxlen = 256)
     
     def createQuad(self):
         # x, y, z, s, t
@@ -77,52 +195,122 @@ class Engine:
     def createColorBuffers(self):
 
         self.colorBuffers = []
+        #running average of the frames drawn since the view last changed
+        self.accumulationBuffers = []
+        #(geometric normal, distance) of each pixel's first hit, for the upscaler
+        self.surfaceBuffers = []
 
         for resolution in self.resolutions:
 
             width,height = resolution
 
-            newColorBuffer = glGenTextures(1)
-            self.colorBuffers.append(newColorBuffer)
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, newColorBuffer)
+            for buffers in (self.colorBuffers, self.accumulationBuffers, self.surfaceBuffers):
+                newColorBuffer = glGenTextures(1)
+                buffers.append(newColorBuffer)
+                glActiveTexture(GL_TEXTURE0)
+                glBindTexture(GL_TEXTURE_2D, newColorBuffer)
+
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+                glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
+
+        #the upscaler's last two full resolution frames, (color, surface)
+        #each, it reads one and writes the other
+        self.upscaledBuffers = []
+        for _ in range(2):
+            frame = glGenTextures(2)
+            self.upscaledBuffers.append(tuple(frame))
+            for texture in frame:
+                glActiveTexture(GL_TEXTURE0)
+                glBindTexture(GL_TEXTURE_2D, texture)
+
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+                glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, *self.resolutions[0], 0, GL_RGBA, GL_FLOAT, None)
+        
+        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
+        #what drawScreen shows, colorBuffer unless it was upscaled
+        self.displayBuffer = self.colorBuffer
+        self.displaySize = (self.screenWidth, self.screenHeight)
+    
+    def createResourceMemory(self):
+
+        """
+            allocate storage for 1024 objects to begin with, more as the scene grows
+        """
+
+        # sphere: (cx cy cz r)    (r g b roughness) (- - - -)       (- - - -)       (- - - -)
+        # plane:  (cx cy cz umin) (tx ty tz umax)   (bx by bz vmin) (nx ny nz vmax) (material_index - - -)
+        # light:  (x y z s)       (r g b -)         (- - - -)       (- - - -)       (- - - -)
+        self.objectData = np.zeros(OBJECT_CAPACITY * 20, dtype=np.float32)
+
+        # one typed storage buffer per kind of object, holding the first
+        # floats of each record: a std430 Sphere, Plane or Light
+        self.sphereBuffer = buffer.Buffer(64, 0, 8)
+        self.planeBuffer = buffer.Buffer(256, 1, 20)
+        self.lightBuffer = buffer.Buffer(16, 2, 8)
+
+        self.createObjectSlots()
+        self.createBVHMemory()
+        self.bvhBuffer = buffer.Buffer(len(self.bvhData) // 12, 4, 12)
+
+        self.grid = None
+        self.levelPlaneBuffer = buffer.Buffer(256, 3, 20)
+        #everything the ray tracer reads from storage buffers
+        self.sceneBuffers = (
+            self.sphereBuffer, self.planeBuffer, self.lightBuffer,
+            self.levelPlaneBuffer, self.bvhBuffer
+        )
+        self.gridTextures = glGenTextures(2)
+        for i, texture in enumerate(self.gridTextures):
+            glActiveTexture(GL_TEXTURE6 + i)
+            glBindTexture(GL_TEXTURE_2D, texture)
 
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
 
-        
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
-        
-        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
-    
-    def createResourceMemory(self):
+            glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,1,1,0,GL_RGBA,GL_FLOAT,np.zeros(4, dtype=np.float32))
 
+    def createObjectSlots(self):
         """
-            allocate storage for up to 1024 objects (why not?)
+            Bookkeeping for updating objectData in place: the active
+            objects it was last packed for, and for each store of moving
+            objects, the slot each of its rows was written to.
         """
 
-        objectData = []
+        self.packedLayout = None
+        self.objectCounts = (0, 0, 0)
+        self.objectSlots = {}
 
-        # sphere: (cx cy cz r)  (r g b roughness) (- - - -)     (- - - -)             (- - - -)
-        # plane:  (cx cy cz tx) (ty tz bx by)     (bz nx ny nz) (umin umax vmin vmax) (material_index - - -)
-        # light:  (x y z s)     (r g b -)         (bz nx ny nz) (umin umax vmin vmax) (material_index - - -)
-        for object in range(1024):
-            for attribute in range(20):
-                objectData.append(0.0)
-        self.objectData = np.array(objectData, dtype=np.float32)
+    def createBVHMemory(self):
 
-        self.objectDataTexture = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
+        """
+            storage for a hierarchy over as many objects as objectData holds
+        """
 
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,5,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
+        # node: (minx miny minz leftFirst) (maxx maxy maxz count) (primitive - - -)
+        self.bvhData = np.zeros(2 * (len(self.objectData) // 20) * 12, dtype=np.float32)
+        self.bvh = None
+        self.bvhLayout = None
+        self.nodeCount = 0
+
+    def generateNoise(self):
+
+        """
+            Returns four screens' worth of noise at full resolution,
+            (rows, cols, 4) texels, see noise.generate
+        """
+
+        width, height = self.resolutions[0]
+        return noise.generate(width, height, self.noiseMethod, self.noiseSeed)
 
     def createNoiseTexture(self):
 
@@ -130,19 +318,8 @@ class Engine:
             generate four screens' worth of noise
         """
 
-        noise = []
-
-        # random noise: (x y z -)
-        for y in range(600):
-            for x in range(800 * 4):
-                radius = np.random.uniform(low = 0.0, high = 0.99)
-                theta = np.random.uniform(low = 0.0, high = 2 * np.pi)
-                phi = np.random.uniform(low = 0.0, high = np.pi)
-                noise.append(radius * np.cos(theta) * np.cos(phi))
-                noise.append(radius * np.sin(theta) * np.cos(phi))
-                noise.append(radius * np.sin(phi))
-                noise.append(0.0)
-        self.noiseData = np.array(noise, dtype=np.float32)
+        self.noiseData = self.generateNoise()
+        height, width = self.noiseData.shape[:2]
 
         self.noiseTexture = glGenTextures(1)
         glActiveTexture(GL_TEXTURE2)
@@ -155,19 +332,61 @@ class Engine:
     
         glTexImage2D(
             GL_TEXTURE_2D,0,GL_RGBA32F, 
-            4 * 800,600,
-            0,GL_RGBA,GL_FLOAT,bytes(self.noiseData)
+            width,height,
+            0,GL_RGBA,GL_FLOAT,self.noiseData
         )
     
     def createMegaTexture(self):
 
-        filenames = [
-            "AlienArchitecture", "AlternatingColumnsConcreteTile", "BiomechanicalPlumbing", 
-            "CarvedStoneFloorCheckered", "ChemicalStrippedConcrete", "ClayBrick",
-            "CrumblingBrickWall", "DiamondSquareFlourishTiles", "EgyptianHieroglyphMetal"
-        ]
+        """
+            Upload every material, or set up a material.MaterialManager
+            to stream them in when there is a budget. Either way the
+            material table says where each one is.
+        """
+
+        if self.materialBudget is None:
+            self.materials = None
+            self.megaTexture = megatexture.MegaTexture(megatexture.cached_atlas(MATERIALS))
+            table = megatexture.atlas_table(len(MATERIALS))
+        else:
+            self.materials = material.MaterialManager(MATERIALS, self.materialBudget)
+            self.megaTexture = megatexture.MegaTexture(self.materials.atlas)
+            table = self.materials.table
 
-        self.megaTexture = megatexture.MegaTexture(filenames)
+        self.materialTable = glGenTextures(1)
+        glActiveTexture(GL_TEXTURE8)
+        glBindTexture(GL_TEXTURE_2D, self.materialTable)
+
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,len(table),1,0,GL_RGBA,GL_FLOAT,table)
+
+        glUseProgram(self.rayTracerShader)
+        glUniform1i(glGetUniformLocation(self.rayTracerShader, "megaTexture"), 3)
+        glUniform1i(glGetUniformLocation(self.rayTracerShader, "materialTable"), 8)
+
+    def updateMaterials(self, scene):
+        """
+            Ask for the materials the scene needs and upload the ones
+            that finished loading.
+        """
+
+        self.materials.request(scene)
+        for x, y, width, height in self.materials.update():
+            glActiveTexture(GL_TEXTURE3)
+            sent = self.megaTexture.update(self.materials.atlas, x, y, width, height)
+            self.uploadedBytes += sent
+            self.totalUploadedBytes += sent
+
+        if self.materials.tableChanged:
+            self.materials.tableChanged = False
+            table = self.materials.table
+            glActiveTexture(GL_TEXTURE8)
+            glBindTexture(GL_TEXTURE_2D, self.materialTable)
+            glTexSubImage2D(GL_TEXTURE_2D,0,0,0,len(table),1,GL_RGBA,GL_FLOAT,table)
+            self.uploadedBytes += table.nbytes
+            self.totalUploadedBytes += table.nbytes
     
     def createShader(self, vertexFilepath, fragmentFilepath):
         """
@@ -186,125 +405,265 @@ class Engine:
         
         return shader
     
-    def createComputeShader(self, filepath):
+    def createComputeShader(self, filepath, defines = None):
         """
             Read source code, compile and link shaders.
             Returns the compiled and linked program.
+
+                Parameters:
+                    filepath (str): compute shader source
+                    defines (dict): name -> value, #defined right
+                        after the #version line
         """
 
         with open(filepath,'r') as f:
             compute_src = f.readlines()
+
+        if defines:
+            compute_src[1:1] = [f"#define {name} {value}\n" for name, value in defines.items()]
         
         shader = compileProgram(compileShader(compute_src, GL_COMPUTE_SHADER))
         
         return shader
 
-    def recordSphere(self, i, _sphere):
+    def packScene(self, scene):
+        """
+            Record the scene's spheres, planes and lights into objectData,
+            in the order the ray tracer expects them.
 
-        # sphere: (cx cy cz r) (r g b -) (- - - -) (- - - -) (- - - -)
+                Parameters:
+                    scene (scene.Scene): scene to pack
 
-        self.objectData[20*i]     = _sphere.center[0]
-        self.objectData[20*i + 1] = _sphere.center[1]
-        self.objectData[20*i + 2] = _sphere.center[2]
+                Returns:
+                    (sphereCount, planeCount, lightCount)
+        """
 
-        self.objectData[20*i + 3] = _sphere.radius
+        spheres = list(scene.spheres)
+        planes = list(scene.planes)
+        lights = list(scene.lights)
+        for room in scene.active_rooms:
+            spheres.extend(room.spheres)
+            planes.extend(room.planes)
+            for door in room.doors:
+                planes.extend(door.planes)
+            lights.extend(room.lights)
 
-        self.objectData[20*i + 4] = _sphere.color[0]
-        self.objectData[20*i + 5] = _sphere.color[1]
-        self.objectData[20*i + 6] = _sphere.color[2]
+        sphereCount = len(spheres)
+        planeCount = len(planes)
+        lightCount = len(lights)
+        self.reserveObjects(sphereCount + planeCount + lightCount)
 
-        self.objectData[20*i + 7] = _sphere.roughness
-    
-    def recordPlane(self, i, _plane):
+        # one gather per kind of object, straight out of the stores
+        records = self.objectData.reshape(-1, 20)
+        records[:sphereCount] = sphere.SPHERES.gather(spheres)
+        records[sphereCount : sphereCount + planeCount] = plane.PLANES.gather(planes)
+        records[sphereCount + planeCount : sphereCount + planeCount + lightCount] = light.LIGHTS.gather(lights)
+
+        #slots of the objects that can move
+        self.objectSlots = {
+            sphere.SPHERES: slot_table(sphere.SPHERES, spheres, 0),
+            light.LIGHTS: slot_table(light.LIGHTS, lights, sphereCount + planeCount)
+        }
+
+        return (sphereCount, planeCount, lightCount)
+
+    def reserveObjects(self, count):
+        """
+            Make room for count objects in objectData, and for a hierarchy
+            over them in bvhData, doubling their capacity as needed.
+        """
 
-        # plane: (cx cy cz tx) (ty tz bx by) (bz nx ny nz) (umin umax vmin vmax) (r g b -)
+        capacity = len(self.objectData) // 20
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
 
-        self.objectData[20*i]     = _plane.center[0]
-        self.objectData[20*i + 1] = _plane.center[1]
-        self.objectData[20*i + 2] = _plane.center[2]
+        objectData = np.zeros(capacity * 20, dtype=np.float32)
+        objectData[:len(self.objectData)] = self.objectData
+        bvhData = np.zeros(2 * capacity * 12, dtype=np.float32)
+        bvhData[:len(self.bvhData)] = self.bvhData
+        self.resizeObjectMemory(objectData, bvhData)
 
-        self.objectData[20*i + 3] = _plane.tangent[0]
-        self.objectData[20*i + 4] = _plane.tangent[1]
-        self.objectData[20*i + 5] = _plane.tangent[2]
+    def resizeObjectMemory(self, objectData, bvhData):
+        """
+            Swap in grown copies of objectData and bvhData.
+        """
 
-        self.objectData[20*i + 6] = _plane.bitangent[0]
-        self.objectData[20*i + 7] = _plane.bitangent[1]
-        self.objectData[20*i + 8] = _plane.bitangent[2]
+        self.objectData = objectData
+        self.bvhData = bvhData
 
-        self.objectData[20*i + 9]  = _plane.normal[0]
-        self.objectData[20*i + 10] = _plane.normal[1]
-        self.objectData[20*i + 11] = _plane.normal[2]
+    def recordChanges(self, scene):
+        """
+            Bring objectData up to date with the scene. Everything is
+            repacked when the set of active objects changes, otherwise
+            only the records of the objects the scene moved are copied over.
 
-        self.objectData[20*i + 12] = _plane.uMin
-        self.objectData[20*i + 13] = _plane.uMax
-        self.objectData[20*i + 14] = _plane.vMin
-        self.objectData[20*i + 15] = _plane.vMax
+                Parameters:
+                    scene (scene.Scene): scene to pack, its moved objects are consumed
 
-        self.objectData[20*i + 16] = _plane.material_index
-    
-    def recordLight(self, i, _light):
+                Returns:
+                    (ranges, repacked): the (first, last) record ranges that
+                    changed, and whether the whole scene was repacked
+        """
+
+        moved = scene.moved
+        scene.moved = []
+
+        layout = (
+            tuple(
+                (room, len(room.spheres), len(room.planes), len(room.lights))
+                for room in scene.active_rooms
+            ),
+            len(scene.spheres), len(scene.planes), len(scene.lights)
+        )
+        if layout != self.packedLayout:
+            self.packedLayout = layout
+            self.objectCounts = self.packScene(scene)
+            return [(0, sum(self.objectCounts))], True
+
+        records = self.objectData.reshape(-1, 20)
+        slots = []
+        for _store, indices in moved:
+            table = self.objectSlots.get(_store)
+            if table is None:
+                continue
+            indices = indices[indices < len(table)]
+            packed = table[indices] >= 0
+            records[table[indices[packed]]] = _store.records[indices[packed]]
+            slots.append(table[indices[packed]])
+
+        if len(slots) == 0:
+            return [], False
+        return merge_slots(np.concatenate(slots)), False
+
+    def updateBVH(self, scene, sphereCount, planeCount):
+        """
+            Rebuild the hierarchy over the packed spheres and planes when
+            the active rooms change, otherwise refit it around moved objects.
+        """
 
-        # light: (x y z s) (r g b -) (- - - -) (- - - -) (- - - -)
+        mins, maxs = bvh.object_bounds(self.objectData, sphereCount, planeCount)
 
-        self.objectData[20*i]     = _light.position[0]
-        self.objectData[20*i + 1] = _light.position[1]
-        self.objectData[20*i + 2] = _light.position[2]
-        self.objectData[20*i + 3] = _light.strength
+        layout = (tuple(scene.active_rooms), sphereCount, planeCount)
+        if self.bvh is None or layout != self.bvhLayout:
+            self.bvh = bvh.BVH(mins, maxs)
+            self.bvhLayout = layout
+        else:
+            self.bvh.refit(mins, maxs)
 
-        self.objectData[20*i + 4] = _light.color[0]
-        self.objectData[20*i + 5] = _light.color[1]
-        self.objectData[20*i + 6] = _light.color[2]
+        self.nodeCount = self.bvh.pack(self.bvhData.reshape(-1, 12))
     
+    def updateGrid(self, scene):
+        """
+            Upload the level's grid, if it isn't the one already uploaded.
+        """
+
+        level = scene.get_grid()
+        if level is self.grid:
+            return
+        self.grid = level
+
+        self.levelPlaneBuffer.write(0, level.planeData)
+        self.uploadBuffer(self.levelPlaneBuffer)
+
+        for i, data in enumerate(level.pack_textures()):
+            height, width, _ = data.shape
+            glActiveTexture(GL_TEXTURE6 + i)
+            glBindTexture(GL_TEXTURE_2D, self.gridTextures[i])
+            glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,width,height,0,GL_RGBA,GL_FLOAT,data)
+            self.uploadedBytes += data.nbytes
+            self.totalUploadedBytes += data.nbytes
+    
+    def uploadObjects(self, ranges):
+        """
+            Copy some ranges of objectData records to the storage buffers.
+
+                Parameters:
+                    ranges (list): (first, last) record ranges to send
+        """
+
+        records = self.objectData.reshape(-1, 20)
+        sphereCount, planeCount, lightCount = self.objectCounts
+        kinds = (
+            (self.sphereBuffer, 0, sphereCount),
+            (self.planeBuffer, sphereCount, sphereCount + planeCount),
+            (self.lightBuffer, sphereCount + planeCount, sphereCount + planeCount + lightCount),
+        )
+
+        for _buffer, start, end in kinds:
+            _buffer.reserve(end - start)
+            for first, last in ranges:
+                first, last = max(first, start), min(last, end)
+                _buffer.write(first - start, records[first:last])
+            self.uploadBuffer(_buffer)
+
+    def uploadBuffer(self, _buffer):
+        """
+            Send what was written to a storage buffer since its last
+            upload into its next mapped region, and count the bytes.
+        """
+
+        sent = _buffer.readFrom()
+        self.uploadedBytes += sent
+        self.totalUploadedBytes += sent
+
     def updateScene(self, scene):
 
         scene.outDated = False
 
         glUseProgram(self.rayTracerShader)
 
-        #spheres
-        sphereCount = 0
-        objectCount = 0
-        for i,_sphere in enumerate(scene.spheres):
-            self.recordSphere(i + sphereCount + objectCount, _sphere)
-        sphereCount += len(scene.spheres)
-        for room in scene.active_rooms:
-            for i, _sphere in enumerate(room.spheres):
-                self.recordSphere(i + sphereCount + objectCount, _sphere)
-            sphereCount += len(room.spheres)
+        ranges, repacked = self.recordChanges(scene)
+        sphereCount, planeCount, lightCount = self.objectCounts
         glUniform1f(glGetUniformLocation(self.rayTracerShader, "sphereCount"), sphereCount)
-        objectCount += sphereCount
-
-        #planes
-        planeCount = 0
-        for i,_plane in enumerate(scene.planes):
-            self.recordPlane(i + planeCount + objectCount, _plane)
-        planeCount += len(scene.planes)
-        for room in scene.active_rooms:
-            for i, _plane in enumerate(room.planes):
-                self.recordPlane(i + planeCount + objectCount, _plane)
-            planeCount += len(room.planes)
-            for door in room.doors:
-                for i,_plane in enumerate(door.planes):
-                    self.recordPlane(i + planeCount + objectCount, _plane)
-                planeCount += len(door.planes)
         glUniform1f(glGetUniformLocation(self.rayTracerShader, "planeCount"), planeCount)
-        objectCount += planeCount
-
-        #lights
-        lightCount = 0
-        for i,_light in enumerate(scene.lights):
-            self.recordLight(i + lightCount + objectCount, _light)
-        lightCount += len(scene.lights)
-        for room in scene.active_rooms:
-            for i, _light in enumerate(room.lights):
-                self.recordLight(i + lightCount + objectCount, _light)
-            lightCount += len(room.lights)
         glUniform1f(glGetUniformLocation(self.rayTracerShader, "lightCount"), lightCount)
-        objectCount += lightCount
 
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,5,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
+        self.uploadObjects(ranges)
+
+        if self.useGrid:
+            self.updateGrid(scene)
+            self.nodeCount = 0
+        elif not self.useBVH:
+            self.bvh = None
+            self.nodeCount = 0
+        elif repacked or self.bvh is None or any(first < sphereCount for first, _ in ranges):
+            #only spheres and planes are in the hierarchy
+            self.updateBVH(scene, sphereCount, planeCount)
+            rows = max(self.nodeCount, sphereCount + planeCount)
+            self.bvhBuffer.write(0, self.bvhData.reshape(-1, 12)[:rows])
+            self.uploadBuffer(self.bvhBuffer)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "nodeCount"), self.nodeCount)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "useGrid"), self.useGrid)
+
+    def updateAccumulation(self, scene):
+        """
+            Start the running average over if accumulation is off, the
+            camera moved, anything in the scene changed or the resolution
+            did, then pick where this frame reads the noise.
+            Call before the scene's changes are consumed.
+        """
+
+        if not self.useAccumulation or self.useUpscaling or scene.cameraMoved or scene.outDated \
+                or self.resolutionLevel != self.accumulationLevel:
+            self.accumulatedFrames = 0
+        scene.cameraMoved = False
+        self.accumulationLevel = self.resolutionLevel
+
+        height, width = self.noiseData.shape[:2]
+        self.noiseOffset = noise.frame_offset(
+            self.accumulatedFrames, width, height, self.noiseSeed, self.noiseMethod
+        )
+        self.noisePoint = noise.frame_point(self.accumulatedFrames, self.noiseMethod)
+
+    def resetAccumulation(self):
+        """
+            Start the running average over from the next frame,
+            for changes the engine can't see, like its own settings.
+        """
+
+        self.accumulatedFrames = 0
 
     def prepareScene(self, scene):
         """
@@ -318,17 +677,42 @@ class Engine:
         glUniform3fv(glGetUniformLocation(self.rayTracerShader, "viewer.right"), 1, scene.camera.right)
         glUniform3fv(glGetUniformLocation(self.rayTracerShader, "viewer.up"), 1, scene.camera.up)
 
+        self.uploadedBytes = 0
+        self.updateAccumulation(scene)
         if scene.outDated:
             self.updateScene(scene)
+        if self.materials is not None:
+            self.updateMaterials(scene)
+
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "useAccumulation"), self.useAccumulation)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "accumulatedFrames"), self.accumulatedFrames)
+        glUniform2f(glGetUniformLocation(self.rayTracerShader, "noiseOffset"), *self.noiseOffset)
+        glUniform4f(glGetUniformLocation(self.rayTracerShader, "noisePoint"), *self.noisePoint)
+
+        self.jitter = noise.frame_jitter(self.upscaledFrames)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "useUpscaling"), self.useUpscaling)
+        glUniform2f(glGetUniformLocation(self.rayTracerShader, "jitter"), *self.jitter)
+        glUniform1f(
+            glGetUniformLocation(self.rayTracerShader, "outputWidth"),
+            self.resolutions[0][0] if self.useUpscaling else self.screenWidth
+        )
         
-        glActiveTexture(GL_TEXTURE1)
-        glBindImageTexture(1, self.objectDataTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        for _buffer in self.sceneBuffers:
+            _buffer.bind()
 
         glActiveTexture(GL_TEXTURE2)
         glBindImageTexture(2, self.noiseTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
 
         glActiveTexture(GL_TEXTURE3)
-        glBindImageTexture(3, self.megaTexture.texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        glBindTexture(GL_TEXTURE_2D, self.megaTexture.texture)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "useTextureLOD"), self.useTextureLOD)
+
+        for i, texture in enumerate(self.gridTextures):
+            glActiveTexture(GL_TEXTURE6 + i)
+            glBindImageTexture(6 + i, texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+
+        glActiveTexture(GL_TEXTURE8)
+        glBindTexture(GL_TEXTURE_2D, self.materialTable)
         
     def renderScene(self, scene):
         """
@@ -341,24 +725,125 @@ class Engine:
 
         glActiveTexture(GL_TEXTURE0)
         glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+        glBindImageTexture(
+            1, self.accumulationBuffers[self.resolutionLevel], 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA32F
+        )
+        glBindImageTexture(
+            5, self.surfaceBuffers[self.resolutionLevel], 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F
+        )
         
-        glDispatchCompute(self.screenWidth, self.screenHeight, 1)
+        localX, localY = self.localSize
+        self.frameTimer.begin("trace")
+        glDispatchCompute(-(-self.screenWidth // localX), -(-self.screenHeight // localY), 1)
+        self.frameTimer.end()
+        #the regions this frame reads can't be refilled until it's done
+        for _buffer in self.sceneBuffers:
+            _buffer.fence()
+        if self.useAccumulation:
+            self.accumulatedFrames += 1
   
         # make sure writing to image has finished before read
         glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
         glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+        glBindImageTexture(1, 0, 0, GL_FALSE, 0, GL_READ_WRITE, GL_RGBA32F)
+
+        if self.useUpscaling:
+            self.frameTimer.begin("upscale")
+            self.upscaleFrame(scene)
+            self.frameTimer.end()
+        else:
+            self.previousView = None
+            self.displayBuffer = self.colorBuffer
+            self.displaySize = (self.screenWidth, self.screenHeight)
+        self.frameTimer.endFrame(self.resolutionLevel)
         self.drawScreen()
+        self.updateResolution()
+
+    def upscaleFrame(self, scene):
+        """
+            Resolve the frame just traced into the next full resolution
+            image. The last one is reprojected from the previous camera
+            and blended in wherever it still sees the same surface.
+        """
+
+        view = scene.camera.snapshot()
+        previousView = view if self.previousView is None else self.previousView
+        history = self.upscaledBuffers[self.upscaledFrames % 2]
+        target = self.upscaledBuffers[(self.upscaledFrames + 1) % 2]
+
+        glUseProgram(self.upscalerShader)
+        for name, camera in (("viewer", view), ("previousViewer", previousView)):
+            for field, vector in zip(("position", "forwards", "right", "up"), camera):
+                glUniform3fv(glGetUniformLocation(self.upscalerShader, f"{name}.{field}"), 1, vector)
+        glUniform2f(glGetUniformLocation(self.upscalerShader, "jitter"), *self.jitter)
+        glUniform1f(glGetUniformLocation(self.upscalerShader, "historyValid"), self.previousView is not None)
+
+        images = (
+            (self.colorBuffer, GL_READ_ONLY), (self.surfaceBuffers[self.resolutionLevel], GL_READ_ONLY),
+            (history[0], GL_READ_ONLY), (history[1], GL_READ_ONLY),
+            (target[0], GL_WRITE_ONLY), (target[1], GL_WRITE_ONLY)
+        )
+        for unit, (texture, access) in enumerate(images):
+            glBindImageTexture(unit, texture, 0, GL_FALSE, 0, access, GL_RGBA32F)
+
+        width, height = self.resolutions[0]
+        localX, localY = self.localSize
+        glDispatchCompute(-(-width // localX), -(-height // localY), 1)
+        glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+        for unit, (_, access) in enumerate(images):
+            glBindImageTexture(unit, 0, 0, GL_FALSE, 0, access, GL_RGBA32F)
+
+        self.previousView = view
+        self.upscaledFrames += 1
+        self.displayBuffer = target[0]
+        self.displaySize = (width, height)
 
     def drawScreen(self):
         glUseProgram(self.shader)
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
         glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.colorBuffer)
+        glBindTexture(GL_TEXTURE_2D, self.displayBuffer)
         glBindVertexArray(self.vao)
         glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
         pg.display.flip()
     
+    def updateResolution(self):
+        """
+            Hand the frames whose times came in to the resolution controller,
+            and with useAdaptiveResolution on, switch to the level it picks.
+        """
+
+        controller = self.resolutionController
+        controller.budget = 1000.0 / self.targetFrameRate
+        for level, times in self.frameTimer.collect():
+            self.frameTimes.append((level, times))
+            controller.record(level, times.get("trace", 0.0), times.get("upscale", 0.0))
+
+        if not self.useAdaptiveResolution:
+            controller.level = self.resolutionLevel
+            return
+        level = controller.choose(self.resolutionLevel)
+        if level != self.resolutionLevel:
+            self.setResolutionLevel(level)
+
+    def resolutionStats(self):
+        """
+            Returns:
+                dict of resolution.ResolutionController.stats, with the
+                clock frames are timed by, "gpu" or "cpu", under "timer"
+                and whether the controller picks the level under "adaptive"
+        """
+
+        stats = self.resolutionController.stats()
+        stats["timer"] = self.frameTimer.kind
+        stats["adaptive"] = self.useAdaptiveResolution
+        return stats
+
     def adaptResolution(self, frameRate):
+        """
+            Step one level towards targetFrameRate from a measured frame rate,
+            useAdaptiveResolution picks levels from frame times instead.
+        """
 
         if frameRate > self.targetFrameRate + self.frameRateMargin and self.resolutionLevel > 0:
             #increase resolution
@@ -367,6 +852,14 @@ class Engine:
             #reduce resolution
             self.resolutionLevel += 1
         
+        self.setResolutionLevel(self.resolutionLevel)
+
+    def setResolutionLevel(self, level):
+        """
+            Render at self.resolutions[level] from the next frame on.
+        """
+
+        self.resolutionLevel = level
         self.screenWidth,self.screenHeight = self.resolutions[self.resolutionLevel]
         self.colorBuffer = self.colorBuffers[self.resolutionLevel]
     
@@ -377,7 +870,20 @@ class Engine:
         glUseProgram(self.rayTracerShader)
         glMemoryBarrier(GL_ALL_BARRIER_BITS)
         glDeleteProgram(self.rayTracerShader)
+        glDeleteProgram(self.upscalerShader)
         glDeleteVertexArrays(1, (self.vao,))
         glDeleteBuffers(1, (self.vbo,))
-        glDeleteTextures(1, (self.colorBuffer,))
-        glDeleteProgram(self.shader)
\ No newline at end of file
+        glDeleteTextures(len(self.colorBuffers), self.colorBuffers)
+        glDeleteTextures(len(self.accumulationBuffers), self.accumulationBuffers)
+        glDeleteTextures(len(self.surfaceBuffers), self.surfaceBuffers)
+        for frame in self.upscaledBuffers:
+            glDeleteTextures(len(frame), frame)
+        glDeleteProgram(self.shader)
+        self.frameTimer.destroy()
+        for _buffer in self.sceneBuffers:
+            _buffer.destroy()
+        self.megaTexture.destroy()
+        glDeleteTextures(1, (self.materialTable,))
+        glDeleteTextures(len(self.gridTextures), self.gridTextures)
+        if self.materials is not None:
+            self.materials.destroy()
\ No newline at end of file
@@ -1,3 +1,5 @@
+from config import *
+from collections import deque
 import room
 import door
 import plane
@@ -46,17 +48,20 @@ def get_lumped_geometry_from(array):
 
 def make_rooms(walls, doors, rooms):
     """
-        Perform Depth First search to partition the empty space
+        Perform Breadth First search to partition the empty space
         into rooms.
 
         Add planes to rooms.
     """
 
-    #list of coordinates to search.
-    coordinates_to_expand = []
-    #history of coordinates which have already been searched.
-    expanded_coordinates = []
+    #queue of coordinates to search.
+    coordinates_to_expand = deque()
+    #coordinates which have already been searched.
+    expanded_coordinates = set()
+    #order in which doors were searched, see forget_doors
+    history = []
     empty_blocks = (0, "d")
+    door_lookup = {_door.coordinate: _door for _door in doors}
 
     #get the first open block to search from
     starting_coordinate = get_new_room(walls, expanded_coordinates)
@@ -65,22 +70,26 @@ def make_rooms(walls, doors, rooms):
         #start looking in a new room
         coordinates_to_expand.append(starting_coordinate)
         #empty blocks can be 0 or "d", but doors can be expanded from both sides,
-        #so remove any doors currently in history.
-        for i,coordinate in enumerate(expanded_coordinates):
-            row, col = coordinate
-            if walls[row][col] == "d":
-                expanded_coordinates.pop(i)
+        #so remove doors from the history.
+        forget_doors(history, expanded_coordinates)
         newRoom = room.Room()
+        internalCoordinates = set()
+        coordinates = set()
     
         #keep expanding empty space within the room, until done.
         while len(coordinates_to_expand) > 0:
 
-            searched_coordinate = coordinates_to_expand.pop(0)
+            searched_coordinate = coordinates_to_expand.popleft()
             if searched_coordinate in expanded_coordinates:
                 #just in case the algorithm tells us to search
                 #the same space twice.
                 continue
-            expanded_coordinates.append(searched_coordinate)
+            expanded_coordinates.add(searched_coordinate)
+            row, col = searched_coordinate
+            if walls[row][col] == "d":
+                history.append(searched_coordinate)
+            elif len(history) == 0 or history[-1] is not None:
+                history.append(None)
             neighbors = expand(walls, searched_coordinate, expanded_coordinates)
             
             for coordinate in neighbors:
@@ -95,12 +104,9 @@ def make_rooms(walls, doors, rooms):
                     #If we're on a door then search to see if the door already exists
                     #(doors can belong to multiple rooms)
                     if walls[row][col] == "d":
-                        alreadyExists = False
-                        for _door in doors:
-                            if coordinate == _door.coordinate:
-                                alreadyExists = True
+                        newDoor = door_lookup.get(coordinate)
                         
-                        if not alreadyExists:
+                        if newDoor is None:
                             #make a door, build the central planes,
                             #then build the external planes
                             newDoor = door.Door(coordinate)
@@ -120,28 +126,54 @@ def make_rooms(walls, doors, rooms):
                                 make_west_wall(row, col + 1, 7,newDoor)
                             
                             doors.append(newDoor)
-                            newRoom.doors.append(newDoor)
-                        else:
-                            #a door exists, find the instance of the door, and add it to the
-                            #current room
-                            newDoor = get_door_by_coordinate(doors, coordinate)
-                            newRoom.doors.append(newDoor)
+                            door_lookup[coordinate] = newDoor
 
-                        
-                    if coordinate not in newRoom.internalCoordinates:
+                        #a door can be added to the same room more than once
+                        newRoom.doors.append(newDoor)
+
+                    if coordinate not in internalCoordinates:
+                        internalCoordinates.add(coordinate)
                         newRoom.internalCoordinates.append(coordinate)
 
-                elif coordinate not in newRoom.coordinates:
+                elif coordinate not in coordinates:
+                    coordinates.add(coordinate)
                     newRoom.coordinates.append(coordinate)
 
         #this room has been fully expanded, add it to the set
         #of rooms, then attempt to start a new room.
         rooms.append(newRoom)
-        starting_coordinate = get_new_room(walls, expanded_coordinates)
+        starting_coordinate = get_new_room(walls, expanded_coordinates, starting_coordinate)
 
-def get_new_room(walls, expanded_coordinates):
+def forget_doors(history, expanded_coordinates):
     """
-        Search the set of rooms and if an empty space is found
+        Remove the searched doors from the set of expanded coordinates,
+        so the next room can expand them too.
+
+        Room output has always depended on the way doors used to be
+        removed from the search history list: popping while enumerating
+        skips the entry after each removed door, so a door searched right
+        after another one stays expanded. That is kept here, on a history
+        holding door coordinates, with None standing in for any run of
+        other searched coordinates.
+    """
+
+    kept = []
+    skip = False
+    for coordinate in history:
+        if skip or coordinate is None:
+            skip = False
+            if coordinate is None and len(kept) > 0 and kept[-1] is None:
+                continue
+            kept.append(coordinate)
+        else:
+            expanded_coordinates.discard(coordinate)
+            skip = True
+    
+    history[:] = kept
+
+def get_new_room(walls, expanded_coordinates, start = (0, 0)):
+    """
+        Search the map, from start onwards, and if an empty space is found
         that hasn't been searched, return that coordinate.
         Otherwise, return None
     """
@@ -150,8 +182,9 @@ def get_new_room(walls, expanded_coordinates):
     rows = len(walls)
     cols = len(walls[0])
 
-    for row in range(rows):
-        for col in range(cols):
+    first_row, first_col = start
+    for row in range(first_row, rows):
+        for col in range(first_col if row == first_row else 0, cols):
             if walls[row][col] == 0:
                 possible_solution = (row,col)
                 if possible_solution not in expanded_coordinates:
@@ -292,6 +325,95 @@ def make_floor(row, col, material, target):
         )
     )
 
+def merge_planes(planes):
+    """
+        Greedily fuse coplanar, adjacent unit faces with the same material
+        into larger rectangles, row by row then column by column.
+        Texture coordinates repeat every unit, so merged planes still show
+        one tile per cell. Planes that aren't unit squares are kept as is.
+
+            Parameters:
+                planes (list of plane.Plane)
+
+            Returns:
+                new list of planes, the ones merged away are destroyed
+    """
+
+    records = plane.PLANES.gather(planes)
+
+    groups = {}
+    merged = []
+    replaced = []
+    for i, _plane in enumerate(planes):
+
+        record = records[i]
+        uMin, uMax, vMin, vMax = record[3:16:4]
+        if uMax - uMin != 1 or vMax - vMin != 1:
+            merged.append(_plane)
+            continue
+
+        # plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (material - - -)
+        center = record[0:3]
+        tangent = record[4:7]
+        bitangent = record[8:11]
+        normal = record[12:15]
+        key = (
+            tuple(tangent), tuple(bitangent), tuple(normal), record[16],
+            round(float(np.dot(center, normal)), 4)
+        )
+        #lower corner of the face, in units along the tangent and bitangent
+        cell = (
+            int(round(float(np.dot(center, tangent) + uMin))),
+            int(round(float(np.dot(center, bitangent) + vMin)))
+        )
+        groups.setdefault(key, set()).add(cell)
+        replaced.append(_plane)
+
+    for key, cells in groups.items():
+
+        tangent, bitangent, normal, material, offset = key
+        tangent = np.array(tangent)
+        bitangent = np.array(bitangent)
+        normal = np.array(normal)
+
+        for cell in sorted(cells, key = lambda cell: (cell[1], cell[0])):
+
+            if cell not in cells:
+                continue
+            u, v = cell
+
+            width = 1
+            while (u + width, v) in cells:
+                width += 1
+            height = 1
+            while all((u + i, v + height) in cells for i in range(width)):
+                height += 1
+
+            for j in range(height):
+                for i in range(width):
+                    cells.discard((u + i, v + j))
+
+            merged.append(
+                plane.Plane(
+                    normal = normal,
+                    tangent = tangent,
+                    bitangent = bitangent,
+                    uMin = -width / 2,
+                    uMax = width / 2,
+                    vMin = -height / 2,
+                    vMax = height / 2,
+                    center = (u + width / 2) * tangent
+                        + (v + height / 2) * bitangent
+                        + offset * normal,
+                    material_index = material
+                )
+            )
+
+    for _plane in replaced:
+        _plane.destroy()
+
+    return merged
+
 def get_door_by_coordinate(doors, coordinate):
 
     for _door in doors:
@@ -0,0 +1,123 @@
+"""
+    Uniform grid over the level's planes, one cell per map tile.
+
+    Rays walk it cell by cell (Amanatides & Woo) and only test the planes
+    registered in the cells they pass through, so their cost depends on
+    how far they travel rather than on the size of the level.
+
+    Planes are packed like the plane records in objectData:
+    plane: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (material - - -)
+    A plane is registered in every cell its rectangle touches, planes lying
+    on the boundary between two cells are registered in both.
+"""
+
+from config import *
+import geometry
+import room
+import plane
+
+INDICES_PER_ROW = 1024
+EPSILON = 0.0001
+
+def pack_planes(planes):
+    """
+        Pack a list of plane.Plane into (n, 20) records.
+    """
+
+    return plane.PLANES.gather(planes)
+
+def cell_range(low, high, size):
+    """
+        Cells along one axis touched by the interval [low, high].
+        A zero width interval on a cell boundary touches both neighbours.
+    """
+
+    if high - low < EPSILON:
+        first = int(np.floor(low - EPSILON))
+        last = int(np.floor(high + EPSILON))
+    else:
+        first = int(np.floor(low + EPSILON))
+        last = int(np.floor(high - EPSILON))
+
+    return range(max(first, 0), min(last, size - 1) + 1)
+
+class Grid:
+    """
+        Planes of a whole level, bucketed by map cell.
+    """
+
+    def __init__(self, walls, floors, ceilings, doors, merge_faces = False):
+        """
+            Build the level's planes from the map and bucket them.
+
+                Parameters:
+                    walls, floors, ceilings (list of lists): map data, as in scene.Scene
+                    doors (list of door.Door): the level's doors, with their planes
+                    merge_faces (bool): fuse adjacent coplanar faces, see geometry.merge_planes
+        """
+
+        self.rows = len(walls)
+        self.cols = len(walls[0])
+
+        level = room.Room()
+        wall_mask = geometry.get_lumped_geometry_from(walls)
+        for row in range(self.rows):
+            for col in range(self.cols):
+                geometry.get_geometry_at_point(
+                    row, col, level, wall_mask, walls, floors, ceilings
+                )
+        if merge_faces:
+            level.planes = geometry.merge_planes(level.planes)
+        for _door in doors:
+            level.planes.extend(_door.planes)
+
+        self.planeData = pack_planes(level.planes)
+        self.bucket(self.planeData)
+
+    def bucket(self, records):
+        """
+            Register every plane in the cells it touches.
+        """
+
+        center = records[:, 0:3]
+        tangent = records[:, 4:7]
+        bitangent = records[:, 8:11]
+        corners = np.stack([
+            center + tangent * records[:, 3 + 4 * u : 4 + 4 * u] + bitangent * records[:, 11 + 4 * v : 12 + 4 * v]
+            for u in (0, 1) for v in (0, 1)
+        ])
+        mins = corners.min(axis = 0)
+        maxs = corners.max(axis = 0)
+
+        cells = [[] for _ in range(self.rows * self.cols)]
+        for i in range(len(records)):
+            for row in cell_range(mins[i, 1], maxs[i, 1], self.rows):
+                for col in cell_range(mins[i, 0], maxs[i, 0], self.cols):
+                    cells[row * self.cols + col].append(i)
+
+        self.cellCount = np.array([len(cell) for cell in cells], dtype=np.int32)
+        self.cellStart = np.concatenate(([0], np.cumsum(self.cellCount)[:-1])).astype(np.int32)
+        self.cellPlanes = np.array(
+            [i for cell in cells for i in cell], dtype=np.int32
+        )
+
+    def pack_textures(self):
+        """
+            Lay the grid's lookup tables out as two RGBA32F images for the shader,
+            planeData goes to a storage buffer as it is.
+
+                Returns:
+                    cells: one (start count - -) texel per map cell
+                    indices: one plane index per texel, INDICES_PER_ROW per row
+        """
+
+        cells = np.zeros((self.rows, self.cols, 4), dtype=np.float32)
+        cells[:, :, 0] = self.cellStart.reshape(self.rows, self.cols)
+        cells[:, :, 1] = self.cellCount.reshape(self.rows, self.cols)
+
+        indexRows = max(1, -(-len(self.cellPlanes) // INDICES_PER_ROW))
+        indices = np.zeros((indexRows * INDICES_PER_ROW, 4), dtype=np.float32)
+        indices[:len(self.cellPlanes), 0] = self.cellPlanes
+        indices = indices.reshape(indexRows, INDICES_PER_ROW, 4)
+
+        return cells, indices
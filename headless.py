@@ -0,0 +1,92 @@
+"""
+    OpenGL without a window.
+
+    Creates a surfaceless EGL context, which Mesa provides even on machines
+    without a GPU (llvmpipe), so engine.Engine can run from scripts and
+    benchmarks. PyOpenGL picks its platform when it is first imported,
+    so this module has to be imported before config.
+"""
+
+import os
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import ctypes
+from OpenGL import EGL
+from config import *
+import engine
+
+def create_context():
+    """
+        Make an OpenGL 4.3 core context current on this thread.
+
+            Returns:
+                (display, context)
+    """
+
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("could not initialize EGL")
+
+    attributes = (EGL.EGLint * 5)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE
+    )
+    config = EGL.EGLConfig()
+    count = EGL.EGLint()
+    EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+    attributes = (EGL.EGLint * 7)(
+        EGL.EGL_CONTEXT_MAJOR_VERSION, 4,
+        EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+        EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+        EGL.EGL_NONE
+    )
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, attributes)
+    if context == EGL.EGL_NO_CONTEXT:
+        raise RuntimeError("could not create an OpenGL 4.3 context")
+    EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context)
+
+    return display, context
+
+def destroy_context(display, context):
+
+    EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+    EGL.eglDestroyContext(display, context)
+    EGL.eglTerminate(display)
+
+class HeadlessEngine(engine.Engine):
+    """
+        Engine that leaves each frame in its color buffer
+        instead of drawing it to a window.
+    """
+
+    def drawScreen(self):
+
+        glFinish()
+
+    def readColorBuffer(self):
+        """
+            Returns:
+                np.ndarray (height, width, 4) float32 of the last frame,
+                row 0 at the bottom
+        """
+
+        glBindTexture(GL_TEXTURE_2D, self.colorBuffer)
+        pixels = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+        return np.frombuffer(pixels, dtype=np.float32).reshape(self.screenHeight, self.screenWidth, 4)
+
+    def readDisplayBuffer(self):
+        """
+            Returns:
+                np.ndarray (height, width, 4) float32 of what the last
+                frame put on screen, upscaled if the upscaler ran
+        """
+
+        width, height = self.displaySize
+        glBindTexture(GL_TEXTURE_2D, self.displayBuffer)
+        pixels = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+        return np.frombuffer(pixels, dtype=np.float32).reshape(height, width, 4)
@@ -0,0 +1,229 @@
+"""
+    Compiled levels on disk.
+
+    Building a level from its map (rooms, doors, planes, the grid) gets
+    slow on large maps, so the result is written to a versioned binary
+    file, named after a hash of the map data, and mapped straight back in
+    on the next launch. Editing the map changes the hash, so a stale
+    file is simply never looked at again.
+
+    File layout:
+    magic (8 bytes) | version (uint32) | header size (uint32) | JSON header
+    followed by the arrays, each starting on a 64 byte boundary.
+    The header lists every array's dtype, shape and offset.
+"""
+
+from config import *
+import os
+import json
+import hashlib
+import storage
+import plane
+import door
+import room
+import grid
+
+MAGIC = b"RTLEVEL\0"
+VERSION = 2
+ALIGNMENT = 64
+
+def level_key(walls, floors, ceilings, merge_faces):
+    """
+        Hash of everything a compiled level is built from.
+    """
+
+    source = json.dumps(
+        [VERSION, walls, floors, ceilings, bool(merge_faces)], separators = (",", ":")
+    )
+    return hashlib.sha1(source.encode()).hexdigest()
+
+def write(path, meta, arrays):
+    """
+        Write a header and a set of named arrays into one file.
+        The file is written next to its destination and moved into place,
+        so readers never see a partial file, and an interrupted write
+        leaves nothing behind.
+    """
+
+    header = {"meta": meta, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    headerBytes = json.dumps(header).encode()
+    start = 16 + len(headerBytes)
+    start += -start % ALIGNMENT
+    headerBytes += b" " * (start - 16 - len(headerBytes))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as file:
+            file.write(MAGIC)
+            file.write(np.array([VERSION, len(headerBytes)], dtype="<u4").tobytes())
+            file.write(headerBytes)
+            for name, array in arrays.items():
+                _, _, arrayOffset = header["arrays"][name]
+                file.seek(start + arrayOffset)
+                file.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+            file.truncate(start + offset)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def read(path):
+    """
+        Map a file written by write.
+
+            Returns:
+                (meta, {name: read only np.memmap}), or None if the file
+                is missing, from another version, or damaged
+    """
+
+    try:
+        with open(path, "rb") as file:
+            if file.read(8) != MAGIC:
+                return None
+            version, headerSize = np.frombuffer(file.read(8), dtype="<u4")
+            if version != VERSION:
+                return None
+            header = json.loads(file.read(headerSize))
+
+        start = 16 + int(headerSize)
+        size = os.path.getsize(path)
+        arrays = {}
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            if start + offset + count * dtype.itemsize > size:
+                #cut short, by a full disk or a copy that didn't finish
+                return None
+            if count == 0:
+                arrays[name] = np.zeros(shape, dtype = dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype = dtype, mode = "r", offset = start + offset, shape = tuple(shape)
+                )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return header["meta"], arrays
+
+def offsets(lengths):
+    """
+        Start of each run and the end of the last, for runs of the given lengths.
+    """
+
+    return np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+def save_level(scene, path):
+    """
+        Compile the scene's rooms and doors into a level file.
+    """
+
+    doorIndex = {id(_door): i for i, _door in enumerate(scene.doors)}
+    roomPlanes = [_plane for _room in scene.rooms for _plane in _room.planes]
+    doorPlanes = [_plane for _door in scene.doors for _plane in _door.planes]
+
+    def coordinates(lists):
+        flat = [coordinate for _list in lists for coordinate in _list]
+        return np.array(flat, dtype=np.int32).reshape(-1, 2)
+
+    arrays = {
+        "planes": plane.PLANES.gather(roomPlanes + doorPlanes),
+        "roomPlanes": offsets([len(_room.planes) for _room in scene.rooms]),
+        "doorPlanes": offsets([len(_door.planes) for _door in scene.doors]),
+        "roomCoordinates": coordinates([_room.coordinates for _room in scene.rooms]),
+        "roomCoordinateStart": offsets([len(_room.coordinates) for _room in scene.rooms]),
+        "roomInternal": coordinates([_room.internalCoordinates for _room in scene.rooms]),
+        "roomInternalStart": offsets([len(_room.internalCoordinates) for _room in scene.rooms]),
+        "doorCoordinates": coordinates([[_door.coordinate for _door in scene.doors]]),
+        "roomDoors": np.array(
+            [doorIndex[id(_door)] for _room in scene.rooms for _door in _room.doors], dtype=np.int32
+        ),
+        "roomDoorStart": offsets([len(_room.doors) for _room in scene.rooms]),
+    }
+    write(path, {"kind": "level"}, arrays)
+
+def load_level(scene, path):
+    """
+        Fill in the scene's rooms, doors and room lookup from a level file.
+
+            Returns:
+                whether the file could be used
+    """
+
+    compiled = read(path)
+    if compiled is None or compiled[0].get("kind") != "level":
+        return False
+    _, arrays = compiled
+
+    planeIndices = plane.PLANES.extend(arrays["planes"])
+    planes = storage.views(plane.Plane, planeIndices)
+    roomPlanes = arrays["roomPlanes"]
+    doorPlanes = arrays["doorPlanes"] + roomPlanes[-1]
+
+    def coordinates(flat, start, i):
+        return [tuple(coordinate) for coordinate in flat[start[i] : start[i + 1]].tolist()]
+
+    doors = []
+    for i, coordinate in enumerate(arrays["doorCoordinates"].tolist()):
+        _door = door.Door(tuple(coordinate))
+        _door.planes = planes[doorPlanes[i] : doorPlanes[i + 1]]
+        doors.append(_door)
+
+    rooms = []
+    roomDoors = arrays["roomDoors"].tolist()
+    roomDoorStart = arrays["roomDoorStart"]
+    for i in range(len(roomPlanes) - 1):
+        _room = room.Room()
+        _room.planes = planes[roomPlanes[i] : roomPlanes[i + 1]]
+        _room.coordinates = coordinates(arrays["roomCoordinates"], arrays["roomCoordinateStart"], i)
+        _room.internalCoordinates = coordinates(arrays["roomInternal"], arrays["roomInternalStart"], i)
+        _room.doors = [doors[j] for j in roomDoors[roomDoorStart[i] : roomDoorStart[i + 1]]]
+        rooms.append(_room)
+
+    scene.doors.extend(doors)
+    scene.rooms.extend(rooms)
+    for _room in rooms:
+        for coordinate in _room.internalCoordinates:
+            scene.room_lookup[coordinate] = _room
+
+    return True
+
+def save_grid(level, path):
+    """
+        Write a level's grid.Grid into a grid file.
+    """
+
+    arrays = {
+        "planeData": level.planeData,
+        "cellStart": level.cellStart,
+        "cellCount": level.cellCount,
+        "cellPlanes": level.cellPlanes,
+    }
+    write(path, {"kind": "grid", "rows": level.rows, "cols": level.cols}, arrays)
+
+def load_grid(path):
+    """
+        Map a grid file back in.
+
+            Returns:
+                grid.Grid, or None if the file could not be used
+    """
+
+    compiled = read(path)
+    if compiled is None or compiled[0].get("kind") != "grid":
+        return None
+    meta, arrays = compiled
+
+    level = grid.Grid.__new__(grid.Grid)
+    level.rows = meta["rows"]
+    level.cols = meta["cols"]
+    for name, array in arrays.items():
+        setattr(level, name, array)
+
+    return level
@@ -1,14 +1,33 @@
 from config import *
+import storage
+import animation
+
+# record: (x y z s) (r g b -)
+# state:  (t) (center xyz) (axis xyz) (radius) (velocity)
+LIGHTS = storage.Store(stateSize = 9)
 
 class Light:
     """
-        Represents a light in the scene
+        Represents a light in the scene, as a view of its row in LIGHTS
     """
 
+    __slots__ = ("index",)
+
+    store = LIGHTS
+
+    position = storage.Column("records", 0, 3)
+    strength = storage.Column("records", 3)
+    color = storage.Column("records", 4, 7)
+
+    t = storage.Column("state", 0)
+    center = storage.Column("state", 1, 4)
+    axis = storage.Column("state", 4, 7)
+    radius = storage.Column("state", 7)
+    velocity = storage.Column("state", 8)
 
     def __init__(self, position, color, strength, axis, radius, velocity):
         """
-            Create a new plane
+            Create a new light
 
             Parameters:
                 position (array [3,1])
@@ -16,16 +35,30 @@ class Light:
                 strength float
         """
 
-        self.position = np.array(position, dtype=np.float32)
-        self.color = np.array(color, dtype=np.float32)
+        self.index = self.store.allocate(self)
+        self.position = position
+        self.color = color
         self.strength = strength
         self.t = 0
-        self.center = np.array(position, dtype=np.float32)
-        self.axis = np.array(axis, dtype=np.float32)
+        self.center = position
+        self.axis = axis
         self.radius = radius
         self.velocity = velocity
     
+    def destroy(self):
+        """
+            Give the light's row back to LIGHTS, the light can't be used after.
+        """
+
+        index = getattr(self, "index", None)
+        if index is not None:
+            del self.index
+            self.store.release(index, self)
+
+    def __del__(self):
+
+        self.destroy()
+    
     def update(self, rate):
 
-        self.t += rate
-        self.position = self.center + self.radius * self.axis * np.sin(self.velocity * self.t)
\ No newline at end of file
+        animation.animate(self.store, np.array([self.index]), rate)
@@ -1,51 +1,347 @@
+"""
+    Streaming of material textures.
+
+    Only the materials near the camera are kept resident, in an atlas of
+    fixed size (the memory budget). Materials are stored at one of several
+    detail levels, each half the size of the one above, and the atlas is
+    carved up like a quadtree: a region that fits a material at size s
+    splits into four regions that fit size s / 2. Regions of size s are
+    2.5 s wide and s high, the packed layout of megatexture.py.
+
+    The table holds one (x y size -) row per material, size 0 for
+    materials that aren't resident. The shader and cpu_tracer read it to
+    find each material in the atlas.
+
+    Levels are read from disk (baked on first use) on a background thread,
+    then copied into the atlas by update() on the rendering thread, along
+    with the smaller levels that make up the material's part of the
+    atlas' mip chain.
+"""
+
 from config import *
+import queue
+import logging
+import threading
+from collections import OrderedDict
+import megatexture
+import plane
+
+log = logging.getLogger(__name__)
 
 class Material:
-        
-    def __init__(self, minDetail: int, maxDetail: int):
+    """
+        Residency state of one material.
+    """
+
+    def __init__(self, name: str, minDetail: int, maxDetail: int):
+        """
+            Parameters:
+                name (str): folder name under textures/
+                minDetail, maxDetail (int): smallest and largest side length,
+                    both included, each level doubles the last
+        """
 
+        self.name = name
         self.detailLevel = 0
         size = minDetail
-        self.textures: list[int] = []
         self.sizes: list[int] = []
-        while size < maxDetail:
-            newTexture = glGenTextures(1)
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, newTexture)
-
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-
-        
-            glTexStorage2D(GL_TEXTURE_2D, 1, GL_RGBA32F, size, size)
-            self.textures.append(newTexture)
+        while size <= maxDetail:
             self.sizes.append(size)
             size *= 2
-    
+
+        #level and (x, y) of the copy in the atlas, None if not resident
+        self.residentLevel = None
+        self.region = None
+        #level being read by the loader thread
+        self.loadingLevel = None
+
     def upsize(self) -> None:
         """
             Attempt to increase detail level
         """
-        self.detailLevel = min(len(self.textures) - 1, self.detailLevel + 1)
-    
+        self.detailLevel = min(len(self.sizes) - 1, self.detailLevel + 1)
+
     def downsize(self) -> None:
         """
             Attempt to decrease detail level
         """
         self.detailLevel = max(0, self.detailLevel - 1)
-    
-    def writeTo(self) -> None:
 
-        glActiveTexture(GL_TEXTURE0)
-        glBindImageTexture(0, self.textures[self.detailLevel], 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+class MaterialManager:
+    """
+        Keeps the materials of the active rooms, and of the rooms
+        behind their doors, resident in a budgeted atlas.
+    """
+
+    def __init__(self, filenames, budget = 64 * 1024 * 1024, minDetail = 64, maxDetail = 1024,
+                 prefetchDetail = 1, cache_dir = "cache"):
+        """
+            Parameters:
+                filenames (list of str): material folder names under textures/,
+                    material k is filenames[-1 - k] like in megatexture.load_atlas
+                budget (int): bytes of atlas memory, mips included, rounded
+                    down to whole maxDetail bands but at least one
+                minDetail, maxDetail (int): range of detail levels, powers of two
+                prefetchDetail (int): levels below full detail to load the
+                    materials of neighbouring rooms at
+                cache_dir (str): folder for baked detail levels
+        """
+
+        self.materials = [Material(name, minDetail, maxDetail) for name in filenames[::-1]]
+        self.maxDetail = maxDetail
+        self.prefetchDetail = prefetchDetail
+        self.cache_dir = cache_dir
+
+        width = int(megatexture.ATLAS_TILES * maxDetail)
+        levels = range(megatexture.mip_count(maxDetail))
+        bandBytes = sum((width >> level) * (maxDetail >> level) * 4 for level in levels)
+        bands = max(1, budget // bandBytes)
+        #mip chain, largest first
+        self.atlas = [
+            np.full(((bands * maxDetail) >> level, width >> level, 4), 255, dtype=np.uint8)
+            for level in levels
+        ]
+        self.table = np.zeros((len(self.materials), 4), dtype=np.float32)
+
+        #free regions by size, top level bands to start with
+        self.free = {size: set() for size in self.materials[0].sizes} if self.materials else {}
+        self.free[maxDetail] = {(0, band * maxDetail) for band in range(bands)}
+
+        #resident material indices, least recently needed first
+        self.recent = OrderedDict()
+        #set whenever the table changes, cleared by whoever uploads it
+        self.tableChanged = True
+        self.needed = set()
+        self.rooms = None
+
+        self.requests = queue.Queue()
+        self.loaded = queue.Queue()
+        self.loader = threading.Thread(target = self.load, daemon = True)
+        self.loader.start()
+
+    def load(self):
+        """
+            Loader thread: read requested levels until told to stop.
+        """
+
+        while True:
+            job = self.requests.get()
+            if job is None:
+                self.requests.task_done()
+                return
+            index, level = job
+            _material = self.materials[index]
+            try:
+                levels = megatexture.cached_material(
+                    _material.name, self.cache_dir, self.maxDetail, megatexture.MIN_MIP_SIZE
+                )
+                first = [len(band) for band in levels].index(_material.sizes[level])
+                chain = [np.array(band) for band in levels[first : first + len(self.atlas)]]
+            except Exception:
+                #missing maps, a corrupt cache or a chain without this size:
+                #report it and keep serving requests, update() sees chain None
+                log.exception("could not load level %d of material %s", level, _material.name)
+                chain = None
+            self.loaded.put((index, level, chain))
+            self.requests.task_done()
+
+    def request(self, scene):
+        """
+            Work out which materials the scene needs, and at which level,
+            and queue loads for the ones that aren't resident at that level yet.
+        """
+
+        if self.rooms == scene.active_rooms:
+            return
+        self.rooms = list(scene.active_rooms)
+
+        neighbours = []
+        for door in {id(door): door for room in self.rooms for door in room.doors}.values():
+            for room in scene.rooms:
+                if room not in self.rooms and room not in neighbours and door in room.doors:
+                    neighbours.append(room)
+
+        wanted = {}
+        for rooms, drop in ((neighbours, self.prefetchDetail), (self.rooms, 0)):
+            planes = [_plane for room in rooms for _plane in room.planes]
+            planes += [_plane for room in rooms for door in room.doors for _plane in door.planes]
+            indices = np.unique(material_indices(planes)).tolist()
+            for index in indices:
+                if 0 <= index < len(self.materials):
+                    wanted[index] = len(self.materials[index].sizes) - 1 - drop
+
+        self.needed = set(wanted)
+        for index, level in wanted.items():
+            _material = self.materials[index]
+            #keep a sharper copy that is already resident, if there is room
+            resident = -1 if _material.residentLevel is None else _material.residentLevel
+            _material.detailLevel = max(0, level, resident)
+            if index in self.recent:
+                self.recent.move_to_end(index)
+        self.fit(wanted)
+
+        for index in wanted:
+            _material = self.materials[index]
+            if _material.detailLevel != _material.residentLevel \
+                and _material.loadingLevel != _material.detailLevel:
+                _material.loadingLevel = _material.detailLevel
+                self.requests.put((index, _material.detailLevel))
+
+    def fit(self, indices):
+        """
+            Lower detail levels, largest first, until the given materials
+            fit in the atlas together.
+        """
+
+        capacity = len(self.atlas[0]) * self.maxDetail
+        materials = [self.materials[index] for index in indices]
+        area = sum(_material.sizes[_material.detailLevel] ** 2 for _material in materials)
+
+        while area > capacity:
+            largest = max(materials, key = lambda _material: _material.sizes[_material.detailLevel])
+            if largest.detailLevel == 0:
+                return
+            area -= 3 * largest.sizes[largest.detailLevel] ** 2 // 4
+            largest.downsize()
+
+    def update(self):
+        """
+            Copy finished loads into the atlas.
+
+                Returns:
+                    list of (x, y, width, height) atlas rectangles that changed
+        """
+
+        changed = []
+        while True:
+            try:
+                index, level, chain = self.loaded.get_nowait()
+            except queue.Empty:
+                return changed
+
+            _material = self.materials[index]
+            if _material.loadingLevel == level:
+                _material.loadingLevel = None
+            if chain is None:
+                #failed, it stays flat grey or at the level it has, and
+                #request() asks again the next time the rooms change
+                continue
+            resident = _material.residentLevel
+            if level == resident or (resident is not None and resident > level != _material.detailLevel):
+                continue
+
+            size = _material.sizes[level]
+            if resident is not None and resident > level:
+                #a smaller copy always fits where the larger one was
+                self.release(index)
+                region = self.allocate(size)
+            else:
+                region = self.allocate(size)
+                if region is None:
+                    #no room at this level, settle for the next one down
+                    _material.detailLevel = level
+                    _material.downsize()
+                    if _material.detailLevel < level and resident is None:
+                        _material.loadingLevel = _material.detailLevel
+                        self.requests.put((index, _material.detailLevel))
+                    continue
+                if resident is not None:
+                    self.release(index)
+
+            x, y = region
+            height, width = chain[0].shape[:2]
+            for mip, pixels in enumerate(chain):
+                if len(pixels) < megatexture.MIN_MIP_SIZE:
+                    break
+                left, top = x >> mip, y >> mip
+                self.atlas[mip][top : top + len(pixels), left : left + pixels.shape[1]] = pixels
+            _material.residentLevel = level
+            _material.region = region
+            self.table[index] = (x, y, size, 0)
+            self.tableChanged = True
+            self.recent[index] = True
+            self.recent.move_to_end(index)
+            changed.append((x, y, width, height))
+
+    def wait(self):
+        """
+            Block until every queued load has finished,
+            the next update() applies them.
+        """
+
+        self.requests.join()
+
+    def allocate(self, size):
+        """
+            Find a free region for a material of the given size, splitting
+            larger regions and evicting the least recently needed materials
+            as necessary.
+
+                Returns:
+                    (x, y) of the region, or None if the needed materials
+                    already fill the atlas
+        """
+
+        while True:
+            region = self.split(size)
+            if region is not None:
+                return region
+            victim = next((index for index in self.recent if index not in self.needed), None)
+            if victim is None:
+                return None
+            self.release(victim)
+
+    def split(self, size):
+
+        if size not in self.free:
+            return None
+        if self.free[size]:
+            return self.free[size].pop()
+
+        parent = self.split(size * 2)
+        if parent is None:
+            return None
+        x, y = parent
+        width = int(megatexture.ATLAS_TILES * size)
+        self.free[size].update({(x + width, y), (x, y + size), (x + width, y + size)})
+        return (x, y)
+
+    def release(self, index):
+        """
+            Give a material's region back, merging it with its free siblings.
+        """
+
+        _material = self.materials[index]
+        size = _material.sizes[_material.residentLevel]
+        x, y = _material.region
+        _material.residentLevel = None
+        _material.region = None
+        self.table[index] = 0
+        self.tableChanged = True
+        self.recent.pop(index, None)
+
+        while size < self.maxDetail:
+            width = int(megatexture.ATLAS_TILES * size)
+            left = x - x % (2 * width)
+            top = y - y % (2 * size)
+            siblings = {(left, top), (left + width, top), (left, top + size), (left + width, top + size)}
+            siblings.discard((x, y))
+            if not siblings <= self.free[size]:
+                break
+            self.free[size] -= siblings
+            x, y, size = left, top, size * 2
+
+        self.free[size].add((x, y))
+
+    def destroy(self):
 
-    def readFrom(self) -> None:
+        self.requests.put(None)
+        self.loader.join()
 
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.textures[self.detailLevel])
-    
-    def destroy(self) -> None:
+def material_indices(planes):
+    """
+        Material indices of a list of plane.Plane.
+    """
 
-        glDeleteTextures(len(self.textures), self.textures)
\ No newline at end of file
+    rows = np.fromiter((_plane.index for _plane in planes), dtype=np.int64, count = len(planes))
+    return plane.PLANES.records[rows, 16].astype(np.int64)
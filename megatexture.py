@@ -1,43 +1,327 @@
+"""
+    Material textures, packed into one RGBA8 atlas.
+
+    Each material occupies a band of texture_size rows holding two full
+    size tiles and one half size tile:
+    tile 0: (albedo.r albedo.g albedo.b gloss)
+    tile 1: (normal.x normal.y specular -), normal.z = sqrt(1 - x^2 - y^2)
+    tile 2: (emissive.r emissive.g emissive.b -) at half resolution,
+        in the first texture_size / 2 rows of the band
+    Normals are stored unit length in [0, 1] like the source maps,
+    specular is stored as the mean of its channels.
+
+    The atlas carries its own mip chain, each level a 2x2 box filter of
+    the last, so a material of size s at (x, y) is found at (x, y) / 2^k
+    with size s / 2^k on level k. Levels are kept while materials are at
+    least MIN_MIP_SIZE texels across.
+
+    Decoding the PNGs takes seconds, so the decoded atlas is baked into a
+    file under cache/ (see level_cache.write for the layout), named after
+    a hash of the source images. Later launches map that file straight in
+    and hand it to OpenGL or the CPU tracer without decoding or copying.
+"""
+
 from config import *
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import level_cache
 
-class MegaTexture:
+MAPS = ("albedo", "emissive", "glossiness", "normal", "specular")
+#width of a material's band, in tiles
+ATLAS_TILES = 2.5
+#bumped whenever the packing changes, so old baked atlases are ignored
+LAYOUT_VERSION = 3
+#levels in the atlas' mip chain, and the smallest material size they go down to
+MIP_LEVELS = 8
+MIN_MIP_SIZE = 8
+
+def map_path(material, map_name):
+
+    return os.path.join("textures", material, f"{material}_{map_name}.png")
+
+def decode_map(filepath, size):
+    """
+        Decode a PNG without going through pg.image.tostring.
+
+            Returns:
+                np.ndarray (size, size, 3) of uint8
+    """
+
+    image = pg.image.load(filepath)
+    if image.get_bitsize() == 8:
+        palette = np.array(image.get_palette(), dtype=np.uint8)[:, :3]
+        pixels = palette[pg.surfarray.pixels2d(image).T]
+    elif image.get_bitsize() in (24, 32):
+        pixels = pg.surfarray.pixels3d(image).transpose(1, 0, 2)
+    else:
+        pixels = pg.surfarray.array3d(image).transpose(1, 0, 2)
+
+    return pixels.reshape(size, size, 3)
+
+def pack_map(map_name, pixels, band):
+    """
+        Write a decoded map into its channels of a material's band.
+
+            Parameters:
+                map_name (str): one of MAPS
+                pixels (np.ndarray): (size, size, 3) uint8, as returned by decode_map
+                band (np.ndarray): (size, width, 4) uint8 view of the atlas
+    """
+
+    size = len(pixels)
+    half = size // 2
+
+    if map_name == "albedo":
+        band[:, :size, :3] = pixels
+    elif map_name == "glossiness":
+        band[:, :size, 3] = pixels[:, :, 0]
+    elif map_name == "normal":
+        normal = pixels.astype(np.float32) * (2.0 / 255.0) - 1.0
+        length = np.sqrt(np.einsum("ijk,ijk->ij", normal, normal))[:, :, None]
+        normal = np.where(length > 0, normal / np.maximum(length, 1e-6), np.float32([0, 0, 1]))
+        band[:, size : 2 * size, :2] = np.rint((normal[:, :, :2] + 1.0) * 127.5)
+    elif map_name == "specular":
+        band[:, size : 2 * size, 2] = np.rint(pixels.mean(axis = 2, dtype=np.float32))
+    else:
+        emissive = pixels.reshape(half, 2, half, 2, 3).mean(axis = (1, 3), dtype=np.float32)
+        band[:half, 2 * size : 2 * size + half, :3] = np.rint(emissive)
+
+def load_atlas(filenames, texture_size = 1024, workers = None):
+    """
+        Read every material's maps into one packed RGBA8 atlas.
+
+        Each material occupies a band of texture_size rows,
+        laid out as described at the top of this module.
+        Bands are stored in the order OpenGL reads them (first row is y = 0).
+        Maps are decoded on a thread pool, each one packed into its own
+        channels of the atlas.
+
+            Parameters:
+                filenames (list of str): material folder names under textures/
+                texture_size (int): side length of a single map
+                workers (int): decoding threads, defaults to one per core
+
+            Returns:
+                np.ndarray (height, width, 4) of uint8
+    """
+
+    texture_count = len(filenames)
+    width = int(ATLAS_TILES * texture_size)
+    height = texture_count * texture_size
+
+    atlas = np.full((height, width, 4), 255, dtype=np.uint8)
+    jobs = []
+    for i in range(texture_count):
+        top = (texture_count - i - 1) * texture_size
+        band = atlas[top : top + texture_size]
+        for map_name in MAPS:
+            jobs.append((map_name, map_path(filenames[i], map_name), band))
+
+    def work(job):
+        map_name, filepath, band = job
+        pack_map(map_name, decode_map(filepath, texture_size), band)
+
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        list(pool.map(work, jobs))
+
+    return atlas
+
+def hash_sources(key, material):
+    """
+        Feed the contents of a material's maps into a hashlib object.
+    """
+
+    for map_name in MAPS:
+        with open(map_path(material, map_name), "rb") as file:
+            key.update(material.encode())
+            key.update(hashlib.sha1(file.read()).digest())
+
+def atlas_key(filenames, texture_size = 1024):
+    """
+        Hash of every source image, and of how they are laid out.
+    """
+
+    key = hashlib.sha1(f"{level_cache.VERSION}:{LAYOUT_VERSION}:{texture_size}".encode())
+    for material in filenames:
+        hash_sources(key, material)
+
+    return key.hexdigest()
+
+def atlas_table(texture_count, texture_size = 1024):
+    """
+        Material table of a full atlas: material k sits in band k.
+
+            Returns:
+                np.ndarray (texture_count, 4) float32 of (x y size -)
+    """
+
+    table = np.zeros((texture_count, 4), dtype=np.float32)
+    table[:, 1] = np.arange(texture_count) * texture_size
+    table[:, 2] = texture_size
+
+    return table
 
-    def __init__(self, filenames):
-        
-        texture_size = 1024
-        texture_count = len(filenames)
-        width = 5 * texture_size
-        height = texture_count * texture_size
-
-        
-        textureData = pg.Surface((width,height)).convert()
-        for i in range(texture_count):
-            #load albedo
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_albedo.png").convert()
-            textureData.blit(image, (0, (texture_count - i - 1) * texture_size))
-            #load emissive
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_emissive.png").convert()
-            textureData.blit(image, (texture_size, (texture_count - i - 1) * texture_size))
-            #load glossmap
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_glossiness.png").convert()
-            textureData.blit(image, (2 * texture_size, (texture_count - i - 1) * texture_size))
-            #load normal
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_normal.png").convert()
-            textureData.blit(image, (3 * texture_size, (texture_count - i - 1) * texture_size))
-            #load specular
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_specular.png").convert()
-            textureData.blit(image, (4 * texture_size, (texture_count - i - 1) * texture_size))
-        img_data = pg.image.tostring(textureData,"RGBA")
+def mip_chain(atlas, texture_size = 1024):
+    """
+        The atlas followed by its smaller mip levels.
 
+            Returns:
+                list of np.ndarray (height, width, 4) of uint8
+    """
+
+    levels = [atlas]
+    while len(levels) < mip_count(texture_size):
+        levels.append(downsample(levels[-1]))
+
+    return levels
+
+def mip_count(texture_size = 1024):
+    """
+        Levels in the mip chain of an atlas of texture_size bands.
+    """
+
+    count = 1
+    while count < MIP_LEVELS and texture_size >> count >= MIN_MIP_SIZE:
+        count += 1
+
+    return count
+
+def bake_atlas(filenames, path, texture_size = 1024):
+    """
+        Decode the materials' maps and write the atlas, with its mips, to path.
+    """
+
+    levels = mip_chain(load_atlas(filenames, texture_size), texture_size)
+    level_cache.write(
+        path, {"kind": "atlas"}, {f"level{i}": level for i, level in enumerate(levels)}
+    )
+
+def cached_atlas(filenames, cache_dir = "cache", texture_size = 1024):
+    """
+        The atlas load_atlas would return and its mips, mapped from
+        their baked file. The file is baked first if it doesn't exist yet.
+
+            Parameters:
+                filenames (list of str): material folder names under textures/
+                cache_dir (str): folder for baked atlases, None to decode
+                    the images every time
+                texture_size (int): side length of a single map
+
+            Returns:
+                list of np.ndarray (height, width, 4) of uint8, largest
+                first, read only np.memmap when they came from the cache
+    """
+
+    if cache_dir is None:
+        return mip_chain(load_atlas(filenames, texture_size), texture_size)
+
+    path = os.path.join(cache_dir, f"{atlas_key(filenames, texture_size)}.atlas")
+    compiled = level_cache.read(path)
+    if compiled is None or compiled[0].get("kind") != "atlas":
+        bake_atlas(filenames, path, texture_size)
+        compiled = level_cache.read(path)
+
+    _, arrays = compiled
+    return [arrays[f"level{i}"] for i in range(len(arrays))]
+
+def material_band(material, texture_size = 1024):
+    """
+        Decode one material's maps into its own packed band.
+
+            Returns:
+                np.ndarray (texture_size, ATLAS_TILES * texture_size, 4) of uint8
+    """
+
+    band = np.full((texture_size, int(ATLAS_TILES * texture_size), 4), 255, dtype=np.uint8)
+    for map_name in MAPS:
+        pack_map(map_name, decode_map(map_path(material, map_name), texture_size), band)
+
+    return band
+
+def downsample(band):
+    """
+        Box filter a band down to half size. Every tile halves in place,
+        so the result is the packed layout for half the texture size.
+    """
+
+    size, width = band.shape[:2]
+    half = band.reshape(size // 2, 2, width // 2, 2, 4).mean(axis = (1, 3), dtype=np.float32)
+
+    return np.rint(half).astype(np.uint8)
+
+def cached_material(material, cache_dir = "cache", texture_size = 1024, min_size = 64):
+    """
+        Every detail level of one material, from texture_size down to min_size,
+        mapped from a baked file the same way cached_atlas does.
+
+            Returns:
+                list of np.ndarray (size, ATLAS_TILES * size, 4) of uint8,
+                largest first
+    """
+
+    key = hashlib.sha1(f"{level_cache.VERSION}:{LAYOUT_VERSION}:{texture_size}:{min_size}".encode())
+    hash_sources(key, material)
+    path = None if cache_dir is None else os.path.join(cache_dir, f"{key.hexdigest()}.material")
+
+    compiled = None if path is None else level_cache.read(path)
+    if compiled is None or compiled[0].get("kind") != "material":
+        levels = [material_band(material, texture_size)]
+        while len(levels[-1]) > min_size:
+            levels.append(downsample(levels[-1]))
+        if path is None:
+            return levels
+        level_cache.write(
+            path, {"kind": "material"}, {f"level{i}": level for i, level in enumerate(levels)}
+        )
+        compiled = level_cache.read(path)
+
+    _, arrays = compiled
+    return [arrays[f"level{i}"] for i in range(len(arrays))]
+
+class MegaTexture:
+
+    def __init__(self, levels):
+        """
+            Upload an atlas and its mips, as returned by cached_atlas
+            or held by a material.MaterialManager.
+        """
 
         self.texture = glGenTextures(1)
         glBindTexture(GL_TEXTURE_2D, self.texture)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,width, height,0,GL_RGBA,GL_UNSIGNED_BYTE,img_data)
-        glGenerateMipmap(GL_TEXTURE_2D)
-    
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+        for level, data in enumerate(levels):
+            height, width, _ = data.shape
+            glTexImage2D(GL_TEXTURE_2D,level,GL_RGBA8,width, height,0,GL_RGBA,GL_UNSIGNED_BYTE,data)
+
+    def update(self, levels, x, y, width, height):
+        """
+            Upload one material's rectangle of the atlas again, on every
+            mip level it is still MIN_MIP_SIZE texels high on.
+
+                Returns:
+                    bytes sent
+        """
+
+        sent = 0
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        for level, data in enumerate(levels):
+            if height >> level < MIN_MIP_SIZE:
+                break
+            left, top = x >> level, y >> level
+            pixels = np.ascontiguousarray(
+                data[top : top + (height >> level), left : left + (width >> level)]
+            )
+            glTexSubImage2D(
+                GL_TEXTURE_2D,level,left,top,width >> level,height >> level,
+                GL_RGBA,GL_UNSIGNED_BYTE,pixels
+            )
+            sent += pixels.nbytes
+        return sent
+
     def destroy(self):
-        glDeleteTextures(1, self.texture)
\ No newline at end of file
+        glDeleteTextures(1, self.texture)
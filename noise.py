@@ -0,0 +1,314 @@
+"""
+    Per pixel noise for the ray tracer.
+
+    Every texel holds an (x y z -) offset inside the upper half of a ball
+    of radius 0.99, built from three numbers in [0, 1):
+    radius = 0.99 u0, theta = 2 pi u1, phi = pi u2
+    x = radius cos(theta) cos(phi), y = radius sin(theta) cos(phi), z = radius sin(phi)
+    main() uses (x y) to jitter the pixel, first_pass() uses (x y z) to
+    scatter rough reflections.
+
+    The three numbers come from one of:
+    white: independent uniform samples
+    blue: a tiled void and cluster pattern, neighbouring pixels get
+        dissimilar values so the error looks like fine grain rather than blotches
+    halton: the Halton sequence in bases 2, 3, 5
+    sobol: the Sobol sequence
+    White and blue noise images hold the offsets themselves, and
+    accumulated frames read them from a different place each, see
+    frame_offset. For the two low discrepancy sequences each pixel
+    steps through the sequence instead, one point per accumulated
+    frame, so its samples stay evenly spread however many frames are
+    averaged. The image holds each texel's own random Cranley-Patterson
+    rotation of the sequence, and the point of the frame (frame_point)
+    is added to it before mapping to the ball (sample), so neighbouring
+    pixels don't see the same points.
+"""
+
+from config import *
+
+METHODS = ("white", "blue", "halton", "sobol")
+SEQUENCES = ("halton", "sobol")
+HALTON_BASES = (2, 3, 5)
+BLUE_NOISE_TILE = 64
+BLUE_NOISE_SIGMA = 1.5
+
+#Sobol direction numbers for the first three dimensions,
+#dimension 0 is the van der Corput sequence, 1 and 2 use the
+#primitive polynomials x + 1 and x^2 + x + 1 (Joe & Kuo)
+SOBOL_BITS = 32
+SOBOL_POLYNOMIALS = ((1, 0, (1,)), (2, 1, (1, 3)))
+
+def generate(width, height, method = "white", seed = 0, screens = 4):
+    """
+        Build a noise image.
+
+            Parameters:
+                width, height (int): size of one screen, in pixels
+                method (str): one of METHODS
+                seed (int): seeds the np.random.Generator, equal seeds give equal noise
+                screens (int): screens laid side by side, the shader reads
+                    screen i at x + i * width
+
+            Returns:
+                np.ndarray (height, screens * width, 4) float32, (x y z 0)
+                offsets, or (u0 u1 u2 0) rotations in [0, 1) for SEQUENCES
+    """
+
+    if method not in METHODS:
+        raise ValueError(f"unknown noise method {method!r}, expected one of {METHODS}")
+
+    rng = np.random.default_rng(seed)
+    shape = (height, screens * width)
+
+    if method == "blue":
+        samples = blue_noise(shape, rng)
+    else:
+        samples = rng.random(shape + (3,))
+
+    if method in SEQUENCES:
+        texels = np.zeros(shape + (4,), dtype=np.float32)
+        texels[..., :3] = samples
+        return texels
+    return to_ball(samples)
+
+def frame_offset(frame, width, height, seed = 0, method = "white"):
+    """
+        Where a frame starts reading a noise image, so successive frames
+        of an accumulated image each get a fresh sample per pixel.
+        Reads wrap around the image. Pixels keep their own texel under
+        SEQUENCES, frame_point moves them along the sequence instead.
+
+            Parameters:
+                frame (int): frames since accumulation started, 0 reads
+                    the image from its origin like an unaccumulated frame
+                width, height (int): size of the whole noise image
+                seed (int): equal seeds give equal offsets
+                method (str): one of METHODS
+
+            Returns:
+                (x, y) offset in texels
+    """
+
+    if frame == 0 or method in SEQUENCES:
+        return (0, 0)
+    rng = np.random.default_rng((seed, frame))
+    return (int(rng.integers(width)), int(rng.integers(height)))
+
+def frame_point(frame, method = "white"):
+    """
+        The sequence point every texel's rotation is added to on a frame.
+
+            Parameters:
+                frame (int): frames since accumulation started
+                method (str): one of METHODS
+
+            Returns:
+                (u0, u1, u2, w), w is 1 for SEQUENCES and 0 when the
+                texels are offsets already
+    """
+
+    if method == "halton":
+        point = halton(np.array([frame + 1]))[0]
+    elif method == "sobol":
+        point = sobol(np.array([frame]))[0]
+    else:
+        return (0.0, 0.0, 0.0, 0.0)
+
+    return tuple(float(u) for u in point) + (1.0,)
+
+def sample(texels, point):
+    """
+        Offsets in the ball of the given texels on a frame, as
+        noise_sample() in the ray tracer reads them.
+
+            Parameters:
+                texels (np.ndarray (..., 4)): read from a noise image
+                point (tuple): the frame's frame_point
+
+            Returns:
+                np.ndarray (..., 3) float32
+    """
+
+    if point[3] == 0:
+        return texels[..., :3]
+    return to_ball(np.mod(texels[..., :3] + np.array(point[:3], dtype=np.float32), 1.0))[..., :3]
+
+def frame_jitter(frame, count = 16):
+    """
+        Where a frame traces each pixel's ray, relative to the pixel's
+        centre, for resolving frames over time. Steps through the first
+        count points of the Halton sequence in bases 2 and 3, so any run
+        of frames covers the pixel evenly.
+
+            Returns:
+                (x, y) in [-0.5, 0.5)
+    """
+
+    index = np.array([frame % count + 1])
+    return (float(radical_inverse(index, 2)[0]) - 0.5, float(radical_inverse(index, 3)[0]) - 0.5)
+
+def to_ball(samples):
+    """
+        Map (..., 3) numbers in [0, 1) to (x y z 0) texels.
+    """
+
+    radius = 0.99 * samples[..., 0]
+    theta = 2 * np.pi * samples[..., 1]
+    phi = np.pi * samples[..., 2]
+
+    texels = np.zeros(samples.shape[:-1] + (4,), dtype=np.float32)
+    texels[..., 0] = radius * np.cos(theta) * np.cos(phi)
+    texels[..., 1] = radius * np.sin(theta) * np.cos(phi)
+    texels[..., 2] = radius * np.sin(phi)
+
+    return texels
+
+def radical_inverse(indices, base):
+    """
+        Mirror the base b digits of each index around the radix point.
+    """
+
+    result = np.zeros(len(indices), dtype=np.float64)
+    indices = indices.copy()
+    scale = 1.0 / base
+    while indices.any():
+        indices, digit = np.divmod(indices, base)
+        result += digit * scale
+        scale /= base
+
+    return result
+
+def halton(indices):
+    """
+        Points of the Halton sequence, 0 is the origin.
+
+            Returns:
+                np.ndarray (len(indices), 3) in [0, 1)
+    """
+
+    indices = np.asarray(indices, dtype=np.int64)
+    return np.stack([radical_inverse(indices, base) for base in HALTON_BASES], axis = 1)
+
+def sobol_directions():
+    """
+        Direction numbers, scaled to SOBOL_BITS bits, for three dimensions.
+
+            Returns:
+                np.ndarray (3, SOBOL_BITS) uint64
+    """
+
+    directions = np.zeros((3, SOBOL_BITS), dtype=np.uint64)
+    directions[0] = [1 << (SOBOL_BITS - 1 - bit) for bit in range(SOBOL_BITS)]
+
+    for dimension, (degree, coefficients, initial) in enumerate(SOBOL_POLYNOMIALS, start = 1):
+        m = list(initial)
+        for k in range(degree, SOBOL_BITS):
+            value = m[k - degree] ^ (m[k - degree] << degree)
+            for i in range(1, degree):
+                if (coefficients >> (degree - 1 - i)) & 1:
+                    value ^= m[k - i] << i
+            m.append(value)
+        directions[dimension] = [m[bit] << (SOBOL_BITS - 1 - bit) for bit in range(SOBOL_BITS)]
+
+    return directions
+
+def sobol(indices):
+    """
+        Points of the Sobol sequence, 0 is the origin.
+
+            Returns:
+                np.ndarray (len(indices), 3) in [0, 1)
+    """
+
+    directions = sobol_directions()
+    indices = np.asarray(indices, dtype=np.uint64)
+    points = np.zeros((len(indices), 3), dtype=np.uint64)
+
+    for bit in range(SOBOL_BITS):
+        remaining = indices >> np.uint64(bit)
+        if not remaining.any():
+            break
+        mask = (remaining & np.uint64(1)).astype(bool)
+        points[mask] ^= directions[:, bit]
+
+    return points.astype(np.float64) / float(1 << SOBOL_BITS)
+
+def void_and_cluster(size, rng, sigma = BLUE_NOISE_SIGMA):
+    """
+        Rank every texel of a size x size tile so that, for any threshold,
+        the texels below it are evenly spread (Ulichney's void and cluster).
+
+            Returns:
+                np.ndarray (size, size) in [0, 1)
+    """
+
+    #toroidal gaussian, tiled twice so any shift of it is a plain slice
+    offsets = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(offsets[:, None] ** 2 + offsets[None, :] ** 2) / (2 * sigma ** 2))
+    kernel = np.tile(kernel, (2, 2))
+
+    def splat(energy, position, sign):
+        y, x = divmod(position, size)
+        energy += sign * kernel[size - y : 2 * size - y, size - x : 2 * size - x].ravel()
+
+    count = size * size
+    points = np.zeros(count, dtype=bool)
+    energy = np.zeros(count)
+
+    #initial pattern: a tenth of the texels, then swap the tightest cluster
+    #into the largest void until that stops changing anything
+    for position in rng.choice(count, size = max(1, count // 10), replace = False):
+        points[position] = True
+        splat(energy, position, 1)
+    while True:
+        cluster = np.argmax(np.where(points, energy, -np.inf))
+        points[cluster] = False
+        splat(energy, cluster, -1)
+        void = np.argmin(np.where(points, np.inf, energy))
+        points[void] = True
+        splat(energy, void, 1)
+        if void == cluster:
+            break
+
+    ranks = np.zeros(count, dtype=np.int64)
+    initial = np.flatnonzero(points)
+
+    #rank the initial points by removing the tightest cluster first
+    removed = points.copy()
+    removalEnergy = energy.copy()
+    for rank in range(len(initial) - 1, -1, -1):
+        cluster = np.argmax(np.where(removed, removalEnergy, -np.inf))
+        removed[cluster] = False
+        splat(removalEnergy, cluster, -1)
+        ranks[cluster] = rank
+
+    #then fill the largest void until the tile is full
+    for rank in range(len(initial), count):
+        void = np.argmin(np.where(points, np.inf, energy))
+        points[void] = True
+        splat(energy, void, 1)
+        ranks[void] = rank
+
+    return ((ranks + 0.5) / count).reshape(size, size)
+
+def blue_noise(shape, rng, size = BLUE_NOISE_TILE):
+    """
+        Three independent blue noise tiles repeated across the image,
+        each with its own random offset.
+
+            Returns:
+                np.ndarray (shape + (3,))
+    """
+
+    rows, cols = shape
+    samples = np.empty(shape + (3,))
+    y = np.arange(rows)[:, None]
+    x = np.arange(cols)[None, :]
+
+    for channel in range(3):
+        tile = void_and_cluster(size, rng)
+        dy, dx = rng.integers(0, size, size = 2)
+        samples[..., channel] = tile[(y + dy) % size, (x + dx) % size]
+
+    return samples
@@ -0,0 +1,366 @@
+from config import *
+import os
+import types
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import engine
+import cpu_engine
+import cpu_tracer
+
+# per process state of a render worker, filled in by attach_worker
+worker = {}
+
+def share(array):
+    """
+        Copy an array into a new shared memory block.
+
+            Returns:
+                (SharedMemory, np.ndarray view of the block)
+    """
+
+    block = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+    view = np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)
+    view[...] = array
+    return block, view
+
+def attach(name, shape, dtype):
+    """
+        Map an existing shared memory block as an array.
+    """
+
+    block = shared_memory.SharedMemory(name = name)
+    return block, np.ndarray(shape, dtype = dtype, buffer = block.buf)
+
+def attach_worker(layout, counter, files):
+    """
+        Pool initializer: map the engine's shared buffers into this process.
+
+            Parameters:
+                layout (dict): buffer name -> (shared memory name, shape, dtype)
+                counter (mp.Value): index of the next tile to render
+                files (dict): buffer name -> (path, offset, shape, dtype)
+                    of read only arrays mapped from disk
+    """
+
+    worker["counter"] = counter
+    worker["blocks"] = []
+    for key, (name, shape, dtype) in layout.items():
+        block, view = attach(name, shape, dtype)
+        worker["blocks"].append(block)
+        worker[key] = view
+    for key, (path, offset, shape, dtype) in files.items():
+        worker[key] = np.memmap(path, dtype = dtype, mode = "r", offset = offset, shape = shape)
+
+    #the atlas comes as one buffer per mip level
+    levels = []
+    while f"megaTexture{len(levels)}" in worker:
+        levels.append(worker.pop(f"megaTexture{len(levels)}"))
+    worker["megaTexture"] = levels
+
+def attach_objects(objectLayout):
+    """
+        Map the shared objectData and bvhData, again whenever the engine
+        has grown them into new blocks.
+
+            Parameters:
+                objectLayout (dict): array name -> (shared memory name, shape, dtype)
+    """
+
+    names = tuple(name for name, _, _ in objectLayout.values())
+    if worker.get("objectNames") == names:
+        return
+
+    for block in worker.get("objectBlocks", []):
+        block.close()
+    worker["objectBlocks"] = []
+    for key, (name, shape, dtype) in objectLayout.items():
+        block, view = attach(name, shape, dtype)
+        worker["objectBlocks"].append(block)
+        worker[key] = view
+
+    worker["objectNames"] = names
+
+def attach_grid(gridLayout):
+    """
+        Map the shared copy of the level's grid, reusing it while the
+        engine keeps sending the same blocks.
+
+            Parameters:
+                gridLayout (tuple): (rows, cols, {array name -> (shared memory name, shape, dtype)})
+    """
+
+    if gridLayout is None:
+        return None
+
+    rows, cols, layout = gridLayout
+    names = tuple(name for name, _, _ in layout.values())
+    if worker.get("gridNames") == names:
+        return worker["grid"]
+
+    for block in worker.get("gridBlocks", []):
+        block.close()
+    worker["gridBlocks"] = []
+    level = types.SimpleNamespace(rows = rows, cols = cols)
+    for key, (name, shape, dtype) in layout.items():
+        block, view = attach(name, shape, dtype)
+        worker["gridBlocks"].append(block)
+        setattr(level, key, view)
+
+    worker["gridNames"] = names
+    worker["grid"] = level
+    return level
+
+def render_tiles(job):
+    """
+        Pull tiles off the shared counter until the frame is done.
+        Whichever worker is free takes the next tile, so tiles that
+        are slow to trace don't hold the others up.
+
+            Parameters:
+                job (tuple): object layout, object counts, node count, grid layout,
+                    camera, screen size, tile size, chunk size, texture LOD flag,
+                    noise offset and point
+
+            Returns:
+                number of tiles this worker rendered
+    """
+
+    objectLayout, counts, nodeCount, gridLayout, viewer, screen_size, tileSize, chunkSize, textureLOD, noiseOffset, noisePoint = job
+    width, height = screen_size
+
+    attach_objects(objectLayout)
+    scene = cpu_tracer.PackedScene(
+        worker["objectData"], *counts, worker["bvhData"], nodeCount, attach_grid(gridLayout)
+    )
+    target = worker["frameBuffer"][: width * height * 4].reshape(height, width, 4)
+
+    columns = (width + tileSize - 1) // tileSize
+    rows = (height + tileSize - 1) // tileSize
+    counter = worker["counter"]
+
+    rendered = 0
+    while True:
+        with counter.get_lock():
+            tile = counter.value
+            counter.value += 1
+        if tile >= rows * columns:
+            return rendered
+
+        x0 = (tile % columns) * tileSize
+        y0 = (tile // columns) * tileSize
+        cpu_tracer.render_tile(
+            scene, viewer, worker["noise"], worker["megaTexture"], worker["materialTable"], screen_size,
+            x0, y0, min(x0 + tileSize, width), min(y0 + tileSize, height),
+            target, chunkSize, textureLOD, noiseOffset, noisePoint
+        )
+        rendered += 1
+
+class ParallelCPUEngine(cpu_engine.CPUEngine):
+    """
+        Splits each frame into tiles and ray traces them on a process pool.
+        Scene, noise and framebuffer live in shared memory, the baked
+        megatexture is mapped from its file by every process.
+    """
+
+    def __init__(self, width, height, workers = None, tileSize = 64, chunkSize = 16384, useBVH = True, useGrid = False,
+                 noiseMethod = "white", noiseSeed = 0, materialBudget = None):
+        """
+            Initialize a multi-process headless raytracing context
+
+                Parameters:
+                    width (int): width of screen
+                    height (int): height of screen
+                    workers (int): size of the process pool, defaults to one per core
+                    tileSize (int): side length of a tile, in pixels
+                    chunkSize (int): rays traced per batch within a tile
+                    useBVH (bool): traverse a bounding volume hierarchy
+                    useGrid (bool): walk the level's grid instead,
+                        takes precedence over useBVH
+                    noiseMethod (str): how the noise texture is sampled, one of noise.METHODS
+                    noiseSeed (int): seed of the noise texture
+                    materialBudget (int): bytes of atlas to stream materials
+                        into, None to load every material up front
+        """
+
+        self.workers = workers or os.cpu_count()
+        self.tileSize = tileSize
+        self.sharedBlocks = []
+        self.layout = {}
+        self.files = {}
+        self.objectBlocks = []
+        self.objectLayout = {}
+        self.grid = None
+        self.gridBlocks = []
+        self.gridLayout = None
+
+        super().__init__(width, height, chunkSize, useBVH, useGrid, noiseMethod, noiseSeed, materialBudget)
+
+        self.counter = mp.Value("i", 0)
+        self.pool = mp.Pool(
+            self.workers, initializer = attach_worker,
+            initargs = (self.layout, self.counter, self.files)
+        )
+
+    def createShared(self, key, array):
+        """
+            Move an array into shared memory and register it for the workers.
+        """
+
+        block, view = share(array)
+        self.sharedBlocks.append(block)
+        self.layout[key] = (block.name, view.shape, view.dtype)
+        return view
+
+    def createColorBuffers(self):
+
+        width, height = self.resolutions[0]
+        self.frameBuffer = self.createShared(
+            "frameBuffer", np.zeros(width * height * 4, dtype=np.float32)
+        )
+
+        self.colorBuffers = []
+        for resolution in self.resolutions:
+
+            width,height = resolution
+            self.colorBuffers.append(
+                self.frameBuffer[: width * height * 4].reshape(height, width, 4)
+            )
+        #averaged in this process once the workers are done, so it isn't shared
+        self.accumulationBuffers = [
+            np.zeros((height, width, 4), dtype=np.float32) for width, height in self.resolutions
+        ]
+
+        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
+
+    def createResourceMemory(self):
+
+        self.objectData = np.zeros(engine.OBJECT_CAPACITY * 20, dtype=np.float32)
+        self.createObjectSlots()
+        self.createBVHMemory()
+        self.resizeObjectMemory(self.objectData, self.bvhData)
+
+    def resizeObjectMemory(self, objectData, bvhData):
+        """
+            Move objectData and bvhData into new shared blocks,
+            workers switch over with the next job.
+        """
+
+        self.releaseObjects()
+        layout = {}
+        for key, array in (("objectData", objectData), ("bvhData", bvhData)):
+            block, view = share(array)
+            self.objectBlocks.append(block)
+            layout[key] = (block.name, view.shape, view.dtype)
+            setattr(self, key, view)
+        self.objectLayout = layout
+
+    def releaseObjects(self):
+
+        for block in self.objectBlocks:
+            block.close()
+            block.unlink()
+        self.objectBlocks = []
+
+    def createNoiseTexture(self):
+
+        super().createNoiseTexture()
+        self.noise = self.createShared("noise", self.noise)
+
+    def createMegaTexture(self):
+
+        super().createMegaTexture()
+        levels = []
+        for level, data in enumerate(self.megaTexture):
+            key = f"megaTexture{level}"
+            if self.materials is None and isinstance(data, np.memmap):
+                #baked atlas: the workers map the same file, sharing its pages
+                self.files[key] = (data.filename, data.offset, data.shape, data.dtype)
+                levels.append(data)
+            else:
+                #streamed atlas: the manager writes straight into shared memory
+                levels.append(self.createShared(key, data))
+        self.megaTexture = levels
+        if self.materials is not None:
+            self.materials.atlas = levels
+        self.materialTable = self.createShared("materialTable", self.materialTable)
+        if self.materials is not None:
+            self.materials.table = self.materialTable
+
+    def updateScene(self, scene):
+
+        scene.outDated = False
+
+        ranges, repacked = self.recordChanges(scene)
+        sphereCount, planeCount, _ = self.objectCounts
+        if self.useGrid:
+            self.shareGrid(scene.get_grid())
+        elif self.useBVH and (repacked or any(first < sphereCount for first, _ in ranges)):
+            self.updateBVH(scene, sphereCount, planeCount)
+
+    def shareGrid(self, level):
+        """
+            Copy the level's grid into shared memory, if it isn't already there.
+            Workers pick up the new blocks from the next job they receive.
+        """
+
+        if level is self.grid:
+            return
+        self.grid = level
+
+        self.releaseGrid()
+        layout = {}
+        for key in ("planeData", "cellStart", "cellCount", "cellPlanes"):
+            block, view = share(getattr(level, key))
+            self.gridBlocks.append(block)
+            layout[key] = (block.name, view.shape, view.dtype)
+        self.gridLayout = (level.rows, level.cols, layout)
+
+    def releaseGrid(self):
+
+        for block in self.gridBlocks:
+            block.close()
+            block.unlink()
+        self.gridBlocks = []
+        self.gridLayout = None
+
+    def renderScene(self, scene):
+        """
+            Draw all objects in the scene, one tile at a time across the pool
+        """
+
+        self.prepareScene(scene)
+
+        self.counter.value = 0
+        gridLayout = self.gridLayout if self.useGrid else None
+        job = (
+            self.objectLayout, self.objectCounts, self.nodeCount, gridLayout, scene.camera,
+            (self.screenWidth, self.screenHeight), self.tileSize, self.chunkSize, self.useTextureLOD,
+            self.noiseOffset, self.noisePoint
+        )
+        self.frameTimer.begin("trace")
+        self.pool.map(render_tiles, [job] * self.workers, chunksize = 1)
+        self.frameTimer.end()
+        self.frameTimer.endFrame(self.resolutionLevel)
+        self.accumulateFrame()
+        self.updateResolution()
+
+    def destroy(self):
+        """
+            Stop the workers and release shared memory
+        """
+
+        self.pool.close()
+        self.pool.join()
+        self.colorBuffers = []
+        self.colorBuffer = None
+        self.frameBuffer = self.objectData = self.bvhData = None
+        self.noise = self.megaTexture = self.materialTable = None
+        if self.materials is not None:
+            self.materials.destroy()
+            self.materials.atlas = self.materials.table = None
+        self.releaseGrid()
+        self.releaseObjects()
+        for block in self.sharedBlocks:
+            block.close()
+            block.unlink()
+        self.sharedBlocks = []
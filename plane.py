@@ -1,10 +1,28 @@
 from config import *
+import storage
+
+# record: (cx cy cz umin) (tx ty tz umax) (bx by bz vmin) (nx ny nz vmax) (material - - -)
+# laid out like the shader's std430 Plane struct, so records upload as they are
+PLANES = storage.Store()
 
 class Plane:
     """
-        Represents a plane in the scene
+        Represents a plane in the scene, as a view of its row in PLANES
     """
 
+    __slots__ = ("index",)
+
+    store = PLANES
+
+    center = storage.Column("records", 0, 3)
+    uMin = storage.Column("records", 3)
+    tangent = storage.Column("records", 4, 7)
+    uMax = storage.Column("records", 7)
+    bitangent = storage.Column("records", 8, 11)
+    vMin = storage.Column("records", 11)
+    normal = storage.Column("records", 12, 15)
+    vMax = storage.Column("records", 15)
+    material_index = storage.Column("records", 16)
 
     def __init__(self, normal, tangent, bitangent, uMin, uMax, vMin, vMax, center, material_index):
         """
@@ -19,12 +37,27 @@ class Plane:
                 material_index int
         """
 
-        self.normal = np.array(normal, dtype=np.float32)
-        self.tangent = np.array(tangent, dtype=np.float32)
-        self.bitangent = np.array(bitangent, dtype=np.float32)
+        self.index = self.store.allocate(self)
+        self.normal = normal
+        self.tangent = tangent
+        self.bitangent = bitangent
         self.uMin = uMin
         self.uMax = uMax
         self.vMin = vMin
         self.vMax = vMax
-        self.center = np.array(center, dtype=np.float32)
-        self.material_index = material_index
\ No newline at end of file
+        self.center = center
+        self.material_index = material_index
+    
+    def destroy(self):
+        """
+            Give the plane's row back to PLANES, the plane can't be used after.
+        """
+
+        index = getattr(self, "index", None)
+        if index is not None:
+            del self.index
+            self.store.release(index, self)
+
+    def __del__(self):
+
+        self.destroy()
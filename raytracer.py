@@ -1,6 +1,12 @@
-from config import *
-import app
+import sys
 
 if __name__ == "__main__":
-    myApp = app.App()
-    myApp.quit()
\ No newline at end of file
+    if sys.argv[1:2] == ["render"]:
+        #offline, without a window, see render.py; imported before
+        #config so it can pick the OpenGL platform
+        import render
+        render.main(sys.argv[2:])
+    else:
+        import app
+        myApp = app.App()
+        myApp.quit()
@@ -0,0 +1,238 @@
+"""
+    Render frames offline, without a window.
+
+    Follows a camera path through the level and writes each frame to a
+    numbered image file, a raw stream of 8 bit RGB frames, or both, then
+    reports throughput. Traces on the CPU, or on the GPU through a
+    surfaceless EGL context (headless.py), which Mesa's llvmpipe provides
+    on servers with neither a display nor a GPU.
+
+    A camera path is a JSON list of keyframes, spread evenly over the frames:
+    [{"position": [1.5, 1.5, 0.5], "theta": 0, "phi": 0}, ...]
+
+    Rays per second count camera rays, width x height x samples a frame.
+
+    OpenGL is only set up for EGL with the gpu backend: PyOpenGL picks its
+    platform when it is first imported, so the ray tracer's modules are
+    imported once the backend is known, and the CPU backends work on
+    machines without libEGL.
+
+    Run from the repository root:
+    python render.py [--backend gpu|cpu|parallel] [--frames N] [--samples N]
+        [--path path.json] [--output frames/%04d.png] [--stream frames.rgb|-]
+    or python raytracer.py render ...
+"""
+
+import os
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pygame as pg
+
+BACKENDS = ("gpu", "cpu", "parallel")
+
+def load_path(filepath):
+    """
+        Returns:
+            [(position, theta, phi)] of the keyframes in a camera path file
+    """
+
+    with open(filepath) as file:
+        keyframes = json.load(file)
+    if len(keyframes) == 0:
+        raise ValueError(f"{filepath} has no keyframes")
+
+    return [
+        (np.array(keyframe["position"], dtype=np.float32),
+         float(keyframe.get("theta", 0)), float(keyframe.get("phi", 0)))
+        for keyframe in keyframes
+    ]
+
+def view_at(keyframes, t):
+    """
+        Interpolate a camera path linearly.
+
+            Parameters:
+                keyframes (list): (position, theta, phi) of each keyframe
+                t (float): 0 for the first keyframe through 1 for the last
+
+            Returns:
+                (position, theta, phi)
+    """
+
+    along = t * (len(keyframes) - 1)
+    first = min(int(along), len(keyframes) - 1)
+    second = min(first + 1, len(keyframes) - 1)
+    f = along - first
+    (position0, theta0, phi0), (position1, theta1, phi1) = keyframes[first], keyframes[second]
+
+    return (
+        position0 + f * (position1 - position0),
+        theta0 + f * (theta1 - theta0),
+        phi0 + f * (phi1 - phi0)
+    )
+
+def create_renderer(args):
+    """
+        Returns:
+            engine drawing frames of args.width x args.height at full resolution
+    """
+
+    if args.backend == "gpu":
+        import headless
+        renderer = headless.HeadlessEngine(args.width, args.height)
+    elif args.backend == "cpu":
+        import cpu_engine
+        renderer = cpu_engine.CPUEngine(args.width, args.height)
+    else:
+        import parallel_engine
+        renderer = parallel_engine.ParallelCPUEngine(args.width, args.height, workers = args.workers)
+    renderer.setResolutionLevel(0)
+    #the samples of a frame are averaged by accumulating them
+    renderer.useAccumulation = True
+
+    return renderer
+
+def read_frame(renderer):
+    """
+        Returns:
+            np.ndarray (height, width, 3) uint8 of the last frame, top row first
+    """
+
+    if hasattr(renderer, "readColorBuffer"):
+        pixels = renderer.readColorBuffer()
+    else:
+        pixels = renderer.colorBuffer
+
+    return (np.clip(pixels[::-1, :, :3], 0, 1) * 255 + 0.5).astype(np.uint8)
+
+def save_image(image, filepath):
+    """
+        Write an image, as binary PPM if filepath ends in .ppm and
+        otherwise in whatever format pygame picks from its extension.
+    """
+
+    folder = os.path.dirname(filepath)
+    if folder:
+        os.makedirs(folder, exist_ok = True)
+
+    if filepath.lower().endswith(".ppm"):
+        height, width = image.shape[:2]
+        with open(filepath, "wb") as file:
+            file.write(f"P6\n{width} {height}\n255\n".encode())
+            file.write(np.ascontiguousarray(image).tobytes())
+    else:
+        pg.image.save(pg.surfarray.make_surface(image.swapaxes(0, 1)), filepath)
+
+def output_path(pattern, frame):
+    """
+        Returns:
+            the file name of a frame, pattern itself if it doesn't take a number
+    """
+
+    try:
+        return pattern % frame
+    except (TypeError, ValueError):
+        return pattern
+
+def render(renderer, level, keyframes, args, stream = None):
+    """
+        Render args.frames frames of args.samples samples each.
+
+            Returns:
+                seconds spent tracing each frame
+    """
+
+    seconds = []
+    for frame in range(args.frames):
+
+        if keyframes is not None:
+            level.camera.setView(*view_at(keyframes, frame / max(1, args.frames - 1)))
+            level.cameraMoved = True
+        level.update(args.rate)
+        #even a still view gets exactly args.samples samples
+        renderer.resetAccumulation()
+
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            renderer.renderScene(level)
+        image = read_frame(renderer)
+        seconds.append(time.perf_counter() - start)
+
+        if args.output is not None:
+            save_image(image, output_path(args.output, frame))
+        if stream is not None:
+            stream.write(image.tobytes())
+
+    return seconds
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices = BACKENDS, default = "gpu",
+                        help = "trace through an EGL context, with NumPy, or with NumPy across processes")
+    parser.add_argument("--width", type = int, default = 800)
+    parser.add_argument("--height", type = int, default = 600)
+    parser.add_argument("--frames", type = int, default = 1)
+    parser.add_argument("--samples", type = int, default = 1, help = "samples averaged per pixel of each frame")
+    parser.add_argument("--path", help = "camera path, JSON keyframes, the level's start if left out")
+    parser.add_argument("--rate", type = float, default = 1.0,
+                        help = "how far objects move per frame, 1 is a frame at 60 fps, 0 holds them still")
+    parser.add_argument("--output", help = "image file pattern, numbered with %%, such as frames/%%04d.png, "
+                        "or a plain file name for a single frame")
+    parser.add_argument("--stream", help = "file to write raw RGB frames to, - for standard output")
+    parser.add_argument("--workers", type = int, default = None, help = "processes for the parallel backend")
+    parser.add_argument("--merge-faces", action = "store_true", help = "fuse coplanar faces of the level")
+    args = parser.parse_args(argv)
+    #check the pattern before spending any time rendering
+    if args.output is not None and args.frames > 1 and output_path(args.output, 0) == output_path(args.output, 1):
+        parser.error(f"--output {args.output} has to number the frames, such as frames/%04d.png")
+
+    #with frames on standard output, report on standard error
+    report = sys.stderr if args.stream == "-" else sys.stdout
+    keyframes = load_path(args.path) if args.path is not None else None
+
+    context = None
+    if args.backend == "gpu":
+        #before anything imports OpenGL, see the module's docstring
+        import headless
+        from OpenGL.GL import glGetString, GL_RENDERER
+        context = headless.create_context()
+        print(glGetString(GL_RENDERER).decode(), file = report)
+    import scene
+
+    renderer = create_renderer(args)
+    level = scene.Scene(merge_faces = args.merge_faces)
+    stream = None
+    if args.stream == "-":
+        stream = sys.stdout.buffer
+    elif args.stream is not None:
+        stream = open(args.stream, "wb")
+
+    start = time.perf_counter()
+    try:
+        seconds = render(renderer, level, keyframes, args, stream)
+    finally:
+        if stream is not None and stream is not sys.stdout.buffer:
+            stream.close()
+        level.destroy()
+        renderer.destroy()
+        if context is not None:
+            headless.destroy_context(*context)
+    total = time.perf_counter() - start
+
+    rays = args.width * args.height * args.samples
+    print(f"{args.frames} frames of {args.width}x{args.height}, {args.samples} samples, "
+          f"{args.backend} backend, {total:.2f} s in total", file = report)
+    print(f"  tracing {len(seconds) / sum(seconds):8.2f} frames/s "
+          f"{rays * len(seconds) / sum(seconds) / 1e6:8.2f} Mrays/s", file = report)
+    if len(seconds) > 1:
+        #the first frame also compiles shaders and builds the level's buffers
+        steady = sum(seconds[1:])
+        print(f"  after the first frame {(len(seconds) - 1) / steady:8.2f} frames/s "
+              f"{rays * (len(seconds) - 1) / steady / 1e6:8.2f} Mrays/s", file = report)
+
+if __name__ == "__main__":
+    main()
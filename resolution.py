@@ -0,0 +1,353 @@
+"""
+    Picks the resolution to render at from measured frame times.
+
+    A frame is modelled as a fixed cost, like the upscaler's full
+    resolution pass, plus a cost per traced pixel. Both are estimated
+    from frames as they are timed, and the controller jumps straight to
+    the largest resolution predicted to fit its budget instead of
+    stepping one level at a time. The model is fitted to the last few
+    frames with medians, so a single hitch barely moves it, and refitted
+    to the latest frames alone when two in a row miss their prediction
+    the same way, so a heavier scene drops the resolution right away.
+    The controller only moves up when the larger resolution fits with
+    headroom to spare, so it doesn't oscillate between two levels.
+
+    Frames are timed with GL_TIME_ELAPSED queries on the GPU (GPUTimer)
+    and with the CPU clock otherwise (CPUTimer).
+"""
+
+from config import *
+import time
+from collections import deque
+
+#query sets in flight, results are read this many frames late
+TIMER_DEPTH = 4
+#software rasterisers run dispatches on the calling thread, outside the
+#span their timer queries measure, so they're timed with the CPU clock
+SOFTWARE_RENDERERS = ("llvmpipe", "softpipe", "swrast", "SwiftShader")
+
+class GPUTimer:
+    """
+        Times phases of each frame on the GPU with GL_TIME_ELAPSED
+        queries. Results are read back once they're available, a few
+        frames later, so reading them never stalls the pipeline.
+    """
+
+    kind = "gpu"
+
+    def __init__(self, phases, depth = TIMER_DEPTH):
+        """
+            Parameters:
+                phases (tuple): names of the phases a frame may time
+                depth (int): frames that can be waiting on results
+        """
+
+        self.phases = phases
+        self.free = [dict(zip(phases, glGenQueries(len(phases)))) for _ in range(depth)]
+        self.current = None
+        self.timed = []
+        #(queries, phases timed, info) of frames waiting on the GPU
+        self.pending = deque()
+        #frames whose results came in but weren't collected yet
+        self.ready = []
+
+    @staticmethod
+    def supported():
+        """
+            Returns:
+                whether the current context's timer queries measure its work
+        """
+
+        renderer = glGetString(GL_RENDERER).decode()
+        if any(name in renderer for name in SOFTWARE_RENDERERS):
+            return False
+        return glGetQueryiv(GL_TIME_ELAPSED, GL_QUERY_COUNTER_BITS) > 0
+
+    def begin(self, phase):
+
+        if self.current is None:
+            if not self.free:
+                #the GPU is a full ring behind, wait for the oldest frame
+                self.retire(wait = True)
+            self.current = self.free.pop()
+        glBeginQuery(GL_TIME_ELAPSED, self.current[phase])
+        self.timed.append(phase)
+
+    def end(self):
+
+        glEndQuery(GL_TIME_ELAPSED)
+
+    def endFrame(self, info):
+        """
+            Close the frame, info is handed back with its times.
+        """
+
+        if self.current is None:
+            return
+        self.pending.append((self.current, self.timed, info))
+        self.current = None
+        self.timed = []
+
+    def retire(self, wait = False):
+        """
+            Read back the frames whose results are available, in order,
+            waiting for the oldest one if asked to.
+        """
+
+        while self.pending:
+            queries, timed, info = self.pending[0]
+            if not wait and not glGetQueryObjectiv(queries[timed[-1]], GL_QUERY_RESULT_AVAILABLE):
+                break
+            self.pending.popleft()
+            #GL_QUERY_RESULT as 32 bits, frames stay well under 4 seconds
+            self.ready.append((info, {
+                phase: glGetQueryObjectuiv(queries[phase], GL_QUERY_RESULT) / 1e6 for phase in timed
+            }))
+            self.free.append(queries)
+            wait = False
+
+    def collect(self):
+        """
+            Returns:
+                [(info, {phase: milliseconds})] of the frames timed since the last call
+                whose results came in
+        """
+
+        self.retire()
+        frames, self.ready = self.ready, []
+        return frames
+
+    def destroy(self):
+
+        for queries in self.free + [queries for queries, _, _ in self.pending]:
+            glDeleteQueries(len(queries), list(queries.values()))
+
+class CPUTimer:
+    """
+        Times phases of each frame with the CPU clock, for renderers
+        that trace on the CPU or GPUs without timer queries.
+        Results are available as soon as the frame ends.
+    """
+
+    kind = "cpu"
+
+    def __init__(self, phases, synchronize = None):
+        """
+            Parameters:
+                phases (tuple): names of the phases a frame may time
+                synchronize (function): called before reading the clock,
+                    such as glFinish to time work queued on a GPU
+        """
+
+        self.phases = phases
+        self.synchronize = synchronize
+        self.times = {}
+        self.phase = None
+        self.start = 0.0
+        self.frames = []
+
+    def begin(self, phase):
+
+        if self.synchronize is not None:
+            self.synchronize()
+        self.phase = phase
+        self.start = time.perf_counter()
+
+    def end(self):
+
+        if self.synchronize is not None:
+            self.synchronize()
+        self.times[self.phase] = self.times.get(self.phase, 0.0) + (time.perf_counter() - self.start) * 1000
+        self.phase = None
+
+    def endFrame(self, info):
+
+        if self.times:
+            self.frames.append((info, self.times))
+        self.times = {}
+
+    def collect(self):
+
+        frames, self.frames = self.frames, []
+        return frames
+
+    def destroy(self):
+
+        pass
+
+class ResolutionController:
+    """
+        Chooses a level of an engine's resolutions so frames
+        fit a time budget.
+    """
+
+    def __init__(self, resolutions, budget, headroom = 0.85, window = 8, tolerance = 1.25, history = 32):
+        """
+            Parameters:
+                resolutions (list): (width, height) of each level, largest first
+                budget (float): milliseconds a frame may take
+                headroom (float): share of the budget a larger resolution
+                    has to be predicted to fit in before moving up to it
+                window (int): recent frames the cost model is fitted to
+                tolerance (float): how far off its prediction, as a factor,
+                    a frame has to be to count as the scene having changed
+                history (int): decisions kept for stats
+        """
+
+        self.resolutions = resolutions
+        self.pixels = np.array([width * height for width, height in resolutions], dtype=np.float64)
+        self.budget = budget
+        self.headroom = headroom
+        self.tolerance = tolerance
+
+        #(pixels, tracing ms, fixed ms) of recent frames
+        self.samples = deque(maxlen = window)
+        #milliseconds per traced pixel, and per frame regardless of resolution
+        self.pixelCost = None
+        self.fixedCost = 0.0
+        #the part of fixedCost spent tracing, such as dispatch overhead
+        self.traceOverhead = 0.0
+        #1 or -1 if the last frame took longer or shorter than predicted
+        self.surprise = 0
+
+        self.level = len(resolutions) - 1
+        self.frames = 0
+        self.measured = None
+        self.changes = 0
+        #(frame, from level, to level, measured ms, predicted ms) of recent changes
+        self.decisions = deque(maxlen = history)
+
+    def record(self, level, pixelTime, fixedTime = 0.0):
+        """
+            Fold one timed frame into the cost model.
+
+                Parameters:
+                    level (int): resolution level the frame was traced at
+                    pixelTime (float): milliseconds spent tracing
+                    fixedTime (float): milliseconds that don't depend on the level
+        """
+
+        self.frames += 1
+        self.measured = pixelTime + fixedTime
+
+        predicted = self.predict(level)
+        surprise = 0
+        if predicted is not None and self.measured > predicted * self.tolerance:
+            surprise = 1
+        elif predicted is not None and self.measured < predicted / self.tolerance:
+            surprise = -1
+        if surprise != 0 and surprise == self.surprise:
+            #two frames in a row off the same way, the scene changed,
+            #so fit to those alone rather than wait for it to show
+            last = self.samples[-1]
+            self.samples.clear()
+            self.samples.append(last)
+            surprise = 0
+        self.surprise = surprise
+
+        self.samples.append((self.pixels[level], pixelTime, fixedTime))
+        self.fit()
+
+    def fit(self):
+        """
+            Fit tracing time as overhead plus a cost per pixel to the
+            recent frames with medians, so a single slow frame hardly moves it.
+        """
+
+        pixels, times, fixedTimes = np.array(self.samples).T
+        fixedCost = float(np.median(fixedTimes))
+
+        #Theil-Sen: the median slope between frames at different levels
+        first, second = np.triu_indices(len(pixels), 1)
+        spread = pixels[second] - pixels[first]
+        apart = spread != 0
+        slope = np.median((times[second] - times[first])[apart] / spread[apart]) if apart.any() else 0.0
+
+        if slope > 0:
+            self.pixelCost = float(slope)
+            self.traceOverhead = max(0.0, float(np.median(times - slope * pixels)))
+        else:
+            #one level so far, keep the overhead but put at least
+            #half the time on pixels so larger levels aren't free
+            medianTime = float(np.median(times))
+            self.traceOverhead = min(self.traceOverhead, 0.5 * medianTime)
+            self.pixelCost = (medianTime - self.traceOverhead) / float(np.median(pixels))
+        self.fixedCost = fixedCost + self.traceOverhead
+
+    def predict(self, level):
+        """
+            Returns:
+                milliseconds a frame at the given level is expected to take,
+                None before any frame was timed
+        """
+
+        if self.pixelCost is None:
+            return None
+        return float(self.predictions()[level])
+
+    def predictions(self):
+        """
+            Returns:
+                np.ndarray of the milliseconds a frame is expected to take at each level
+        """
+
+        predicted = self.fixedCost + self.pixelCost * self.pixels
+        #cost isn't quite linear in pixels, but no level costs less than
+        #recent frames measured at as many pixels or fewer
+        pixels, times, fixedTimes = np.array(self.samples).T
+        for count in np.unique(pixels):
+            measured = np.median((times + fixedTimes)[pixels == count])
+            larger = self.pixels >= count
+            predicted[larger] = np.maximum(predicted[larger], measured)
+        return predicted
+
+    def choose(self, level):
+        """
+            Pick the level to render the next frame at.
+
+                Parameters:
+                    level (int): level being rendered at now
+
+                Returns:
+                    the level to switch to, possibly the same one
+        """
+
+        self.level = level
+        if self.pixelCost is None:
+            return level
+
+        predicted = self.predictions()
+        fitting = np.flatnonzero(predicted <= self.budget * self.headroom)
+        best = int(fitting[0]) if len(fitting) > 0 else len(self.resolutions) - 1
+
+        #drop as soon as the current level is over budget, only
+        #climb to levels that fit with headroom to spare
+        if predicted[level] > self.budget or best < level:
+            if best != level:
+                self.decisions.append((self.frames, level, best, self.measured, float(predicted[best])))
+                self.changes += 1
+                self.level = best
+
+        return self.level
+
+    def stats(self):
+        """
+            Returns:
+                dict with the current level and resolution, the budget, the
+                last measured and the predicted frame time in milliseconds,
+                the cost model, frames timed, level changes, and the recent
+                decisions as (frame, from level, to level, measured ms, predicted ms)
+        """
+
+        return {
+            "level": self.level,
+            "resolution": self.resolutions[self.level],
+            "budgetMs": self.budget,
+            "measuredMs": self.measured,
+            "predictedMs": self.predict(self.level),
+            "pixelCostNs": None if self.pixelCost is None else self.pixelCost * 1e6,
+            "fixedMs": self.fixedCost,
+            "frames": self.frames,
+            "changes": self.changes,
+            "decisions": list(self.decisions),
+        }
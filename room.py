@@ -14,13 +14,33 @@ class Room:
         self.coordinates = []
         self.internalCoordinates = []
         self.doors = []
+
+        #store rows of the room's lights and spheres, for animating them together
+        self.lightIndices = None
+        self.sphereIndices = None
     
     def add_light(self, light):
 
         if light not in self.lights:
             self.lights.append(light)
+            self.lightIndices = None
     
     def add_sphere(self, sphere):
 
         if sphere not in self.spheres:
-            self.spheres.append(sphere)
\ No newline at end of file
+            self.spheres.append(sphere)
+            self.sphereIndices = None
+    
+    def get_light_indices(self):
+
+        if self.lightIndices is None:
+            self.lightIndices = np.array([_light.index for _light in self.lights], dtype=np.int64)
+        
+        return self.lightIndices
+    
+    def get_sphere_indices(self):
+
+        if self.sphereIndices is None:
+            self.sphereIndices = np.array([_sphere.index for _sphere in self.spheres], dtype=np.int64)
+        
+        return self.sphereIndices
\ No newline at end of file
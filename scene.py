@@ -5,6 +5,10 @@ import light
 import geometry
 import room
 import plane
+import grid
+import animation
+import level_cache
+import os
 
 class Scene:
     """
@@ -12,11 +16,20 @@ class Scene:
     """
 
 
-    def __init__(self):
+    def __init__(self, merge_faces = False, cache_dir = "cache"):
         """
             Set up scene objects.
+
+                Parameters:
+                    merge_faces (bool): fuse adjacent coplanar faces with the
+                        same material into larger planes
+                    cache_dir (str): folder for compiled levels, None to
+                        always build the level from the map
         """
 
+        self.merge_faces = merge_faces
+        self.cache_dir = cache_dir
+
         """
             Map data
         """
@@ -150,12 +163,19 @@ class Scene:
         self.planes = []
 
         self.room_lookup = {}
+
+        self.grid = None
+
+        #(store, rows) of spheres and lights moved since the engine last packed them
+        self.moved = []
         
         self.camera = camera.Camera(
             position = [1.5, 1.5, 0.5]
         )
 
         self.outDated = True
+        #whether move_player or spin_player changed the view since an engine last looked
+        self.cameraMoved = True
 
         self.make_level()
 
@@ -163,6 +183,16 @@ class Scene:
     
     def make_level(self):
 
+        self.grid = None
+
+        self.level_key = level_cache.level_key(
+            self.wall_geometry, self.floor_geometry, self.ceiling_geometry, self.merge_faces
+        )
+        if self.cache_dir is not None \
+            and level_cache.load_level(self, self.get_cache_path("level")):
+            self.active_rooms = [self.rooms[0],]
+            return
+
         geometry.make_rooms(
             walls = self.wall_geometry, doors = self.doors, rooms = self.rooms
         )
@@ -189,9 +219,37 @@ class Scene:
                     row, col, _room, wall_mask, 
                     self.wall_geometry, self.floor_geometry, self.ceiling_geometry
                 )
+            
+            if self.merge_faces:
+                _room.planes = geometry.merge_planes(_room.planes)
         
         self.active_rooms = [self.rooms[0],]
 
+        if self.cache_dir is not None:
+            level_cache.save_level(self, self.get_cache_path("level"))
+
+    def get_cache_path(self, kind):
+
+        return os.path.join(self.cache_dir, f"{self.level_key}.{kind}")
+
+    def get_grid(self):
+        """
+            Uniform grid over every plane in the level, built on first use.
+        """
+
+        if self.grid is None and self.cache_dir is not None:
+            self.grid = level_cache.load_grid(self.get_cache_path("grid"))
+
+        if self.grid is None:
+            self.grid = grid.Grid(
+                self.wall_geometry, self.floor_geometry, self.ceiling_geometry, self.doors,
+                self.merge_faces
+            )
+            if self.cache_dir is not None:
+                level_cache.save_grid(self.grid, self.get_cache_path("grid"))
+        
+        return self.grid
+
     def send_objects_to_rooms(self):
 
         while len(self.lights) > 0:
@@ -208,6 +266,25 @@ class Scene:
             _room = self.room_lookup[coordinate]
             _room.add_sphere(_sphere)
     
+    def destroy(self):
+        """
+            Give the rows of the scene's planes, spheres and lights back
+            to their stores. The scene can't be used after.
+        """
+
+        objects = self.spheres + self.lights
+        for _room in self.rooms:
+            objects += _room.planes + _room.spheres + _room.lights
+        for _door in self.doors:
+            objects += _door.planes
+
+        for _object in objects:
+            _object.destroy()
+
+        self.spheres, self.lights, self.rooms, self.doors, self.active_rooms = [], [], [], [], []
+        self.room_lookup = {}
+        self.grid = None
+    
     def move_player(self, forwardsSpeed, rightSpeed):
         """
         attempt to move the player with the given speed
@@ -221,16 +298,22 @@ class Scene:
         col = int(self.camera.position[0])
         if (self.wall_geometry[row][col] in empty_blocks):
             self.camera.position[1] += dy
+            self.cameraMoved |= dy != 0
         
         row = int(self.camera.position[1])
         col = int(self.camera.position[0] + 1.1 * dx)
         if (self.wall_geometry[row][col] in empty_blocks):
             self.camera.position[0] += dx
+            self.cameraMoved |= dx != 0
     
     def spin_player(self, dAngle):
         """
             shift the player's direction by the given amount, in degrees
         """
+        if dAngle[0] == 0 and dAngle[1] == 0:
+            return
+
+        self.cameraMoved = True
         self.camera.theta += dAngle[0]
         if (self.camera.theta < 0):
             self.camera.theta += 360
@@ -251,16 +334,23 @@ class Scene:
         col = int(self.camera.position[0])
         coordinate = (row,col)
         
+        previous_rooms = self.active_rooms
         self.active_rooms = []
 
         for room in self.rooms:
             if coordinate in room.internalCoordinates:
                 self.active_rooms.append(room)
-            
-                for _light in room.lights:
-                    _light.update(rate)
-                
-                for _sphere in room.spheres:
-                    _sphere.update(rate)
         
-        self.outDated = True
\ No newline at end of file
+        #advance every active light and sphere at once
+        for _store, indices in (
+            (light.LIGHTS, [room.get_light_indices() for room in self.active_rooms]),
+            (sphere.SPHERES, [room.get_sphere_indices() for room in self.active_rooms])
+        ):
+            if len(indices) == 0:
+                continue
+            moved = animation.animate(_store, np.concatenate(indices), rate)
+            if len(moved) > 0:
+                self.moved.append((_store, moved))
+        
+        if self.active_rooms != previous_rooms or len(self.moved) > 0:
+            self.outDated = True
\ No newline at end of file
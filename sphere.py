@@ -1,10 +1,31 @@
 from config import *
+import storage
+import animation
+
+# record: (cx cy cz r) (r g b roughness)
+# state:  (t) (motion center xyz) (axis xyz) (radius of motion) (velocity)
+SPHERES = storage.Store(stateSize = 9)
 
 class Sphere:
     """
-        Represents a sphere in the scene
+        Represents a sphere in the scene, as a view of its row in SPHERES
     """
 
+    __slots__ = ("index",)
+
+    store = SPHERES
+
+    center = storage.Column("records", 0, 3)
+    radius = storage.Column("records", 3)
+    color = storage.Column("records", 4, 7)
+    roughness = storage.Column("records", 7)
+
+    t = storage.Column("state", 0)
+    center_of_motion = storage.Column("state", 1, 4)
+    axis = storage.Column("state", 4, 7)
+    radius_of_motion = storage.Column("state", 7)
+    velocity = storage.Column("state", 8)
+
     def __init__(self, center, radius, color, roughness, axis, radius_of_motion, velocity):
         """
             Create a new sphere
@@ -15,17 +36,31 @@ class Sphere:
                 color (array [3,1])
         """
 
-        self.center = np.array(center,dtype=np.float32)
+        self.index = self.store.allocate(self)
+        self.center = center
         self.radius = radius
-        self.color = np.array(color, dtype=np.float32)
+        self.color = color
         self.roughness = roughness
         self.t = 0
-        self.center_of_motion = np.array(center, dtype=np.float32)
-        self.axis = np.array(axis, dtype=np.float32)
+        self.center_of_motion = center
+        self.axis = axis
         self.radius_of_motion = radius_of_motion
         self.velocity = velocity
     
+    def destroy(self):
+        """
+            Give the sphere's row back to SPHERES, the sphere can't be used after.
+        """
+
+        index = getattr(self, "index", None)
+        if index is not None:
+            del self.index
+            self.store.release(index, self)
+
+    def __del__(self):
+
+        self.destroy()
+    
     def update(self, rate):
 
-        self.t += rate
-        self.center = self.center_of_motion + self.radius_of_motion * self.axis * np.sin(self.velocity * self.t)
\ No newline at end of file
+        animation.animate(self.store, np.array([self.index]), rate)
@@ -0,0 +1,188 @@
+"""
+    Structure of arrays storage for scene objects.
+
+    Every object of a kind lives in one row of its Store: the 20 float
+    objectData record the ray tracer reads, plus a row of extra state
+    (animation parameters) that never reaches the GPU.
+    Objects only remember their row, attributes are Column descriptors
+    reading and writing slices of the store, so packing objectData is
+    a single gather from Store.records.
+    Rows are given back with the object's destroy(), or when an object
+    nobody destroyed is collected, and only by the object holding them,
+    so a row viewed twice or released twice is never handed out twice.
+"""
+
+from config import *
+
+RECORD_SIZE = 20
+
+class Column:
+    """
+        Object attribute kept in a slice of its store's rows.
+    """
+
+    def __init__(self, array, start, stop = None):
+        """
+            Parameters:
+                array (str): "records" or "state"
+                start (int): first column
+                stop (int): one past the last column, or None for a scalar
+        """
+
+        self.array = array
+        self.start = start
+        self.stop = stop
+
+    def __get__(self, _object, owner):
+
+        if _object is None:
+            return self
+
+        data = getattr(_object.store, self.array)
+        if self.stop is None:
+            return data[_object.index, self.start]
+        return data[_object.index, self.start : self.stop]
+
+    def __set__(self, _object, value):
+
+        data = getattr(_object.store, self.array)
+        if self.stop is None:
+            data[_object.index, self.start] = value
+        else:
+            data[_object.index, self.start : self.stop] = value
+
+class Store:
+    """
+        Growable rows for one kind of scene object.
+    """
+
+    def __init__(self, stateSize = 0, capacity = 64):
+        """
+            Parameters:
+                stateSize (int): extra float64 columns per object
+                capacity (int): rows to allocate up front
+        """
+
+        self.records = np.zeros((capacity, RECORD_SIZE), dtype=np.float32)
+        self.state = np.zeros((capacity, stateSize), dtype=np.float64)
+        self.count = 0
+        self.free = []
+        #row: id of the object holding it
+        self.owners = {}
+
+    def allocate(self, owner):
+        """
+            Claim a zeroed row, growing the arrays if they are full.
+
+                Parameters:
+                    owner (object): the object the row belongs to
+
+                Returns:
+                    index of the row
+        """
+
+        if len(self.free) > 0:
+            index = self.free.pop()
+            self.records[index] = 0
+            self.state[index] = 0
+        else:
+            if self.count == len(self.records):
+                self.grow(self.count + 1)
+            self.count += 1
+            index = self.count - 1
+
+        self.owners[index] = id(owner)
+        return index
+
+    def extend(self, records, state = None):
+        """
+            Append a block of rows at once, owned by nothing until
+        views() makes objects for them.
+
+                Parameters:
+                    records (np.ndarray (n, RECORD_SIZE)): their records
+                    state (np.ndarray (n, stateSize)): their state, zero if None
+
+                Returns:
+                    indices of the new rows
+        """
+
+        first = self.count
+        count = len(records)
+        if first + count > len(self.records):
+            self.grow(first + count)
+
+        self.records[first : first + count] = records
+        if state is not None:
+            self.state[first : first + count] = state
+        self.count += count
+
+        return np.arange(first, first + count)
+
+    def grow(self, rows):
+        """
+            Double the capacity until it holds the given number of rows.
+        """
+
+        capacity = max(1, len(self.records))
+        while capacity < rows:
+            capacity *= 2
+
+        records = np.zeros((capacity, RECORD_SIZE), dtype=np.float32)
+        records[:len(self.records)] = self.records
+        state = np.zeros((capacity, self.state.shape[1]), dtype=np.float64)
+        state[:len(self.state)] = self.state
+        self.records = records
+        self.state = state
+
+    def claim(self, index, owner):
+        """
+            Hand a row over to owner, who is then the one to release it.
+        """
+
+        self.owners[index] = id(owner)
+
+    def release(self, index, owner):
+        """
+            Free a row for reuse if owner holds it. A row released
+            already, or one owner only views, is left alone.
+
+                Returns:
+                    whether the row was freed
+        """
+
+        if self.owners.get(index) != id(owner):
+            return False
+
+        del self.owners[index]
+        self.free.append(index)
+        return True
+
+    def gather(self, objects):
+        """
+            Records of the given objects, in order.
+
+                Returns:
+                    np.ndarray (len(objects), RECORD_SIZE)
+        """
+
+        indices = np.fromiter(
+            (_object.index for _object in objects), dtype=np.int64, count = len(objects)
+        )
+        return self.records[indices]
+
+def views(cls, indices):
+    """
+        Objects of a stored class (sphere.Sphere, plane.Plane, light.Light)
+        for rows that already hold their data, skipping __init__.
+        The new objects own their rows.
+    """
+
+    objects = []
+    for index in indices.tolist():
+        _object = cls.__new__(cls)
+        _object.index = index
+        cls.store.claim(index, _object)
+        objects.append(_object)
+
+    return objects
@@ -0,0 +1,48 @@
+"""
+    A damaged level file is rebuilt rather than loaded, and a write that
+    is interrupted leaves no file behind.
+
+    Run from the repository root: python -m pytest tests
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+import level_cache
+import plane
+import scene
+
+def room_planes(level):
+
+    return [plane.PLANES.gather(_room.planes).tolist() for _room in level.rooms]
+
+@pytest.mark.parametrize("keep", (0.5, 0.99))
+def test_truncated_level_is_rebuilt(tmp_path, keep):
+
+    built = scene.Scene(cache_dir = str(tmp_path))
+    path = built.get_cache_path("level")
+    size = os.path.getsize(path)
+    with open(path, "r+b") as file:
+        file.truncate(int(size * keep))
+
+    assert level_cache.read(path) is None
+    rebuilt = scene.Scene(cache_dir = str(tmp_path))
+    assert room_planes(rebuilt) == room_planes(built)
+    assert os.path.getsize(path) == size
+    built.destroy()
+    rebuilt.destroy()
+
+def test_interrupted_write_leaves_nothing(tmp_path, monkeypatch):
+
+    def interrupt(source, destination):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(level_cache.os, "replace", interrupt)
+    path = str(tmp_path / "interrupted.level")
+    with pytest.raises(KeyboardInterrupt):
+        level_cache.write(path, {"kind": "level"}, {"planes": np.zeros((4, 20), dtype=np.float32)})
+    assert os.listdir(tmp_path) == []
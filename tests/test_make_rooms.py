@@ -0,0 +1,161 @@
+"""
+    geometry.make_rooms against a frozen copy of the implementation it
+    replaced, which popped doors from its history while enumerating it.
+    forget_doors keeps that quirk, so rooms, their doors and the door
+    planes must come out exactly as the old search built them.
+
+    Run from the repository root: python -m pytest tests
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import pytest
+
+import geometry
+import door
+import room
+import scene
+
+def old_make_rooms(walls, doors, rooms):
+    """
+        make_rooms as it was before rooms were partitioned with sets.
+    """
+
+    coordinates_to_expand = []
+    expanded_coordinates = []
+    empty_blocks = (0, "d")
+
+    starting_coordinate = old_get_new_room(walls, expanded_coordinates)
+
+    while starting_coordinate is not None:
+        coordinates_to_expand.append(starting_coordinate)
+        for i,coordinate in enumerate(expanded_coordinates):
+            row, col = coordinate
+            if walls[row][col] == "d":
+                expanded_coordinates.pop(i)
+        newRoom = room.Room()
+
+        while len(coordinates_to_expand) > 0:
+
+            searched_coordinate = coordinates_to_expand.pop(0)
+            if searched_coordinate in expanded_coordinates:
+                continue
+            expanded_coordinates.append(searched_coordinate)
+            neighbors = geometry.expand(walls, searched_coordinate, expanded_coordinates)
+
+            for coordinate in neighbors:
+                row,col = coordinate
+                if walls[row][col] in empty_blocks:
+
+                    if coordinate not in expanded_coordinates:
+                        coordinates_to_expand.append(coordinate)
+
+                    if walls[row][col] == "d":
+                        alreadyExists = False
+                        for _door in doors:
+                            if coordinate == _door.coordinate:
+                                alreadyExists = True
+
+                        if not alreadyExists:
+                            newDoor = door.Door(coordinate)
+                            geometry.make_north_wall(row, col, 7, newDoor)
+                            geometry.make_east_wall(row, col, 7, newDoor)
+                            geometry.make_south_wall(row, col, 7, newDoor)
+                            geometry.make_west_wall(row, col, 7, newDoor)
+                            geometry.make_ceiling(row, col, 7, newDoor)
+                            geometry.make_floor(row, col, 7, newDoor)
+                            if walls[row+1][col] not in empty_blocks:
+                                geometry.make_north_wall(row + 1, col, 7, newDoor)
+                                geometry.make_south_wall(row - 1, col, 7, newDoor)
+                            else:
+                                geometry.make_east_wall(row, col - 1, 7,newDoor)
+                                geometry.make_west_wall(row, col + 1, 7,newDoor)
+
+                            doors.append(newDoor)
+                            newRoom.doors.append(newDoor)
+                        else:
+                            newDoor = old_get_door_by_coordinate(doors, coordinate)
+                            newRoom.doors.append(newDoor)
+
+                    if coordinate not in newRoom.internalCoordinates:
+                        newRoom.internalCoordinates.append(coordinate)
+
+                elif coordinate not in newRoom.coordinates:
+                    newRoom.coordinates.append(coordinate)
+
+        rooms.append(newRoom)
+        starting_coordinate = old_get_new_room(walls, expanded_coordinates)
+
+def old_get_new_room(walls, expanded_coordinates):
+
+    rows = len(walls)
+    cols = len(walls[0])
+
+    for row in range(rows):
+        for col in range(cols):
+            if walls[row][col] == 0:
+                possible_solution = (row,col)
+                if possible_solution not in expanded_coordinates:
+                    return possible_solution
+    return None
+
+def old_get_door_by_coordinate(doors, coordinate):
+
+    for _door in doors:
+        if _door.coordinate == coordinate:
+            return _door
+
+def random_map(seed, size = 12):
+    """
+        A walled map of random blocks, with runs of adjacent doors
+        dropped onto interior walls.
+    """
+
+    rng = random.Random(seed)
+    walls = [[1] * size for _ in range(size)]
+    for row in range(1, size - 1):
+        for col in range(1, size - 1):
+            walls[row][col] = 0 if rng.random() < 0.6 else 1
+
+    for _ in range(rng.randint(2, 6)):
+        row, col = rng.randint(2, size - 3), rng.randint(2, size - 3)
+        dRow, dCol = rng.choice(((0, 1), (1, 0)))
+        for _ in range(rng.randint(1, 3)):
+            if 1 < row < size - 2 and 1 < col < size - 2:
+                walls[row][col] = "d"
+            row, col = row + dRow, col + dCol
+
+    return walls
+
+def partition(make, walls):
+    """
+        Returns:
+            (rooms, doors) as plain data: per room its coordinates, internal
+            coordinates and door coordinates, per door its plane records
+    """
+
+    doors = []
+    rooms = []
+    make(walls, doors, rooms)
+
+    return (
+        [(_room.coordinates, _room.internalCoordinates, [_door.coordinate for _door in _room.doors])
+            for _room in rooms],
+        [(_door.coordinate, [_plane.store.records[_plane.index].tolist() for _plane in _door.planes])
+            for _door in doors]
+    )
+
+def test_shipped_map():
+
+    walls = scene.Scene(cache_dir = None).wall_geometry
+    assert any("d" in row for row in walls)
+    assert partition(geometry.make_rooms, walls) == partition(old_make_rooms, walls)
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_maps_with_adjacent_doors(seed):
+
+    walls = random_map(seed)
+    assert partition(geometry.make_rooms, walls) == partition(old_make_rooms, walls)
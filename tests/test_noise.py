@@ -0,0 +1,74 @@
+"""
+    Accumulated frames with low discrepancy noise: every pixel steps
+    through its own rotation of the sequence, so averaging its frames
+    converges faster than averaging white noise.
+
+    Run from the repository root: python -m pytest tests
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+import noise
+import cpu_tracer
+
+WIDTH, HEIGHT = 16, 12
+
+def integrand(offsets):
+
+    x, z = offsets[:, 0], offsets[:, 2]
+    return x + z + x * x
+
+#mean of the integrand over the half ball the unit cube maps to
+EXACT = 0.99 / np.pi + 0.99 ** 2 / 12
+
+def accumulation_error(method, frames, seed = 1):
+    """
+        Returns:
+            RMS error over the pixels of each pixel's running average after each frame
+    """
+
+    texels = noise.generate(WIDTH, HEIGHT, method, seed)
+    height, width = texels.shape[:2]
+    pixel_y, pixel_x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    pixel_x, pixel_y = pixel_x.ravel(), pixel_y.ravel()
+
+    total = np.zeros(len(pixel_x))
+    errors = []
+    for frame in range(frames):
+        offsets = cpu_tracer.noise_sample(
+            texels, pixel_x, pixel_y,
+            noise.frame_offset(frame, width, height, seed, method), noise.frame_point(frame, method)
+        )
+        total += integrand(offsets)
+        errors.append(np.sqrt(np.mean((total / (frame + 1) - EXACT) ** 2)))
+
+    return np.array(errors)
+
+@pytest.mark.parametrize("method", noise.SEQUENCES)
+def test_sequences_converge_faster_than_white(method):
+
+    white = accumulation_error("white", 256)
+    sequence = accumulation_error(method, 256)
+
+    assert sequence[-1] < 0.4 * white[-1]
+    #and the gap keeps growing with more frames
+    assert sequence[-1] / sequence[15] < white[-1] / white[15]
+
+@pytest.mark.parametrize("method", noise.SEQUENCES)
+def test_pixels_start_from_their_own_rotation(method):
+
+    first = accumulation_error(method, 1)
+    white = accumulation_error("white", 1)
+    #a single frame is as good as white noise, neighbours don't share points
+    assert first[0] == pytest.approx(white[0], rel = 0.5)
+
+    texels = noise.generate(WIDTH, HEIGHT, method, 1)
+    for channel in range(3):
+        values = texels[..., channel]
+        across = np.corrcoef(values[:, :-1].ravel(), values[:, 1:].ravel())[0, 1]
+        assert abs(across) < 0.1
@@ -0,0 +1,80 @@
+"""
+    Store rows are freed once, by the object holding them, so a row is
+    never handed to two live objects.
+
+    Run from the repository root: python -m pytest tests
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gc
+import numpy as np
+import pytest
+
+import storage
+import plane
+import sphere
+import light
+import scene
+
+def make_sphere():
+
+    return sphere.Sphere(
+        center = (1, 2, 3), radius = 0.5, color = (1, 0, 0), roughness = 0,
+        axis = (0, 0, 1), radius_of_motion = 0, velocity = 0
+    )
+
+def test_destroy_twice_frees_once():
+
+    _sphere = make_sphere()
+    index = _sphere.index
+    _sphere.destroy()
+    _sphere.destroy()
+    assert sphere.SPHERES.free.count(index) == 1
+
+    first, second = make_sphere(), make_sphere()
+    assert first.index != second.index
+    first.destroy()
+    second.destroy()
+
+def test_second_view_does_not_free():
+
+    store = plane.PLANES
+    indices = store.extend(np.ones((2, storage.RECORD_SIZE), dtype=np.float32))
+    stale = storage.views(plane.Plane, indices)
+    owners = storage.views(plane.Plane, indices)
+
+    for _plane in stale:
+        _plane.destroy()
+    assert not set(indices.tolist()) & set(store.free)
+
+    for _plane in owners:
+        _plane.destroy()
+    assert set(indices.tolist()) <= set(store.free)
+
+def test_failed_init_leaves_store_alone(recwarn):
+
+    free = list(sphere.SPHERES.free)
+    with pytest.raises(TypeError):
+        sphere.Sphere(center = (0, 0, 0))
+    gc.collect()
+    assert sphere.SPHERES.free == free
+    assert len(recwarn) == 0
+
+def test_scene_destroy_frees_its_rows():
+
+    level = scene.Scene(merge_faces = True, cache_dir = None)
+    rows = {store: set() for store in (plane.PLANES, sphere.SPHERES, light.LIGHTS)}
+    for _room in level.rooms:
+        for _object in _room.planes + _room.spheres + _room.lights:
+            rows[_object.store].add(_object.index)
+    for _door in level.doors:
+        rows[plane.PLANES].update(_plane.index for _plane in _door.planes)
+    level.destroy()
+
+    for store, held in rows.items():
+        assert len(held) > 0
+        assert held <= set(store.free)
+        assert not held & set(store.owners)